@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-16 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream_handler', '0014_streamsubscription_target_timestamp_ms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streamsubscription',
+            name='region_of_interest',
+            field=models.TextField(blank=True, help_text='JSON region of the frame to recognize objects in, whole frame if empty', null=True),
+        ),
+    ]
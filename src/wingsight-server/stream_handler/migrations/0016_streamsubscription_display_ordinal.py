@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-16 11:03
+
+from django.db import migrations, models
+
+
+def assign_display_ordinals(apps, schema_editor):
+    """
+    Number each user's existing subscriptions by creation, deleted ones included.
+    """
+
+    StreamSubscription = apps.get_model('stream_handler', 'StreamSubscription')
+
+    ordinals = {}
+    for stream_subscription in StreamSubscription.objects.order_by('user_id', 'created_at', 'id'):
+        ordinals[stream_subscription.user_id] = ordinals.get(stream_subscription.user_id, 0) + 1
+        stream_subscription.display_ordinal = ordinals[stream_subscription.user_id]
+        stream_subscription.save(update_fields=['display_ordinal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream_handler', '0015_streamsubscription_region_of_interest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streamsubscription',
+            name='display_ordinal',
+            field=models.IntegerField(blank=True, help_text="Position among the user's subscriptions by creation, shown as 'Stream #N'", null=True),
+        ),
+        migrations.RunPython(assign_display_ordinals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-16 12:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream_handler', '0016_streamsubscription_display_ordinal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamLease',
+            fields=[
+                ('stream_subscription', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lease', serialize=False, to='stream_handler.streamsubscription')),
+                ('owner', models.CharField(help_text='ID of the stream processor instance', max_length=255)),
+                ('acquired_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'stream_lease',
+            },
+        ),
+    ]
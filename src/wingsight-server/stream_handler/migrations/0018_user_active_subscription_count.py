@@ -0,0 +1,46 @@
+# Generated by Django 5.1.6 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def renumber_active_subscriptions(apps, schema_editor):
+    """
+    Number each user's active subscriptions by creation and store how many there are, like
+    User.renumber_subscriptions().
+    """
+
+    User = apps.get_model('stream_handler', 'User')
+    StreamSubscription = apps.get_model('stream_handler', 'StreamSubscription')
+
+    counts = {}
+    for stream_subscription in StreamSubscription.objects.order_by('user_id', 'created_at', 'id'):
+        if stream_subscription.is_active and not stream_subscription.is_deleted:
+            counts[stream_subscription.user_id] = counts.get(stream_subscription.user_id, 0) + 1
+            stream_subscription.display_ordinal = counts[stream_subscription.user_id]
+        else:
+            stream_subscription.display_ordinal = None
+        stream_subscription.save(update_fields=['display_ordinal'])
+
+    for user_id, count in counts.items():
+        User.objects.filter(id=user_id).update(active_subscription_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream_handler', '0017_streamlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='active_subscription_count',
+            field=models.IntegerField(default=0, help_text='Number of active subscriptions, kept up to date by renumber_subscriptions()'),
+        ),
+        migrations.AlterField(
+            model_name='streamsubscription',
+            name='display_ordinal',
+            field=models.IntegerField(blank=True, help_text="Position among the user's active subscriptions by creation, shown as 'Stream #N'", null=True),
+        ),
+        migrations.RunPython(renumber_active_subscriptions, migrations.RunPython.noop),
+    ]
@@ -5,12 +5,13 @@ import logging
 import numpy as np
 import json
 
-from django.db import models
+from django.db import models, transaction
 from django.db.utils import DatabaseError
 from django.utils import timezone
 from django.conf import settings
 
 from stream_handler.utils import queue_events
+from stream_handler.utils.region_of_interest import validate_region_of_interest
 
 from .custom_exceptions import SubscriptionAlreadyExists
 import boto3
@@ -28,6 +29,9 @@ class User(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_sns_subscribed = models.BooleanField(default=False)
     sns_topic_arn = models.CharField(max_length=255, blank=True, null=True)  # New field
+    active_subscription_count = models.IntegerField(
+        default=0, help_text="Number of active subscriptions, kept up to date by renumber_subscriptions()"
+    )
 
     def create_sns_topic(self):
         """Create a personal SNS topic for this user."""
@@ -61,17 +65,47 @@ class User(models.Model):
         :return: StreamSubscription object if created, else raises an exception
         """
 
-        stream_subscription = StreamSubscription.objects.create(
-            user=self,
-            url=url,
-            frame_fetch_frequency=frame_fetch_frequency,
-            provide_notification=provide_notification 
-        )
+        with transaction.atomic():
+            # lock the user so concurrent subscriptions don't get the same ordinal
+            User.objects.select_for_update().get(id=self.id)
+
+            stream_subscription = StreamSubscription.objects.create(
+                user=self,
+                url=url,
+                frame_fetch_frequency=frame_fetch_frequency,
+                provide_notification=provide_notification
+            )
+            self.renumber_subscriptions()
+
+        stream_subscription.refresh_from_db(fields=["display_ordinal"])
 
         queue_events.publish_stream_event(stream_subscription.id)
 
         return stream_subscription
 
+    def renumber_subscriptions(self):
+        """
+        Number the active subscriptions 1..N by creation and store N, so notifications tell streams apart without
+        querying. Inactive and deleted subscriptions have no ordinal. Must run in a transaction holding the user's
+        row lock.
+        """
+
+        active_subscriptions = list(
+            self.subscriptions.filter(is_active=True, is_deleted=False).order_by("created_at", "id")
+        )
+
+        for display_ordinal, stream_subscription in enumerate(active_subscriptions, start=1):
+            if stream_subscription.display_ordinal != display_ordinal:
+                stream_subscription.display_ordinal = display_ordinal
+                stream_subscription.save(update_fields=["display_ordinal"])
+
+        self.subscriptions.exclude(
+            id__in=[stream_subscription.id for stream_subscription in active_subscriptions]
+        ).exclude(display_ordinal=None).update(display_ordinal=None)
+
+        self.active_subscription_count = len(active_subscriptions)
+        self.save(update_fields=["active_subscription_count"])
+
     def get_all_stream_subscriptions(self):
         """
         Get all user's streams.
@@ -101,17 +135,53 @@ class StreamSubscription(models.Model):
         null=True, blank=True, help_text="Can be used for messages from stream parsing backend"
     )
     target_timestamp_ms = models.IntegerField(default=1)
+    region_of_interest = models.TextField(
+        null=True, blank=True, help_text="JSON region of the frame to recognize objects in, whole frame if empty"
+    )
+    display_ordinal = models.IntegerField(
+        null=True, blank=True,
+        help_text="Position among the user's active subscriptions by creation, shown as 'Stream #N'"
+    )
 
     class Meta:
         db_table = "stream_subscription"
 
+    def set_region_of_interest(self, region_of_interest):
+        """
+        Limit recognition to a part of the frame.
+        :param region_of_interest: normalized rectangle or polygon dict, None to use the whole frame
+        :raises ValueError: if the region is malformed
+        """
+
+        if region_of_interest is not None:
+            region_of_interest = json.dumps(validate_region_of_interest(region_of_interest))
+
+        self.region_of_interest = region_of_interest
+        self.save(update_fields=["region_of_interest"])
+
+        queue_events.publish_control_event(self.id, "update", region_of_interest=region_of_interest)
+
+    def _save_and_renumber(self):
+        """
+        Save an activation change and renumber the user's active subscriptions, which this one joined or left.
+        """
+
+        with transaction.atomic():
+            user = User.objects.select_for_update().get(id=self.user_id)
+            self.save()
+            user.renumber_subscriptions()
+
+        self.refresh_from_db(fields=["display_ordinal"])
+
     def deactivate(self):
         """
         Deactivate this subscription. Will kill the thread, stop recognizing objects and provoking notifications.
         """
 
         self.is_active = False
-        self.save()
+        self._save_and_renumber()
+
+        queue_events.publish_control_event(self.id, "deactivate")
 
     def reactivate(self):
         """
@@ -119,8 +189,9 @@ class StreamSubscription(models.Model):
         """
 
         self.is_active = True
-        self.save()
+        self._save_and_renumber()
 
+        queue_events.publish_control_event(self.id, "reactivate")
         queue_events.publish_stream_event(self.id)
 
     def delete_subscription(self):
@@ -130,7 +201,26 @@ class StreamSubscription(models.Model):
 
         self.is_active = False
         self.is_deleted = True
-        self.save()
+        self._save_and_renumber()
+
+        queue_events.publish_control_event(self.id, "delete")
+
+
+class StreamLease(models.Model):
+    """
+    Which stream processor instance runs a subscription. Kept alive by the owner's heartbeats; an expired lease is
+    reclaimed by another instance. Written by the stream processors only.
+    """
+
+    stream_subscription = models.OneToOneField(
+        StreamSubscription, on_delete=models.CASCADE, primary_key=True, related_name='lease'
+    )
+    owner = models.CharField(max_length=255, help_text="ID of the stream processor instance")
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "stream_lease"
 
 
 class RecognitionEntry(models.Model):
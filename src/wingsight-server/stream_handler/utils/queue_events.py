@@ -47,3 +47,37 @@ def publish_stream_event(subscription_id):
     logging.info(f"Django sent new subscription with id: {subscription_id} to RabbitMQ host: {MQ_HOST}")
 
     connection.close()
+
+
+CONTROL_EXCHANGE_NAME = os.getenv("CONTROL_EXCHANGE_NAME", "stream_control")
+
+
+def publish_control_event(subscription_id, action, **changes):
+    """
+    Tell all stream processors about a change of a running StreamSubscription.
+
+    Best effort: processors also reconcile with the DB periodically, so a lost event only delays the change.
+
+    :param subscription_id: ID of the subscription
+    :param action: "deactivate", "reactivate", "delete" or "update"
+    :param changes: changed subscription fields, e.g. target_bird_species="[...]"
+    """
+
+    message = json.dumps({"subscription_id": str(subscription_id), "action": action, "changes": changes})
+
+    try:
+        connection = pika.BlockingConnection(pika.ConnectionParameters(MQ_HOST, credentials=credentials))
+
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=CONTROL_EXCHANGE_NAME, exchange_type="fanout")
+            channel.basic_publish(exchange=CONTROL_EXCHANGE_NAME, routing_key="", body=message)
+
+        finally:
+            connection.close()
+
+    except Exception as e:
+        logging.error(f"Could not publish {action} control event for subscription {subscription_id}: {e}")
+        return
+
+    logging.info(f"Django sent {action} control event for subscription {subscription_id} to RabbitMQ host: {MQ_HOST}")
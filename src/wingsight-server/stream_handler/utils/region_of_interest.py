@@ -0,0 +1,48 @@
+def validate_region_of_interest(region_of_interest):
+    """
+    Check a region of interest before it is stored on a StreamSubscription.
+
+    Coordinates are normalized to 0-1, either a rectangle
+        {"type": "rect", "x": 0.25, "y": 0.1, "width": 0.5, "height": 0.6}
+    or a polygon of at least 3 points
+        {"type": "polygon", "points": [[0.2, 0.1], [0.8, 0.2], [0.5, 0.9]]}
+
+    :param region_of_interest: region of interest dict
+    :return: the region with only the known keys
+    :raises ValueError: if the region is malformed
+    """
+
+    if not isinstance(region_of_interest, dict):
+        raise ValueError("region_of_interest must be an object")
+
+    region_type = region_of_interest.get("type")
+
+    try:
+        if region_type == "rect":
+            region = {
+                "type": "rect",
+                **{key: float(region_of_interest[key]) for key in ("x", "y", "width", "height")}
+            }
+            points = [
+                (region["x"], region["y"]),
+                (region["x"] + region["width"], region["y"] + region["height"])
+            ]
+            if region["width"] <= 0 or region["height"] <= 0:
+                raise ValueError("width and height must be positive")
+
+        elif region_type == "polygon":
+            points = [(float(x), float(y)) for x, y in region_of_interest["points"]]
+            if len(points) < 3:
+                raise ValueError("polygon needs at least 3 points")
+            region = {"type": "polygon", "points": [list(point) for point in points]}
+
+        else:
+            raise ValueError("type must be 'rect' or 'polygon'")
+
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"malformed {region_type} region: {e}")
+
+    if not all(0 <= coordinate <= 1 for point in points for coordinate in point):
+        raise ValueError("coordinates must be normalized to 0-1")
+
+    return region
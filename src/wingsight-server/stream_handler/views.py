@@ -17,6 +17,7 @@ from .serializers import StreamSubscriptionSerializer
 from .models import User, StreamSubscription, RecognitionEntry
 from .serializers import StreamSubscriptionSerializer, RecognitionEntrySerializer
 from .custom_exceptions import SubscriptionAlreadyExists, MessageBrokerNotAvailable
+from .utils import queue_events
 
 
 logger = logging.getLogger(__name__)
@@ -845,6 +846,10 @@ class UpdateStreamSubscriptionTargetSpeciesView(views.APIView):
                 stream_subscription.target_bird_species = json_species
                 stream_subscription.save(update_fields=["target_bird_species"])
                 logging.info(f"Saved subscription with new target species")
+
+            queue_events.publish_control_event(
+                stream_subscription.id, "update", target_bird_species=json_species
+            )
             
             # Verify the update by getting a fresh instance
             fresh_subscription = StreamSubscription.objects.get(id=stream_subscription_id)
@@ -882,3 +887,83 @@ class UpdateStreamSubscriptionTargetSpeciesView(views.APIView):
                 data={"status": "error", "message": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class UpdateStreamSubscriptionRegionOfInterestView(views.APIView):
+    """
+    Update the region of interest of a stream subscription.
+    """
+
+    @swagger_auto_schema(
+        operation_summary="Limit recognition to a part of the stream's frame. Coordinates are normalized to 0-1; "
+                          "send null region_of_interest to use the whole frame again.",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=["user_id", "stream_subscription_id", "region_of_interest"],
+            properties={
+                "user_id": openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description="The ID of the user",
+                    default="29e27fff-b9b0-4b90-aac7-48cadb8b2387"
+                ),
+                "stream_subscription_id": openapi.Schema(
+                    type=openapi.TYPE_INTEGER,
+                    format=openapi.FORMAT_INT32,
+                    description="StreamSubscription ID (int)"
+                ),
+                "region_of_interest": openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    x_nullable=True,
+                    description="Rectangle {'type': 'rect', 'x': 0.25, 'y': 0.1, 'width': 0.5, 'height': 0.6} or "
+                                "polygon {'type': 'polygon', 'points': [[0.2, 0.1], [0.8, 0.2], [0.5, 0.9]]}"
+                ),
+            },
+        ),
+        responses={
+            200: openapi.Response(description="Region of interest updated successfully"),
+            400: openapi.Response(description="Invalid request"),
+            404: openapi.Response(description="User or subscription not found"),
+        },
+    )
+    def post(self, request, *args, **kwargs):
+        user_id = request.data.get("user_id")
+        stream_subscription_id = request.data.get("stream_subscription_id")
+
+        if not all([user_id, stream_subscription_id]) or "region_of_interest" not in request.data:
+            return Response(
+                data={
+                    "status": "error",
+                    "message": {
+                        "error_description": "Missing required body params"
+                    }
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user = get_object_or_404(User, id=user_id)
+        stream_subscription = get_object_or_404(StreamSubscription, user=user, id=stream_subscription_id)
+
+        try:
+            stream_subscription.set_region_of_interest(request.data.get("region_of_interest"))
+
+        except ValueError as e:
+            return Response(
+                data={
+                    "status": "error",
+                    "message": {
+                        "error_description": f"Invalid region_of_interest: {e}"
+                    }
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            data={
+                "status": "updated",
+                "message": {
+                    "subscription_id": stream_subscription.id,
+                    "region_of_interest": request.data.get("region_of_interest")
+                }
+            },
+            status=status.HTTP_200_OK
+        )
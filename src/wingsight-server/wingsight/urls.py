@@ -31,6 +31,7 @@ from stream_handler.views import DeleteStreamSubscriptionView
 from stream_handler.views import ManageSNSSubscriptionView
 from stream_handler.views import GetAllStreamSubscriptionRecognitionEntriesView
 from stream_handler.views import UpdateStreamSubscriptionTargetSpeciesView
+from stream_handler.views import UpdateStreamSubscriptionRegionOfInterestView
 
 
 # swagger
@@ -62,6 +63,7 @@ urlpatterns = [
 
     path('v1/get_all_stream_subscription_recognitions', GetAllStreamSubscriptionRecognitionEntriesView.as_view(), name='get_all_stream_subscription_recognitions'),
     path('v1/update_target_species', UpdateStreamSubscriptionTargetSpeciesView.as_view(), name='update_target_species'),
+    path('v1/update_region_of_interest', UpdateStreamSubscriptionRegionOfInterestView.as_view(), name='update_region_of_interest'),
     # New SNS endpoints
     path('v1/manage_subscription', ManageSNSSubscriptionView.as_view(), name='manage_subscription'),
     path('v1/toggle_stream_notification', ToggleStreamNotificationView.as_view(), name='toggle_stream_notification'),
@@ -0,0 +1,123 @@
+"""
+Compares Rekognition labels of stored frames sent at several payload sizes against the full-resolution frames.
+
+Usage:
+    python src/benchmark_payload_sizes.py <frames_dir> [--long-edges 640,960,1280] [--byte-budget 307200]
+
+For every long edge it reports the mean payload size and latency, how often the primary species matches the one
+found at full resolution and the mean overlap (Jaccard index) of the bird label sets.
+"""
+import argparse
+import logging
+import os
+import time
+
+import cv2
+
+from utils.payload_planner import PayloadPlanner, REKOGNITION_MAX_INLINE_BYTES
+from utils.rekognition_client import RekognitionClient, is_bird_label, summarize_bird_labels
+
+from config import AWS_REGION, REKOGNITION_JPEG_QUALITY, REKOGNITION_PAYLOAD_BYTE_BUDGET
+
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_frames(frames_dir):
+    frames = []
+    for file_name in sorted(os.listdir(frames_dir)):
+        if not file_name.lower().endswith(FRAME_EXTENSIONS):
+            continue
+
+        frame = cv2.imread(os.path.join(frames_dir, file_name))
+        if frame is None:
+            logging.warning(f"Skipping unreadable frame {file_name}")
+            continue
+
+        frames.append((file_name, frame))
+
+    return frames
+
+
+def detect(client, payload):
+    started_at = time.monotonic()
+    response = client.rekognition.detect_labels(
+        Image={'Bytes': payload}, MaxLabels=50, MinConfidence=client.min_confidence
+    )
+    latency_s = time.monotonic() - started_at
+
+    labels = response['Labels']
+    bird_labels = {label['Name'] for label in labels if is_bird_label(label['Name'])}
+
+    return summarize_bird_labels(labels).get("primary_species"), bird_labels, latency_s
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+
+    return len(a & b) / len(a | b)
+
+
+def run_benchmark(frames, long_edges, byte_budget):
+    client = RekognitionClient(region_name=AWS_REGION)
+
+    # full resolution at the highest quality that fits the inline limit is the reference
+    reference_planner = PayloadPlanner(target_long_edge=0, byte_budget=REKOGNITION_MAX_INLINE_BYTES)
+    references = {}
+    for file_name, frame in frames:
+        primary_species, bird_labels, _ = detect(client, reference_planner.plan(frame))
+        references[file_name] = (primary_species, bird_labels)
+
+    results = []
+    for long_edge in long_edges:
+        planner = PayloadPlanner(
+            target_long_edge=long_edge, byte_budget=byte_budget, max_quality=REKOGNITION_JPEG_QUALITY
+        )
+
+        payload_bytes, latencies_s, primary_matches, overlaps = [], [], 0, []
+        for file_name, frame in frames:
+            payload = planner.plan(frame)
+            primary_species, bird_labels, latency_s = detect(client, payload)
+
+            reference_species, reference_labels = references[file_name]
+            payload_bytes.append(len(payload))
+            latencies_s.append(latency_s)
+            primary_matches += primary_species == reference_species
+            overlaps.append(jaccard(bird_labels, reference_labels))
+
+        results.append({
+            "long_edge": long_edge,
+            "mean_bytes": sum(payload_bytes) // len(frames),
+            "mean_latency_s": sum(latencies_s) / len(frames),
+            "primary_agreement": primary_matches / len(frames),
+            "label_overlap": sum(overlaps) / len(frames),
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Rekognition label agreement across payload sizes")
+    parser.add_argument("frames_dir", help="directory with stored frames (.jpg/.png)")
+    parser.add_argument("--long-edges", default="480,640,960,1280", help="comma-separated long edges to compare")
+    parser.add_argument("--byte-budget", type=int, default=REKOGNITION_PAYLOAD_BYTE_BUDGET)
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames_dir)
+    if not frames:
+        raise SystemExit(f"No frames found in {args.frames_dir}")
+
+    long_edges = [int(long_edge) for long_edge in args.long_edges.split(",")]
+    results = run_benchmark(frames, long_edges, args.byte_budget)
+
+    print(f"{len(frames)} frames, byte budget {args.byte_budget}")
+    print(f"{'long edge':>10} {'mean bytes':>11} {'latency s':>10} {'primary agr':>12} {'label overlap':>14}")
+    for result in results:
+        print(
+            f"{result['long_edge']:>10} {result['mean_bytes']:>11} {result['mean_latency_s']:>10.3f} "
+            f"{result['primary_agreement']:>12.2%} {result['label_overlap']:>14.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
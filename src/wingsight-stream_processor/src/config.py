@@ -1,4 +1,6 @@
 import os
+import json
+import tempfile
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -29,3 +31,189 @@ LOG_LEVEL = os.getenv("LOG_LEVEL")
 AWS_REGION = os.getenv("AWS_REGION")
 SNS_TOPIC_ARN = os.getenv("SNS_TOPIC_ARN")
 API_URL = os.getenv("API_URL") # API Gateway URL 4 audio lambda
+
+# re-resolve signed stream URLs this many seconds before their `expire` timestamp
+CAPTURE_URL_EXPIRY_MARGIN_S = int(os.getenv("CAPTURE_URL_EXPIRY_MARGIN_S", 300))
+
+# resolved stream URLs are shared between threads and processes through this SQLite file
+STREAM_URL_CACHE_PATH = os.getenv(
+    "STREAM_URL_CACHE_PATH", os.path.join(tempfile.gettempdir(), "wingsight_stream_url_cache.sqlite3")
+)
+# lifetime of resolved URLs that don't carry an expiry param
+STREAM_URL_CACHE_DEFAULT_TTL_S = int(os.getenv("STREAM_URL_CACHE_DEFAULT_TTL_S", 3600))
+YT_DLP_TIMEOUT_S = int(os.getenv("YT_DLP_TIMEOUT_S", 60))
+
+# subscriptions of the same source reuse a frame read less than this many seconds ago
+SHARED_FRAME_MAX_AGE_S = float(os.getenv("SHARED_FRAME_MAX_AGE_S", 1.0))
+
+# how frames are taken from the stream: "capture" (seek + read per sample), "grabber" (background grab at
+# live edge) or "ffmpeg" (long-lived ffmpeg process sampling and scaling frames)
+FRAME_SOURCE_MODE = os.getenv("FRAME_SOURCE_MODE", "capture")
+# grabber mode reports a read failure if no frame could be grabbed for this long
+GRABBER_STALE_AFTER_S = float(os.getenv("GRABBER_STALE_AFTER_S", 10))
+GRABBER_REOPEN_BACKOFF_S = float(os.getenv("GRABBER_REOPEN_BACKOFF_S", 5))
+
+# "ffmpeg" frame source mode: ffmpeg samples one frame per fetch interval of the stream's subscriptions (this period
+# until it is known) and scales it to this long edge
+FFMPEG_SAMPLE_PERIOD_S = float(os.getenv("FFMPEG_SAMPLE_PERIOD_S", 1))
+FFMPEG_FRAME_LONG_EDGE = int(os.getenv("FFMPEG_FRAME_LONG_EDGE", 1280))
+FFMPEG_READ_TIMEOUT_S = float(os.getenv("FFMPEG_READ_TIMEOUT_S", 30))
+
+# thread pools shared by all subscriptions of the instance
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 8))
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", 8))
+# starting subscriptions and reopening streams (yt-dlp, capture open) has its own pool, so it never holds fetch slots
+OPEN_WORKERS = int(os.getenv("OPEN_WORKERS", 4))
+# a stream whose reopen failed is retried after this delay, doubled with every further failure
+REOPEN_BACKOFF_BASE_S = float(os.getenv("REOPEN_BACKOFF_BASE_S", 5))
+REOPEN_BACKOFF_MAX_S = float(os.getenv("REOPEN_BACKOFF_MAX_S", 300))
+
+# where frames are analyzed: "thread" (process pool threads) or "process" (analysis processes fed via shared memory)
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "thread")
+ANALYSIS_PROCESSES = int(os.getenv("ANALYSIS_PROCESSES", os.cpu_count() or 1))
+FRAME_RING_SLOTS = int(os.getenv("FRAME_RING_SLOTS", 2 * (os.cpu_count() or 1)))
+FRAME_RING_SLOT_BYTES = int(os.getenv("FRAME_RING_SLOT_BYTES", 1920 * 1080 * 3))
+FRAME_RING_FREE_SLOT_TIMEOUT_S = float(os.getenv("FRAME_RING_FREE_SLOT_TIMEOUT_S", 30))
+# a process pool thread waits at most this long for an analysis process to handle its frame
+ANALYSIS_RESULT_TIMEOUT_S = float(os.getenv("ANALYSIS_RESULT_TIMEOUT_S", 60))
+# dead analysis processes are respawned within this interval, failing the frames they had not handled
+ANALYSIS_PROCESS_CHECK_INTERVAL_S = float(os.getenv("ANALYSIS_PROCESS_CHECK_INTERVAL_S", 1))
+
+# skip recognition of frames whose scene didn't change
+MOTION_GATE_ENABLED = os.getenv("MOTION_GATE_ENABLED", "true").lower() == "true"
+# fraction of downscaled pixels that must change for a frame to be recognized
+MOTION_GATE_THRESHOLD = float(os.getenv("MOTION_GATE_THRESHOLD", 0.01))
+# per-subscription thresholds as JSON, e.g. {"12": 0.05}
+MOTION_GATE_THRESHOLD_OVERRIDES = json.loads(os.getenv("MOTION_GATE_THRESHOLD_OVERRIDES", "{}"))
+# grayscale difference (0-255) above which a pixel counts as changed
+MOTION_GATE_PIXEL_DELTA = int(os.getenv("MOTION_GATE_PIXEL_DELTA", 25))
+MOTION_GATE_FRAME_WIDTH = int(os.getenv("MOTION_GATE_FRAME_WIDTH", 160))
+MOTION_GATE_BACKGROUND_ALPHA = float(os.getenv("MOTION_GATE_BACKGROUND_ALPHA", 0.1))
+# recognize a frame at least this often even without motion
+MOTION_GATE_MAX_SKIP_S = float(os.getenv("MOTION_GATE_MAX_SKIP_S", 600))
+MOTION_GATE_STATS_EVERY = int(os.getenv("MOTION_GATE_STATS_EVERY", 100))
+
+# reuse recognition results of near-identical frames (per subscription, keyed by perceptual hash)
+RECOGNITION_CACHE_ENABLED = os.getenv("RECOGNITION_CACHE_ENABLED", "true").lower() == "true"
+RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", 32))
+RECOGNITION_CACHE_TTL_S = float(os.getenv("RECOGNITION_CACHE_TTL_S", 1800))
+# max differing bits of the 64-bit dHash for two frames to share a result
+RECOGNITION_CACHE_MAX_DISTANCE = int(os.getenv("RECOGNITION_CACHE_MAX_DISTANCE", 4))
+
+# which recognizer classifies frames: "rekognition" (AWS API), "local" (cv2.dnn model on the CPU) or "cascade"
+# (local model first, Rekognition for frames the local model is unsure about)
+RECOGNIZER_BACKEND = os.getenv("RECOGNIZER_BACKEND", "rekognition")
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "models/bird_classifier.onnx")
+# class names of the model, one per line in output order
+LOCAL_MODEL_LABELS_PATH = os.getenv("LOCAL_MODEL_LABELS_PATH", "models/bird_classifier_labels.txt")
+LOCAL_MODEL_INPUT_SIZE = int(os.getenv("LOCAL_MODEL_INPUT_SIZE", 224))
+LOCAL_MODEL_SCALE = float(os.getenv("LOCAL_MODEL_SCALE", 1 / 255))
+LOCAL_MODEL_MEAN = tuple(float(value) for value in os.getenv("LOCAL_MODEL_MEAN", "0,0,0").split(","))
+LOCAL_MODEL_MIN_CONFIDENCE = float(os.getenv("LOCAL_MODEL_MIN_CONFIDENCE", 50))
+LOCAL_MODEL_BATCH_SIZE = int(os.getenv("LOCAL_MODEL_BATCH_SIZE", 16))
+LOCAL_MODEL_BATCH_WAIT_MS = float(os.getenv("LOCAL_MODEL_BATCH_WAIT_MS", 50))
+
+# cascade: local bird scores (0-100) in [lower, upper] are escalated to Rekognition
+CASCADE_LOWER_SCORE = float(os.getenv("CASCADE_LOWER_SCORE", 20))
+CASCADE_UPPER_SCORE = float(os.getenv("CASCADE_UPPER_SCORE", 90))
+# also escalate confident positives, for local models that only tell bird from no bird
+CASCADE_ESCALATE_ABOVE_BAND = os.getenv("CASCADE_ESCALATE_ABOVE_BAND", "false").lower() == "true"
+CASCADE_STATS_EVERY = int(os.getenv("CASCADE_STATS_EVERY", 100))
+
+# send frames of several streams to Rekognition as one mosaic image per DetectLabels call
+REKOGNITION_MOSAIC_BATCHING = os.getenv("REKOGNITION_MOSAIC_BATCHING", "false").lower() == "true"
+MOSAIC_MAX_TILES = int(os.getenv("MOSAIC_MAX_TILES", 4))
+MOSAIC_TILE_WIDTH = int(os.getenv("MOSAIC_TILE_WIDTH", 640))
+MOSAIC_TILE_HEIGHT = int(os.getenv("MOSAIC_TILE_HEIGHT", 360))
+MOSAIC_BATCH_WAIT_MS = float(os.getenv("MOSAIC_BATCH_WAIT_MS", 200))
+
+# all Rekognition calls of the process share one dispatcher, rate-limited to the account's TPS quota
+REKOGNITION_TPS = float(os.getenv("REKOGNITION_TPS", 5))
+REKOGNITION_BURST = float(os.getenv("REKOGNITION_BURST", 5))
+REKOGNITION_DISPATCHER_WORKERS = int(os.getenv("REKOGNITION_DISPATCHER_WORKERS", 8))
+REKOGNITION_QUEUE_SIZE = int(os.getenv("REKOGNITION_QUEUE_SIZE", 256))
+REKOGNITION_QUEUE_TIMEOUT_S = float(os.getenv("REKOGNITION_QUEUE_TIMEOUT_S", 30))
+REKOGNITION_MAX_RETRIES = int(os.getenv("REKOGNITION_MAX_RETRIES", 4))
+REKOGNITION_BACKOFF_BASE_S = float(os.getenv("REKOGNITION_BACKOFF_BASE_S", 0.2))
+REKOGNITION_BACKOFF_MAX_S = float(os.getenv("REKOGNITION_BACKOFF_MAX_S", 5))
+REKOGNITION_STATS_EVERY = int(os.getenv("REKOGNITION_STATS_EVERY", 100))
+
+# JPEG payloads are encoded once per frame with OpenCV
+REKOGNITION_JPEG_QUALITY = int(os.getenv("REKOGNITION_JPEG_QUALITY", 90))
+# frames sent to Rekognition are downscaled to this long edge (0 keeps the frame size) and their JPEG quality is
+# lowered down to REKOGNITION_MIN_JPEG_QUALITY until they fit the byte budget
+REKOGNITION_TARGET_LONG_EDGE = int(os.getenv("REKOGNITION_TARGET_LONG_EDGE", 1280))
+REKOGNITION_PAYLOAD_BYTE_BUDGET = int(os.getenv("REKOGNITION_PAYLOAD_BYTE_BUDGET", 300 * 1024))
+REKOGNITION_MIN_JPEG_QUALITY = int(os.getenv("REKOGNITION_MIN_JPEG_QUALITY", 50))
+if REKOGNITION_MIN_JPEG_QUALITY > REKOGNITION_JPEG_QUALITY:
+    raise ValueError(
+        f"REKOGNITION_MIN_JPEG_QUALITY ({REKOGNITION_MIN_JPEG_QUALITY}) is above "
+        f"REKOGNITION_JPEG_QUALITY ({REKOGNITION_JPEG_QUALITY})"
+    )
+PAYLOAD_STATS_EVERY = int(os.getenv("PAYLOAD_STATS_EVERY", 100))
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 320))
+THUMBNAIL_HEIGHT = int(os.getenv("THUMBNAIL_HEIGHT", 240))
+THUMBNAIL_JPEG_QUALITY = int(os.getenv("THUMBNAIL_JPEG_QUALITY", 85))
+
+# thumbnails are uploaded to S3 in the background by a pool of workers sharing one S3 client
+THUMBNAIL_UPLOAD_WORKERS = int(os.getenv("THUMBNAIL_UPLOAD_WORKERS", 4))
+THUMBNAIL_UPLOAD_QUEUE_SIZE = int(os.getenv("THUMBNAIL_UPLOAD_QUEUE_SIZE", 256))
+THUMBNAIL_UPLOAD_MAX_RETRIES = int(os.getenv("THUMBNAIL_UPLOAD_MAX_RETRIES", 4))
+THUMBNAIL_UPLOAD_BACKOFF_BASE_S = float(os.getenv("THUMBNAIL_UPLOAD_BACKOFF_BASE_S", 0.5))
+THUMBNAIL_UPLOAD_BACKOFF_MAX_S = float(os.getenv("THUMBNAIL_UPLOAD_BACKOFF_MAX_S", 10))
+THUMBNAIL_UPLOAD_STATS_EVERY = int(os.getenv("THUMBNAIL_UPLOAD_STATS_EVERY", 100))
+# thumbnails that could not be uploaded (or didn't fit the queue) are kept here and retried every interval
+THUMBNAIL_SPILL_DIR = os.getenv(
+    "THUMBNAIL_SPILL_DIR", os.path.join(tempfile.gettempdir(), "wingsight_thumbnail_spill")
+)
+THUMBNAIL_SPILL_DRAIN_INTERVAL_S = float(os.getenv("THUMBNAIL_SPILL_DRAIN_INTERVAL_S", 60))
+
+# detection notifications are sent in the background; detections of one user within the window go out as one message
+NOTIFICATION_COALESCE_WINDOW_S = float(os.getenv("NOTIFICATION_COALESCE_WINDOW_S", 60))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", 1024))
+NOTIFICATION_PUBLISH_WORKERS = int(os.getenv("NOTIFICATION_PUBLISH_WORKERS", 4))
+NOTIFICATION_STATS_EVERY = int(os.getenv("NOTIFICATION_STATS_EVERY", 50))
+POLLY_API_TIMEOUT_S = float(os.getenv("POLLY_API_TIMEOUT_S", 10))
+
+# a species detected again in the same subscription within its cooldown is not recorded or notified again
+DETECTION_COOLDOWN_S = float(os.getenv("DETECTION_COOLDOWN_S", 1800))
+# JSON object of species name -> cooldown in seconds, e.g. {"Hummingbird": 300}
+DETECTION_COOLDOWN_OVERRIDES = json.loads(os.getenv("DETECTION_COOLDOWN_OVERRIDES", "{}"))
+
+# Django publishes subscription changes to this fanout exchange; workers apply them to their cached subscription state
+CONTROL_EXCHANGE_NAME = os.getenv("CONTROL_EXCHANGE_NAME", "stream_control")
+CONTROL_CHANNEL_RECONNECT_S = float(os.getenv("CONTROL_CHANNEL_RECONNECT_S", 5))
+# cached subscription state is re-read from the DB this often, in case a control event was lost
+SUBSCRIPTION_RECONCILE_INTERVAL_S = float(os.getenv("SUBSCRIPTION_RECONCILE_INTERVAL_S", 300))
+
+# last_frame_fetched_at and target_timestamp_ms of all streams are written in one bulk UPDATE this often
+HEARTBEAT_FLUSH_INTERVAL_S = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL_S", 10))
+
+# detections are inserted in bulk once this many are buffered or the oldest waited this long
+DETECTION_SINK_BATCH_SIZE = int(os.getenv("DETECTION_SINK_BATCH_SIZE", 50))
+DETECTION_SINK_FLUSH_INTERVAL_S = float(os.getenv("DETECTION_SINK_FLUSH_INTERVAL_S", 5))
+# a batch that still fails after this many flushes is split to isolate rows the DB rejects
+DETECTION_SINK_MAX_RETRIES = int(os.getenv("DETECTION_SINK_MAX_RETRIES", 5))
+# buffered detections are journaled here until inserted, and replayed after a crash
+DETECTION_JOURNAL_DIR = os.getenv(
+    "DETECTION_JOURNAL_DIR", os.path.join(tempfile.gettempdir(), "wingsight_detection_journal")
+)
+
+# DB connections are pooled per process and sized by worker concurrency, not by stream count: sessions are only held
+# for one unit of work (loading a subscription, saving a batch of heartbeats or detections, queueing a notification)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", PROCESS_WORKERS + 2))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", FETCH_WORKERS + OPEN_WORKERS))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", 30))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# connections are replaced before RDS drops them as idle
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", 1800))
+# analysis processes recognize one frame at a time, plus the background writers
+ANALYSIS_DB_POOL_SIZE = int(os.getenv("ANALYSIS_DB_POOL_SIZE", 3))
+
+# every running subscription is leased to one instance; leases not renewed within the TTL are reclaimed by others
+PROCESSOR_INSTANCE_ID = os.getenv("PROCESSOR_INSTANCE_ID", "")
+STREAM_LEASE_TTL_S = float(os.getenv("STREAM_LEASE_TTL_S", 60))
+STREAM_LEASE_HEARTBEAT_S = float(os.getenv("STREAM_LEASE_HEARTBEAT_S", 15))
+STREAM_LEASE_RECLAIM_INTERVAL_S = float(os.getenv("STREAM_LEASE_RECLAIM_INTERVAL_S", 30))
+# stream messages are requeued after this delay when the instance is at MAX_STREAMS_PER_INSTANCE
+STREAM_REQUEUE_DELAY_S = float(os.getenv("STREAM_REQUEUE_DELAY_S", 5))
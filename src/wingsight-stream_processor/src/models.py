@@ -25,6 +25,8 @@ class StreamSubscription(Base):
     target_bird_species = Column(Text, nullable=True)
     misc_info = Column(Text, nullable=True)
     target_timestamp_ms = Column(Integer, default=1)
+    region_of_interest = Column(Text, nullable=True)
+    display_ordinal = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="subscriptions")
     recognition_history = relationship("RecognitionEntry", back_populates="stream_subscription")
@@ -39,10 +41,22 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.now(UTC))
     is_sns_subscribed = Column(Boolean, default=False)
     sns_topic_arn = Column(String(255), unique=True, nullable=True)
+    active_subscription_count = Column(Integer, default=0)
 
     subscriptions = relationship("StreamSubscription", back_populates="user")
 
 
+class StreamLease(Base):
+    __tablename__ = "stream_lease"
+
+    stream_subscription_id = Column(
+        Integer, ForeignKey("stream_subscription.id", ondelete="CASCADE"), primary_key=True
+    )
+    owner = Column(String(255), nullable=False)
+    acquired_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
 class RecognitionEntry(Base):
     __tablename__ = "recognition_entry"
 
@@ -2,28 +2,54 @@ import pika
 import json
 import logging
 import subprocess
-import cv2
 import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from sqlalchemy import update
 from datetime import datetime, UTC
-from concurrent.futures import ThreadPoolExecutor
 
 from models import StreamSubscription
-from config import DATABASE_URL, MQ_HOST, MQ_USER, MQ_PASSWORD, MAX_STREAMS_PER_INSTANCE
+from config import MQ_HOST, MQ_USER, MQ_PASSWORD, MAX_STREAMS_PER_INSTANCE, YT_DLP_TIMEOUT_S
+from config import FRAME_SOURCE_MODE, FETCH_WORKERS, PROCESS_WORKERS, OPEN_WORKERS
+from config import ANALYSIS_MODE, ANALYSIS_PROCESSES, FRAME_RING_SLOTS, FRAME_RING_SLOT_BYTES, ANALYSIS_RESULT_TIMEOUT_S
+from config import SUBSCRIPTION_RECONCILE_INTERVAL_S, STREAM_REQUEUE_DELAY_S
 from utils.object_recognizer import ObjectRecognizer
+from utils.capture_session import CaptureSession
+from utils.frame_grabber import GrabbingCaptureSession
+from utils.ffmpeg_frame_source import FfmpegCaptureSession
+from utils.stream_url_cache import StreamUrlCache
+from utils.stream_registry import StreamRegistry
+from utils.subscription_scheduler import SubscriptionScheduler
+from utils.process_pipeline import ProcessFramePipeline
+from utils.region_of_interest import parse_region_of_interest
+from utils.s3_thumbnail_uploader import shutdown_thumbnail_uploader
+from utils.notification_dispatcher import shutdown_notification_dispatcher
+from utils.subscription_control import SubscriptionState, ControlChannelListener
+from utils.heartbeat_buffer import HeartbeatBuffer
+from utils.detection_sink import shutdown_detection_sink
+from utils.database import create_session_factory
+from utils.stream_lease import LeaseManager
 
 
 QUEUE_NAME = "new_stream_subscriptions"
 
-executor = ThreadPoolExecutor(max_workers=int(MAX_STREAMS_PER_INSTANCE))
+scheduler = SubscriptionScheduler(
+    fetch_workers=FETCH_WORKERS, process_workers=PROCESS_WORKERS, open_workers=OPEN_WORKERS
+)
+
+# set up in main() when ANALYSIS_MODE is "process"
+frame_pipeline = None
+
+# set up in main(), analysis processes must not renew or reclaim leases
+lease_manager = None
 
 logging.basicConfig(level=logging.DEBUG)
 
 
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# sessions are short-lived: opened for one unit of work and closed right after, returning the connection to the pool
+Session = create_session_factory()
+
+heartbeat_buffer = HeartbeatBuffer(session_factory=Session)
 
 
 def get_live_stream_url(subscription_url):
@@ -37,7 +63,7 @@ def get_live_stream_url(subscription_url):
                 "yt-dlp", "-g", "-f", "b", "--no-playlist",
                 subscription_url
             ],
-            capture_output=True, text=True, check=True
+            capture_output=True, text=True, check=True, timeout=YT_DLP_TIMEOUT_S
         )
         stream_url = result.stdout.strip()
         logging.info(f"[yt-dlp] Retrieved stream URL for {subscription_url}. Retrieved URL: {stream_url}")
@@ -51,110 +77,399 @@ def get_live_stream_url(subscription_url):
             f"Retrying..."
         )
 
-def obtain_video_capture(video_url):
-    """
-    Get OpenCV VideoCapture
-    :param video_url: client-provided url of the video
-    :return: cv2.VideoCapture
-    """
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(
+            f"Failed to retrieve stream URL for {subscription_url}. "
+            f"yt-dlp timed out after {YT_DLP_TIMEOUT_S}s. "
+            f"Retrying..."
+        )
 
-    stream_url = get_live_stream_url(video_url)
-    logging.debug(f"Obtained live stream URL: {stream_url}")
 
-    return cv2.VideoCapture(stream_url)
+stream_url_cache = StreamUrlCache(resolve_stream_url=get_live_stream_url)
 
 
-def parse_thread(subscription_id):
+def create_capture_session(subscription_url, logging_prefix):
+    capture_session_class = {
+        "grabber": GrabbingCaptureSession,
+        "ffmpeg": FfmpegCaptureSession,
+    }.get(FRAME_SOURCE_MODE, CaptureSession)
+
+    return capture_session_class(
+        subscription_url=subscription_url,
+        resolve_stream_url=stream_url_cache.get,
+        invalidate_stream_url=stream_url_cache.invalidate,
+        logging_prefix=logging_prefix
+    )
+
+
+stream_registry = StreamRegistry(create_capture_session=create_capture_session)
+
+
+class SubscriptionJob:
     """
-    Parse video thread while it is active.
+    Parses one stream subscription while it is active. Cycles are driven by the SubscriptionScheduler.
+
+    Subscription settings are cached in a SubscriptionState, updated by control events and re-read from the DB every
+    SUBSCRIPTION_RECONCILE_INTERVAL_S in case an event was lost.
+
+    The job only runs while this instance holds the subscription's lease. The RabbitMQ message that started the job is
+    settled once start() knows the outcome: acked when the stream runs or can't run anywhere, requeued on DB errors.
     """
 
-    logging_prefix = f"[StreamSubscription {subscription_id}] "
+    def __init__(self, subscription_id, settle_message=None):
+        """
+        :param subscription_id: ID of the StreamSubscription
+        :param settle_message: callable (requeue) settling the message that started the job, None if there is none
+        """
 
-    session = Session()
-    logging.info(logging_prefix + f"Starting stream parser...")
+        self.subscription_id = subscription_id
+        self.settle_message = settle_message
+        self.logging_prefix = f"[StreamSubscription {subscription_id}] "
 
-    try:
-        stream_subscription = session.get(StreamSubscription, subscription_id)
+        self.is_running = True
+        self.period_s = 1
 
-    except Exception as e:
-        logging.error(logging_prefix + f"Error while accessing database: {e}")
-        return
+        self.shared_stream = None
+        self.object_recognizer = None
 
-    object_recognizer = ObjectRecognizer(
-        db_session=session,
-        stream_subscription_id=stream_subscription.id
-    )
+        self.state = None
+        self.reconciled_at = 0.0
+        self.target_timestamp_ms = 1
 
-    video_capture = None
+        self.region_of_interest = None
+        self.region_of_interest_json = None
 
-    try:
-        video_capture = obtain_video_capture(stream_subscription.url)
+    def start(self):
+        """
+        Load the subscription, lease it and attach it to the shared stream of its source.
+        :return: whether the subscription can be parsed
+        """
+
+        logging.info(self.logging_prefix + f"Starting stream parser...")
+
+        try:
+            started, requeue = self._start()
 
-    except RuntimeError as e:
-        logging.error(e)
+        except Exception as e:
+            logging.error(self.logging_prefix + f"Error while starting: {e}")
+            started, requeue = False, True
 
-        stream_subscription.misc_info = f"Unable to parse the stream. Error: {e}"
-        session.commit()
+            try:
+                lease_manager.release(self.subscription_id)
+            except Exception as e:
+                logging.error(self.logging_prefix + f"Could not release lease: {e}")
 
-    while True and video_capture is not None:
-        stream_subscription = session.get(StreamSubscription, subscription_id)
+        if self.settle_message is not None:
+            self.settle_message(requeue)
 
-        video_capture = obtain_video_capture(stream_subscription.url) # to update url for platforms that have expired param
+        return started
 
-        logging.debug(logging_prefix + "Retrieved subscription from DB in a loop...")
+    def _start(self):
+        """
+        :return: (whether the subscription is running, whether its message should be requeued)
+        """
+
+        try:
+            with Session() as session:
+                stream_subscription = session.get(StreamSubscription, self.subscription_id)
+
+        except Exception as e:
+            logging.error(self.logging_prefix + f"Error while accessing database: {e}")
+            return False, True
 
         if not stream_subscription:
-            logging.error(logging_prefix + "Subscription object not found in the database.")
-            break
+            logging.error(self.logging_prefix + "Subscription object not found in the database.")
+            return False, False
+
+        if not stream_subscription.is_active or stream_subscription.is_deleted:
+            logging.info(self.logging_prefix + "Subscription is not active, not starting.")
+            return False, False
+
+        if not lease_manager.acquire(self.subscription_id):
+            logging.info(self.logging_prefix + "Subscription is leased to another instance, not starting.")
+            return False, False
+
+        self.state = SubscriptionState.from_model(stream_subscription)
+        self.reconciled_at = time.monotonic()
+        self.target_timestamp_ms = stream_subscription.target_timestamp_ms
+        self.period_s = stream_subscription.frame_fetch_frequency
+
+        try:
+            self.shared_stream = stream_registry.acquire(
+                self.subscription_id, stream_subscription.url, fetch_period_s=stream_subscription.frame_fetch_frequency
+            )
+
+        except RuntimeError as e:
+            logging.error(e)
+
+            with Session() as session:
+                session.execute(
+                    update(StreamSubscription)
+                    .where(StreamSubscription.id == self.subscription_id)
+                    .values(misc_info=f"Unable to parse the stream. Error: {e}")
+                )
+                session.commit()
+
+            lease_manager.release(self.subscription_id)
+            return False, False
+
+        self.object_recognizer = ObjectRecognizer(
+            session_factory=Session,
+            stream_subscription_id=stream_subscription.id,
+            shared_results=self.shared_stream.recognition_results
+        )
+
+        return True, False
+
+    def apply_control_event(self, action, changes):
+        """
+        Apply a subscription change published by the Django app. Called from the control channel thread.
+        """
+
+        self.state.apply(action, changes)
+
+        # reactivated before the deactivation took effect, the job keeps running
+        if action == "reactivate":
+            self.is_running = True
+
+        if not self.state.is_active:
+            logging.info(self.logging_prefix + f"Subscription {action}d, releasing...")
+            self.is_running = False
+
+    def reconcile(self):
+        """
+        Re-read the subscription from the DB.
+        :return: whether the subscription still exists
+        """
+
+        with Session() as session:
+            stream_subscription = session.get(StreamSubscription, self.subscription_id)
+
+        self.reconciled_at = time.monotonic()
+
+        logging.debug(self.logging_prefix + "Reconciled subscription with DB...")
+
+        if not stream_subscription:
+            return False
+
+        self.state = SubscriptionState.from_model(stream_subscription)
+        return True
+
+    def needs_reopen(self):
+        return self.shared_stream.needs_reopen()
+
+    def reopen(self):
+        """
+        Reopen the shared stream; runs on the scheduler's open pool, never on a fetch slot.
+        :raises RuntimeError: if the stream url could not be resolved
+        """
+
+        logging.info(self.logging_prefix + "Reopening stream...")
+        self.shared_stream.ensure_open()
+
+    def fetch(self):
+        """
+        Fetch the next frame of the subscription.
+        :return: (frame_id, frame, target_species), or None if no frame was read in this cycle
+        """
+
+        if time.monotonic() - self.reconciled_at >= SUBSCRIPTION_RECONCILE_INTERVAL_S and not self.reconcile():
+            logging.error(self.logging_prefix + "Subscription object not found in the database.")
+            self.is_running = False
+            return None
+
+        if not self.state.is_active:
+            logging.info(self.logging_prefix + "Subscription is deactivated, releasing...")
+            self.is_running = False
+            return None
+
+        if self.period_s != self.state.frame_fetch_frequency:
+            self.period_s = self.state.frame_fetch_frequency
+            self.shared_stream.set_fetch_period(self.subscription_id, self.period_s)
+
+        if self.state.region_of_interest != self.region_of_interest_json:
+            self.region_of_interest_json = self.state.region_of_interest
+            self.region_of_interest = parse_region_of_interest(self.region_of_interest_json, self.logging_prefix)
 
-        time.sleep(stream_subscription.frame_fetch_frequency)
+        try:
+            # frame is 3-dimensional ndarray; for 1080x1920 video frame, the ndarray is (1080, 1920, 3)
+            frame_id, frame = self.shared_stream.read_frame(position_ms=self.target_timestamp_ms)
 
-        if not stream_subscription.is_active:
-            logging.info(logging_prefix + "Subscription is deactivated, releasing...")
-            break
+        except RuntimeError as e:
+            logging.error(self.logging_prefix + str(e))
+            return None
 
-        if not video_capture.isOpened():
-            continue
+        self.target_timestamp_ms += self.state.frame_fetch_frequency * 1000
 
-        video_capture.set(cv2.CAP_PROP_POS_MSEC, stream_subscription.target_timestamp_ms)
+        if frame is None:
+            return None
 
-        stream_subscription.target_timestamp_ms += stream_subscription.frame_fetch_frequency * 1000
+        # written to the DB in bulk with the heartbeats of all other streams
+        heartbeat_buffer.record(self.subscription_id, datetime.now(UTC), self.target_timestamp_ms)
+        logging.info(self.logging_prefix + f"Fetched frame {frame_id}.")
 
-        # frame is 3-dimensional ndarray; for 1080x1920 video frame, the ndarray is (1080, 1920, 3)
-        frame_read_correctly, frame = video_capture.read()
-        if not frame_read_correctly:
-            continue
+        return frame_id, frame, self.state.target_species
 
-        stream_subscription.last_frame_fetched_at = datetime.now(UTC)
-        session.commit()
-        logging.info(logging_prefix + "Fetched frame.")
+    def process(self, work):
+        frame_id, frame, target_species = work
 
-        object_recognizer.handle_image_objects(frame, stream_subscription.target_bird_species)
+        # crop to the region of interest before motion gating, encoding and recognition
+        region_key = None
+        if self.region_of_interest is not None:
+            frame = self.region_of_interest.apply(frame)
+            region_key = self.region_of_interest.key
 
-    video_capture.release()
-    session.close()
+        if frame_pipeline is not None and frame_pipeline.ring.fits(frame):
+            future = frame_pipeline.submit(
+                self.subscription_id, self.shared_stream.source_url, frame, target_species,
+                frame_id=frame_id, region_key=region_key
+            )
+
+            try:
+                future.result(timeout=ANALYSIS_RESULT_TIMEOUT_S)
+
+            except FutureTimeoutError:
+                # the analysis process keeps the subscription's state, so the frame is skipped rather than analyzed
+                # here; its slot is freed once the process gets to it
+                logging.error(
+                    self.logging_prefix + f"Frame {frame_id} not analyzed within {ANALYSIS_RESULT_TIMEOUT_S}s, skipping"
+                )
+
+            except RuntimeError as e:
+                # the analysis process died, it is respawned with a fresh state for the subscription
+                logging.error(self.logging_prefix + f"Frame {frame_id} not analyzed: {e}, skipping")
+
+            return
+
+        self.object_recognizer.handle_image_objects(frame, target_species, frame_id=frame_id, region_key=region_key)
+
+    def stop(self):
+        if frame_pipeline is not None and self.shared_stream is not None:
+            frame_pipeline.release(self.subscription_id, self.shared_stream.source_url)
+
+        if self.shared_stream is not None:
+            stream_registry.release(self.subscription_id, self.shared_stream)
+
+        lease_manager.release(self.subscription_id)
+
+
+def handle_control_event(subscription_id, action, changes):
+    """
+    Apply a control event to the subscription's job, if this instance runs it.
+    """
+
+    job = scheduler.jobs.get(subscription_id)
+    if job is None or job.state is None:
+        return
+
+    job.apply_control_event(action, changes)
+
+    if not job.is_running:
+        scheduler.cancel(subscription_id)
+
+
+def handle_lease_lost(subscription_id):
+    scheduler.cancel(subscription_id)
+
+
+def handle_reclaimable(subscription_ids):
+    """
+    Take over subscriptions whose owner stopped renewing their lease, or that no instance ever leased, as far as this
+    instance has capacity.
+    """
+
+    for subscription_id in subscription_ids:
+        if len(scheduler.jobs) >= int(MAX_STREAMS_PER_INSTANCE):
+            return
+
+        if scheduler.submit(SubscriptionJob(subscription_id)):
+            logging.info(f"[StreamWatcher] Reclaiming subscription {subscription_id}")
+
+
+def make_message_settler(ch, delivery_tag):
+    """
+    :return: callable (requeue) acking or requeuing the message from any thread; pika channels are not thread-safe.
+        Requeued messages are delayed by STREAM_REQUEUE_DELAY_S, so a failing start is not redelivered in a hot loop
+    """
+
+    def settle(requeue):
+        if requeue:
+            callback = lambda: ch.connection.call_later(
+                STREAM_REQUEUE_DELAY_S, lambda: ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            )
+        else:
+            callback = lambda: ch.basic_ack(delivery_tag=delivery_tag)
+
+        ch.connection.add_callback_threadsafe(callback)
+
+    return settle
 
-    return
 
 def handle_message_callback(ch, method, properties, body):
     """
-    Handle a new message from RabbitMQ.
+    Handle a new message from RabbitMQ. The message is only acked once its stream runs, so a stream is never lost
+    with an instance that dies while starting it.
     """
 
     message = json.loads(body)
     subscription_id = message.get("subscription_id")
 
-    executor.submit(parse_thread, subscription_id)
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    if subscription_id in scheduler.jobs:
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
+
+    if len(scheduler.jobs) >= int(MAX_STREAMS_PER_INSTANCE):
+        # requeued after a delay, so the message goes to an instance with capacity rather than bouncing back here
+        logging.info(f"[StreamWatcher] At capacity, requeuing subscription {subscription_id}")
+        ch.connection.call_later(
+            STREAM_REQUEUE_DELAY_S, lambda: ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        )
+        return
+
+    if not scheduler.submit(SubscriptionJob(subscription_id, make_message_settler(ch, method.delivery_tag))):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def main():
+    global frame_pipeline, lease_manager
+
+    if ANALYSIS_MODE == "process":
+        frame_pipeline = ProcessFramePipeline(
+            process_count=ANALYSIS_PROCESSES,
+            slot_count=FRAME_RING_SLOTS,
+            slot_bytes=FRAME_RING_SLOT_BYTES
+        )
+
+    lease_manager = LeaseManager(
+        session_factory=Session, on_lease_lost=handle_lease_lost, on_reclaimable=handle_reclaimable
+    )
+    ControlChannelListener(on_event=handle_control_event)
+
+    credentials = pika.PlainCredentials(MQ_USER, MQ_PASSWORD)
+    connection = pika.BlockingConnection(pika.ConnectionParameters(MQ_HOST, credentials=credentials))
+    channel = connection.channel()
+    channel.basic_qos(prefetch_count=int(MAX_STREAMS_PER_INSTANCE))
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=handle_message_callback)
+
+    logging.info("[*] Waiting for messages...")
+    try:
+        channel.start_consuming()
+    finally:
+        # other instances reclaim the streams of this one right away instead of waiting for the leases to expire
+        lease_manager.expire_all()
+        scheduler.shutdown()
+
+        # analysis processes flush their detection sinks and notification dispatchers when they stop
+        if frame_pipeline is not None:
+            frame_pipeline.shutdown()
 
+        heartbeat_buffer.shutdown()
+        shutdown_detection_sink()
+        shutdown_notification_dispatcher()
+        shutdown_thumbnail_uploader()
 
-credentials = pika.PlainCredentials(MQ_USER, MQ_PASSWORD)
-connection = pika.BlockingConnection(pika.ConnectionParameters(MQ_HOST, credentials=credentials))
-channel = connection.channel()
-channel.basic_qos(prefetch_count=int(MAX_STREAMS_PER_INSTANCE))
-channel.queue_declare(queue=QUEUE_NAME, durable=True)
-channel.basic_consume(queue=QUEUE_NAME, on_message_callback=handle_message_callback)
 
-logging.info("[*] Waiting for messages...")
-channel.start_consuming()
\ No newline at end of file
+# analysis processes import this module as __mp_main__, so consuming must only start when run as a script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+
+class BatchQueue:
+    """
+    Collects items submitted from many threads and hands them to a batch function in groups.
+
+    A batch is closed once it holds max_batch_size items or max_wait_ms passed since its first item arrived.
+    """
+
+    def __init__(self, process_batch, max_batch_size, max_wait_ms, name="batch"):
+        """
+        :param process_batch: callable taking a list of items and returning a list of results in the same order
+        :param max_batch_size: max items per batch
+        :param max_wait_ms: max time the first item of a batch waits for more items
+        :param name: name of the batching thread, used in log messages
+        """
+
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+
+        self.batches_processed = 0
+        self.items_processed = 0
+
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        :return: Future resolving to the item's result
+        """
+
+        future = Future()
+        self._requests.put((item, future))
+
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+
+            while len(batch) < self.max_batch_size:
+                remaining_s = deadline - time.monotonic()
+                if remaining_s <= 0:
+                    break
+
+                try:
+                    batch.append(self._requests.get(timeout=remaining_s))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.process_batch([item for item, _ in batch])
+
+            except Exception as e:
+                logging.error(f"[{self.name}] Error processing a batch of {len(batch)}: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches_processed += 1
+            self.items_processed += len(batch)
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches_processed": self.batches_processed,
+            "items_processed": self.items_processed,
+            "mean_batch_size": self.items_processed / self.batches_processed if self.batches_processed else None,
+            "queued": self._requests.qsize(),
+        }
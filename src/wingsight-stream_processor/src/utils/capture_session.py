@@ -0,0 +1,139 @@
+import logging
+import time
+
+import cv2
+
+from utils.stream_url import parse_stream_url_expiry
+
+from config import CAPTURE_URL_EXPIRY_MARGIN_S
+
+
+class CaptureSession:
+    """
+    Keeps one cv2.VideoCapture open for a subscription for as long as the stream is parsed.
+
+    The stream URL is re-resolved and the capture reopened only when a read failed or when the signed stream URL
+    is about to expire, instead of on every fetched frame. A failed read releases the capture; the owner reopens it
+    when needs_reopen() says so (see SubscriptionScheduler), so reads never wait for a reopen.
+    """
+
+    # don't reopen for expiry more often than this, e.g. while the resolver keeps serving an expiring cached url
+    MIN_EXPIRY_REOPEN_INTERVAL_S = 60
+
+    def __init__(self, subscription_url, resolve_stream_url, invalidate_stream_url=None, logging_prefix=""):
+        """
+        :param subscription_url: client-provided url of the video
+        :param resolve_stream_url: callable that maps the client-provided url to a live stream url
+        :param invalidate_stream_url: optional callable to drop a cached live stream url after a failed read
+        :param logging_prefix: prefix for log messages of the owning stream
+        """
+
+        self.subscription_url = subscription_url
+        self.resolve_stream_url = resolve_stream_url
+        self.invalidate_stream_url = invalidate_stream_url
+        self.logging_prefix = logging_prefix
+
+        self.video_capture = None
+        self.stream_url = None
+        self.stream_url_expires_at = None
+        self.opened_at = 0.0
+
+        self.open_count = 0
+        self.reopen_count = 0
+        self.read_failure_count = 0
+        self.frames_read = 0
+
+    def open(self):
+        """
+        Resolve the stream url and open a new capture, releasing the previous one.
+        :raises RuntimeError: if the stream url could not be resolved
+        """
+
+        self._release_capture()
+
+        self.stream_url = self.resolve_stream_url(self.subscription_url)
+        self.stream_url_expires_at = parse_stream_url_expiry(self.stream_url)
+        self.video_capture = cv2.VideoCapture(self.stream_url)
+        self.opened_at = time.monotonic()
+
+        if self.open_count > 0:
+            self.reopen_count += 1
+            logging.info(
+                self.logging_prefix + f"Reopened video capture (reopens: {self.reopen_count}, "
+                                      f"frames read: {self.frames_read}, read failures: {self.read_failure_count})"
+            )
+
+        self.open_count += 1
+
+    def is_expiring(self):
+        """
+        Whether the signed stream URL expires within the configured margin.
+        """
+
+        if self.stream_url_expires_at is None:
+            return False
+
+        if time.monotonic() - self.opened_at < self.MIN_EXPIRY_REOPEN_INTERVAL_S:
+            return False
+
+        return time.time() >= self.stream_url_expires_at - CAPTURE_URL_EXPIRY_MARGIN_S
+
+    def is_opened(self):
+        return self.video_capture is not None and self.video_capture.isOpened()
+
+    def needs_reopen(self):
+        return not self.is_opened() or self.is_expiring()
+
+    def ensure_open(self):
+        """
+        Open the capture if it is not usable or its stream URL is about to expire.
+        """
+
+        if self.needs_reopen():
+            self.open()
+
+    def read(self, position_ms=None):
+        """
+        Read the next frame. A failed read releases the capture, so that it is reopened before the next read.
+        :param position_ms: optional position to seek to before reading (for non-live videos)
+        :return: (frame_read_correctly, frame) like cv2.VideoCapture.read()
+        """
+
+        self.ensure_open()
+
+        if position_ms is not None:
+            self.video_capture.set(cv2.CAP_PROP_POS_MSEC, position_ms)
+
+        frame_read_correctly, frame = self.video_capture.read()
+
+        if frame_read_correctly:
+            self.frames_read += 1
+            return True, frame
+
+        self.read_failure_count += 1
+
+        if self.invalidate_stream_url is not None:
+            self.invalidate_stream_url(self.subscription_url)
+        self._release_capture()
+
+        return False, None
+
+    def stats(self):
+        """
+        :return: dict with open/reopen/read counters of this session
+        """
+
+        return {
+            "open_count": self.open_count,
+            "reopen_count": self.reopen_count,
+            "read_failure_count": self.read_failure_count,
+            "frames_read": self.frames_read,
+        }
+
+    def _release_capture(self):
+        if self.video_capture is not None:
+            self.video_capture.release()
+            self.video_capture = None
+
+    def release(self):
+        self._release_capture()
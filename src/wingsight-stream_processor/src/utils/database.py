@@ -0,0 +1,27 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT_S, DB_POOL_PRE_PING, DB_POOL_RECYCLE_S
+)
+
+
+def create_session_factory(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    """
+    Create the process' engine and a factory of short-lived sessions on it.
+    :param pool_size: connections kept open
+    :param max_overflow: extra connections opened under load, closed when returned
+    :return: sessionmaker; use sessions as `with session_factory() as session:` so connections return to the pool
+    """
+
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT_S,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE_S
+    )
+
+    # objects stay readable after the session that loaded them is closed
+    return sessionmaker(bind=engine, expire_on_commit=False)
@@ -0,0 +1,376 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import RecognitionEntry
+
+from config import (
+    DETECTION_SINK_BATCH_SIZE, DETECTION_SINK_FLUSH_INTERVAL_S, DETECTION_SINK_MAX_RETRIES, DETECTION_JOURNAL_DIR
+)
+
+
+DATETIME_FIELDS = ("earth_timestamp", "stream_timestamp")
+
+# rows the DB rejects are appended to this file in the journal directory, with the error
+DEAD_LETTER_FILE_NAME = "dead-letter-detections.jsonl"
+
+
+def is_rejected_row_error(error):
+    """
+    Whether the DB rejected the rows themselves (e.g. a constraint violation), rather than failing for a reason that
+    may pass, like a lost connection.
+    """
+
+    return isinstance(error, (IntegrityError, DataError))
+
+
+def encode_row(row):
+    return json.dumps({
+        field: value.isoformat() if field in DATETIME_FIELDS else value for field, value in row.items()
+    })
+
+
+def decode_row(line):
+    row = json.loads(line)
+    for field in DATETIME_FIELDS:
+        row[field] = datetime.fromisoformat(row[field])
+
+    return row
+
+
+class DetectionSink:
+    """
+    Buffers RecognitionEntry rows and inserts them in bulk, once DETECTION_SINK_BATCH_SIZE rows are buffered or
+    DETECTION_SINK_FLUSH_INTERVAL_S passed since the last flush.
+
+    Every row is appended to a journal file in DETECTION_JOURNAL_DIR before add() returns, and the journal is only
+    deleted once its rows are committed, so a crash doesn't lose detections that were already notified (at least
+    once). Each process journals under its own PID and holds a lock file while alive; journals whose lock is free
+    belong to a dead process and are replayed, skipping rows that did make it to the DB.
+
+    A batch the DB rejects, or that still fails after DETECTION_SINK_MAX_RETRIES flushes, is bisected down to the
+    failing rows, which go to a dead-letter file, so one bad row never holds back the detections after it.
+    """
+
+    def __init__(self, session_factory, journal_dir=DETECTION_JOURNAL_DIR, batch_size=DETECTION_SINK_BATCH_SIZE,
+                 flush_interval_s=DETECTION_SINK_FLUSH_INTERVAL_S):
+        """
+        :param session_factory: callable returning a new SQLAlchemy session
+        :param journal_dir: directory of the journal files
+        :param batch_size: buffered rows that trigger a flush
+        :param flush_interval_s: max delay between two flushes
+        """
+
+        self.session_factory = session_factory
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.journal_prefix = os.path.join(self.journal_dir, f"detections-{os.getpid()}")
+
+        # released by the OS when the process dies, which marks the journals for recovery
+        self._lock_file = open(self.journal_prefix + ".lock", "w")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+        self._buffer = []
+        # rows of journal segments whose insert failed, retried with the next flush
+        self._retry_rows = []
+        self._segments = []
+        self._segment_sequence = 0
+
+        self.rows_inserted = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_recovered = 0
+        self.rows_dead_lettered = 0
+        # consecutive failed flushes of the retried rows
+        self._retries = 0
+
+        self.recover()
+
+        self._journal = open(self._journal_path(), "a")
+
+        self._thread = threading.Thread(target=self._run, name="detection-sink", daemon=True)
+        self._thread.start()
+
+    def _journal_path(self):
+        return f"{self.journal_prefix}-{self._segment_sequence}.jsonl"
+
+    def add(self, row):
+        """
+        Journal a detection and buffer it for insertion.
+        :param row: RecognitionEntry column values
+        """
+
+        with self._lock:
+            self._journal.write(encode_row(row) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+            self._buffer.append(row)
+            should_flush = len(self._buffer) >= self.batch_size
+
+        if should_flush:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Insert the buffered rows.
+        :return: number of rows inserted
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                if self._buffer:
+                    # the rows being inserted move to a closed journal segment, new rows go to a new one
+                    self._journal.close()
+                    self._segments.append(self._journal_path())
+                    self._segment_sequence += 1
+                    self._journal = open(self._journal_path(), "a")
+
+                rows = self._retry_rows + self._buffer
+                segments = list(self._segments)
+                self._buffer = []
+
+            if not rows:
+                return 0
+
+            try:
+                self._insert(rows)
+                inserted = len(rows)
+
+            except Exception as e:
+                self._retries += 1
+
+                if not is_rejected_row_error(e) and self._retries <= DETECTION_SINK_MAX_RETRIES:
+                    self.failed_flushes += 1
+                    logging.error(f"[DetectionSink] Could not insert {len(rows)} detections, will retry: {e}")
+                    self._retry_rows = rows
+                    return 0
+
+                logging.error(f"[DetectionSink] Could not insert {len(rows)} detections, isolating failing rows: {e}")
+                left_rows, dead_lettered = self._insert_isolating(rows)
+
+                if left_rows:
+                    # the journal segments are kept until the left rows are in; recovery skips the inserted ones
+                    self.failed_flushes += 1
+                    self._retry_rows = left_rows
+                    self.rows_inserted += len(rows) - len(left_rows) - dead_lettered
+                    return len(rows) - len(left_rows) - dead_lettered
+
+                inserted = len(rows) - dead_lettered
+
+            # every row is now inserted or dead-lettered
+            self._retry_rows = []
+            self._retries = 0
+            with self._lock:
+                self._segments = self._segments[len(segments):]
+
+            for segment in segments:
+                os.remove(segment)
+
+            self.flushes += 1
+            self.rows_inserted += inserted
+
+            return inserted
+
+    def _insert(self, rows):
+        session = self.session_factory()
+
+        try:
+            session.execute(insert(RecognitionEntry), rows)
+            session.commit()
+
+        except Exception:
+            session.rollback()
+            raise
+
+        finally:
+            session.close()
+
+    def _insert_isolating(self, rows):
+        """
+        Insert rows in ever smaller chunks, moving single rows that fail to the dead-letter file. A single row failing
+        for a reason that may pass (e.g. a lost connection) before anything could be inserted means the DB is down
+        rather than the row bad, so the rows not inserted yet are left for the next flush.
+        :return: (rows left to retry, number of rows dead-lettered)
+        """
+
+        chunks = [rows]
+        dead_lettered = 0
+        any_inserted = False
+
+        while chunks:
+            chunk = chunks.pop()
+
+            try:
+                self._insert(chunk)
+                any_inserted = True
+
+            except Exception as e:
+                if len(chunk) > 1:
+                    middle = len(chunk) // 2
+                    chunks.extend((chunk[middle:], chunk[:middle]))
+                    continue
+
+                if not is_rejected_row_error(e) and not any_inserted:
+                    return [row for left_chunk in chunks for row in left_chunk] + chunk, dead_lettered
+
+                self._dead_letter(chunk[0], e)
+                dead_lettered += 1
+
+        return [], dead_lettered
+
+    def _dead_letter(self, row, error):
+        logging.error(f"[DetectionSink] Detection rejected by the DB, moved to {DEAD_LETTER_FILE_NAME}: {row}: {error}")
+
+        with open(os.path.join(self.journal_dir, DEAD_LETTER_FILE_NAME), "a") as dead_letter_file:
+            dead_letter_file.write(json.dumps({"row": json.loads(encode_row(row)), "error": str(error)}) + "\n")
+
+        self.rows_dead_lettered += 1
+
+    def _is_stored(self, session, row):
+        # both the DB column and the journal keep microseconds, so a repeat detection within a second is not a match
+        return session.query(
+            session.query(RecognitionEntry).filter(
+                RecognitionEntry.stream_subscription_id == row["stream_subscription_id"],
+                RecognitionEntry.recognized_specie_name == row["recognized_specie_name"],
+                RecognitionEntry.earth_timestamp == row["earth_timestamp"]
+            ).exists()
+        ).scalar()
+
+    def recover(self):
+        """
+        Insert the journaled rows of dead processes (including an earlier process with this PID).
+        :return: number of rows recovered
+        """
+
+        recovered = 0
+
+        for lock_path in glob.glob(os.path.join(self.journal_dir, "detections-*.lock")):
+            prefix = lock_path[:-len(".lock")]
+
+            try:
+                if prefix == self.journal_prefix:
+                    recovered += self._recover_journals(prefix)
+                    continue
+
+                # the lock is held while the owner lives, and by this process while it recovers the journals
+                with open(lock_path, "a") as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+
+                    recovered += self._recover_journals(prefix)
+                    os.remove(lock_path)
+
+            except Exception as e:
+                # the journals are kept and recovered by the next process that starts
+                logging.error(f"[DetectionSink] Could not recover journaled detections of {prefix}: {e}")
+
+        if recovered:
+            logging.info(f"[DetectionSink] Recovered {recovered} journaled detections")
+
+        self.rows_recovered += recovered
+        return recovered
+
+    def _recover_journals(self, prefix):
+        journal_paths = sorted(glob.glob(prefix + "-*.jsonl"))
+
+        rows = []
+        for journal_path in journal_paths:
+            with open(journal_path) as journal:
+                # the last line may be partial if the process died while writing it
+                rows.extend(decode_row(line) for line in journal if line.endswith("\n"))
+
+        if rows:
+            session = self.session_factory()
+            try:
+                # rows of a batch committed right before the crash are already stored
+                rows = [row for row in rows if not self._is_stored(session, row)]
+            finally:
+                session.close()
+
+        if rows:
+            left_rows, _ = self._insert_isolating(rows)
+
+            if left_rows:
+                raise RuntimeError(f"{len(left_rows)} journaled detections could not be inserted")
+
+        for journal_path in journal_paths:
+            os.remove(journal_path)
+
+        return len(rows)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"[DetectionSink] Error while flushing detections: {e}")
+
+    def shutdown(self):
+        """
+        Insert what is still buffered. Rows that can't be inserted stay journaled for the next run.
+        """
+
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+
+        self.flush()
+        self._journal.close()
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "retrying": len(self._retry_rows),
+            "rows_inserted": self.rows_inserted,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "rows_recovered": self.rows_recovered,
+            "rows_dead_lettered": self.rows_dead_lettered,
+        }
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_detection_sink(session_factory):
+    """
+    The sink is created once per process and shared by all streams.
+    :param session_factory: callable returning a new SQLAlchemy session, used by the first caller
+    """
+
+    global _sink
+
+    with _sink_lock:
+        if _sink is None:
+            _sink = DetectionSink(session_factory=session_factory)
+
+        return _sink
+
+
+def shutdown_detection_sink():
+    with _sink_lock:
+        if _sink is not None:
+            _sink.shutdown()
@@ -0,0 +1,55 @@
+from datetime import datetime, UTC
+
+from models import RecognitionEntry
+
+from config import DETECTION_COOLDOWN_S, DETECTION_COOLDOWN_OVERRIDES
+
+
+def as_utc(timestamp):
+    # DateTime columns come back naive from MySQL and SQLite, they are stored in UTC
+    return timestamp if timestamp.tzinfo is not None else timestamp.replace(tzinfo=UTC)
+
+
+class DetectionState:
+    """
+    Last detection of one subscription, kept in memory for the anti-spam filter.
+
+    Seeded once from the latest RecognitionEntry and updated on every recorded detection afterwards. A detection of
+    the same species as the last one is a duplicate until the species' cooldown (DETECTION_COOLDOWN_S, or its entry in
+    DETECTION_COOLDOWN_OVERRIDES) has passed.
+    """
+
+    __slots__ = ("last_species", "last_detected_at")
+
+    def __init__(self, last_species=None, last_detected_at=None):
+        self.last_species = last_species
+        self.last_detected_at = last_detected_at
+
+    @classmethod
+    def load(cls, db_session, stream_subscription_id):
+        last_entry = (
+            db_session.query(RecognitionEntry)
+            .filter_by(stream_subscription_id=stream_subscription_id)
+            .order_by(RecognitionEntry.earth_timestamp.desc())
+            .first()
+        )
+
+        if last_entry is None:
+            return cls()
+
+        return cls(last_entry.recognized_specie_name, as_utc(last_entry.earth_timestamp))
+
+    @staticmethod
+    def cooldown_s(species):
+        return DETECTION_COOLDOWN_OVERRIDES.get(species, DETECTION_COOLDOWN_S)
+
+    def is_duplicate(self, species, detected_at=None):
+        if species != self.last_species or self.last_detected_at is None:
+            return False
+
+        detected_at = detected_at or datetime.now(UTC)
+        return (detected_at - self.last_detected_at).total_seconds() < self.cooldown_s(species)
+
+    def record(self, species, detected_at):
+        self.last_species = species
+        self.last_detected_at = as_utc(detected_at)
@@ -0,0 +1,239 @@
+import logging
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from utils.capture_session import CaptureSession
+from utils.stream_url import parse_stream_url_expiry
+
+from config import FFMPEG_SAMPLE_PERIOD_S, FFMPEG_FRAME_LONG_EDGE, FFMPEG_READ_TIMEOUT_S
+
+
+class FfmpegCaptureSession(CaptureSession):
+    """
+    Drop-in alternative to the cv2.VideoCapture based CaptureSession that runs one long-lived ffmpeg process.
+
+    ffmpeg samples the stream (`fps=1/N`, N being the shortest fetch interval of the subscriptions to the stream, see
+    set_sample_period()), scales it down and writes raw BGR frames to stdout, so Python never sees frames it would
+    throw away. A reader thread keeps the pipe drained and reads every frame with readinto() into
+    a pooled bytearray that np.frombuffer wraps without copying. The latest frame is handed out by read(); frames
+    superseded before anyone read them return their buffer to the pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.process = None
+        self.frame_shape = None
+
+        self.sample_period_s = FFMPEG_SAMPLE_PERIOD_S
+        # ffmpeg is restarted with the new period by the next read()
+        self._sample_period_changed = False
+
+        self._reader_thread = None
+        self._frame_condition = threading.Condition()
+        self._latest_frame = None
+        self._latest_buffer = None
+        self._free_buffers = []
+        self._reader_finished = False
+
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+
+    def _probe_frame_shape(self):
+        """
+        Get the (height, width) ffmpeg will output, keeping the source aspect ratio within FFMPEG_FRAME_LONG_EDGE.
+        """
+
+        try:
+            result = subprocess.run(
+                [
+                    "ffprobe", "-v", "error", "-select_streams", "v:0",
+                    "-show_entries", "stream=width,height", "-of", "csv=p=0:s=x",
+                    self.stream_url
+                ],
+                capture_output=True, text=True, check=True, timeout=FFMPEG_READ_TIMEOUT_S
+            )
+            source_width, source_height = (int(value) for value in result.stdout.split()[0].split("x"))
+
+        except (subprocess.SubprocessError, ValueError, IndexError) as e:
+            logging.warning(self.logging_prefix + f"ffprobe failed, assuming 16:9 frames: {e}")
+            source_width, source_height = FFMPEG_FRAME_LONG_EDGE, FFMPEG_FRAME_LONG_EDGE * 9 // 16
+
+        scale = min(1.0, FFMPEG_FRAME_LONG_EDGE / max(source_width, source_height))
+
+        # ffmpeg's scaler needs even dimensions
+        width = max(2, int(source_width * scale) // 2 * 2)
+        height = max(2, int(source_height * scale) // 2 * 2)
+
+        return height, width
+
+    def open(self):
+        """
+        Resolve the stream url and start a new ffmpeg process, stopping the previous one.
+        :raises RuntimeError: if the stream url could not be resolved
+        """
+
+        self._release_capture()
+
+        self.stream_url = self.resolve_stream_url(self.subscription_url)
+        self.stream_url_expires_at = parse_stream_url_expiry(self.stream_url)
+        self.frame_shape = self._probe_frame_shape()
+
+        height, width = self.frame_shape
+
+        self.process = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error",
+                "-i", self.stream_url,
+                "-an", "-sn",
+                "-vf", f"fps=1/{self.sample_period_s},scale={width}:{height}",
+                "-pix_fmt", "bgr24", "-f", "rawvideo",
+                "pipe:1"
+            ],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+        )
+        self.opened_at = time.monotonic()
+        self._sample_period_changed = False
+
+        with self._frame_condition:
+            self._latest_frame = None
+            self._latest_buffer = None
+            self._free_buffers = []
+            self._reader_finished = False
+
+        self._reader_thread = threading.Thread(target=self._read_loop, args=(self.process,), daemon=True)
+        self._reader_thread.start()
+
+        if self.open_count > 0:
+            self.reopen_count += 1
+            logging.info(
+                self.logging_prefix + f"Restarted ffmpeg (reopens: {self.reopen_count}, "
+                                      f"frames read: {self.frames_read}, read failures: {self.read_failure_count})"
+            )
+
+        self.open_count += 1
+
+    def _read_loop(self, process):
+        height, width = self.frame_shape
+        frame_size = height * width * 3
+
+        while True:
+            with self._frame_condition:
+                buffer = self._free_buffers.pop() if self._free_buffers else bytearray(frame_size)
+
+            view = memoryview(buffer)
+            bytes_read = 0
+
+            while bytes_read < frame_size:
+                try:
+                    chunk_size = process.stdout.readinto(view[bytes_read:])
+                except (ValueError, OSError):
+                    # the pipe was closed by _release_capture()
+                    break
+
+                if not chunk_size:
+                    break
+                bytes_read += chunk_size
+
+            if bytes_read < frame_size:
+                break
+
+            frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+
+            with self._frame_condition:
+                if process is not self.process:
+                    return
+
+                if self._latest_buffer is not None:
+                    self.frames_dropped += 1
+                    self._free_buffers.append(self._latest_buffer)
+
+                self._latest_frame = frame
+                self._latest_buffer = buffer
+                self.frames_decoded += 1
+                self._frame_condition.notify_all()
+
+        with self._frame_condition:
+            if process is self.process:
+                self._reader_finished = True
+                self._frame_condition.notify_all()
+
+    def is_opened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def needs_reopen(self):
+        return self._sample_period_changed or super().needs_reopen()
+
+    def set_sample_period(self, sample_period_s):
+        """
+        Sample one frame every `sample_period_s` seconds, from the next read() on.
+        """
+
+        if sample_period_s and sample_period_s != self.sample_period_s:
+            logging.info(self.logging_prefix + f"Sample period changed to {sample_period_s}s")
+            self.sample_period_s = sample_period_s
+            self._sample_period_changed = True
+
+    def _take_latest_frame(self):
+        """
+        Wait for a frame that wasn't handed out yet. Handed out buffers are owned by the caller and never reused.
+        """
+
+        with self._frame_condition:
+            self._frame_condition.wait_for(
+                lambda: self._latest_frame is not None or self._reader_finished,
+                timeout=self.sample_period_s + FFMPEG_READ_TIMEOUT_S
+            )
+
+            frame = self._latest_frame
+            self._latest_frame = None
+            self._latest_buffer = None
+
+            return frame
+
+    def read(self, position_ms=None):
+        """
+        Get the latest frame sampled by ffmpeg. If none arrives in time, ffmpeg is stopped, to be restarted before the
+        next read, so a dead pipe costs one timed wait.
+        :param position_ms: ignored, ffmpeg follows the live edge
+        :return: (frame_read_correctly, frame) like cv2.VideoCapture.read()
+        """
+
+        self.ensure_open()
+
+        frame = self._take_latest_frame()
+
+        if frame is not None:
+            self.frames_read += 1
+            return True, frame
+
+        self.read_failure_count += 1
+
+        if self.invalidate_stream_url is not None:
+            self.invalidate_stream_url(self.subscription_url)
+        self._release_capture()
+
+        return False, None
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "frames_decoded": self.frames_decoded,
+            "frames_dropped": self.frames_dropped,
+        }
+
+    def _release_capture(self):
+        process = self.process
+        if process is None:
+            return
+
+        with self._frame_condition:
+            self.process = None
+            self._frame_condition.notify_all()
+
+        process.kill()
+        process.wait()
+        process.stdout.close()
@@ -0,0 +1,58 @@
+import cv2
+
+from utils.payload_planner import default_payload_planner
+
+from config import THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, THUMBNAIL_JPEG_QUALITY
+
+
+def encode_jpeg(image, quality):
+    """
+    Encode a BGR or grayscale ndarray to JPEG bytes with OpenCV.
+    :raises ValueError: if the image could not be encoded
+    """
+
+    encoded, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not encoded:
+        raise ValueError(f"Could not encode image of shape {image.shape} to JPEG")
+
+    return buffer.tobytes()
+
+
+class EncodedFrame:
+    """
+    A frame together with the JPEG payloads derived from it.
+
+    Each payload is encoded at most once, directly from the BGR ndarray, and only when it is first needed: the
+    Rekognition payload (sized by the PayloadPlanner) when the frame is classified, the thumbnail when a detection
+    is saved.
+    """
+
+    __slots__ = ("image", "_rekognition_jpeg", "_thumbnail_jpeg")
+
+    def __init__(self, image):
+        """
+        :param image: BGR (or grayscale) ndarray
+        """
+
+        self.image = image
+        self._rekognition_jpeg = None
+        self._thumbnail_jpeg = None
+
+    @property
+    def has_rekognition_jpeg(self):
+        return self._rekognition_jpeg is not None
+
+    @property
+    def rekognition_jpeg(self):
+        if self._rekognition_jpeg is None:
+            self._rekognition_jpeg = default_payload_planner.plan(self.image)
+
+        return self._rekognition_jpeg
+
+    @property
+    def thumbnail_jpeg(self):
+        if self._thumbnail_jpeg is None:
+            thumbnail = cv2.resize(self.image, (THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT), interpolation=cv2.INTER_AREA)
+            self._thumbnail_jpeg = encode_jpeg(thumbnail, THUMBNAIL_JPEG_QUALITY)
+
+        return self._thumbnail_jpeg
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+
+import cv2
+
+from utils.capture_session import CaptureSession
+
+from config import GRABBER_STALE_AFTER_S, GRABBER_REOPEN_BACKOFF_S
+
+
+class GrabbingCaptureSession(CaptureSession):
+    """
+    CaptureSession that keeps the demuxer at the live edge.
+
+    A background thread calls grab() continuously, so buffered data never piles up. Only that thread touches the
+    capture: when read() asks for a frame, the thread retrieve()s the next grabbed frame into a single-slot buffer,
+    so frames grabbed in between are never converted to BGR ndarrays, and a grab() blocked on a slow source never
+    holds a lock read() waits for.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._stop_event = threading.Event()
+        self._grab_thread = None
+
+        self.grab_count = 0
+        self.grab_failure_count = 0
+        self.last_grab_at = 0.0
+
+        # single-slot latest-frame buffer, filled by the grab thread when _frame_requested is set
+        self._slot_condition = threading.Condition()
+        self._frame_requested = False
+        self._slot_frame = None
+        self._slot_grab_count = 0
+
+    def open(self):
+        super().open()
+        self.last_grab_at = time.monotonic()
+
+    def needs_reopen(self):
+        # once the grab thread runs, it reopens the capture itself
+        if self._grab_thread is not None and self._grab_thread.is_alive():
+            return False
+
+        return super().needs_reopen()
+
+    def ensure_open(self):
+        """
+        Open the capture and start the grab thread. Once it runs, the grab thread reopens the capture itself.
+        """
+
+        if self._grab_thread is not None and self._grab_thread.is_alive():
+            if not self._stop_event.is_set():
+                return
+
+            # a released grab thread still finishing a grab() releases the capture on its way out
+            self._grab_thread.join()
+
+        super().ensure_open()
+
+        self._stop_event.clear()
+        self._grab_thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self._grab_thread.start()
+
+    def _grab_loop(self):
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    if self.is_expiring() or not self.is_opened():
+                        self.open()
+
+                    if not self.video_capture.grab():
+                        self.grab_failure_count += 1
+
+                        if self.invalidate_stream_url is not None:
+                            self.invalidate_stream_url(self.subscription_url)
+                        self.open()
+                        continue
+
+                    self.grab_count += 1
+                    self.last_grab_at = time.monotonic()
+
+                    if self._frame_requested:
+                        self._retrieve()
+
+                except (RuntimeError, AttributeError, cv2.error) as e:
+                    logging.error(self.logging_prefix + f"Grabber failed to read the stream: {e}")
+                    self._stop_event.wait(GRABBER_REOPEN_BACKOFF_S)
+
+        finally:
+            # the capture is only released by the thread using it, never under a running grab()
+            if self._stop_event.is_set():
+                self._release_capture()
+
+    def _retrieve(self):
+        frame_retrieved, frame = self.video_capture.retrieve()
+
+        with self._slot_condition:
+            self._frame_requested = False
+
+            if frame_retrieved:
+                self._slot_frame = frame
+                self._slot_grab_count = self.grab_count
+                self.frames_read += 1
+            else:
+                self.read_failure_count += 1
+
+            self._slot_condition.notify_all()
+
+    def read(self, position_ms=None):
+        """
+        Get the latest grabbed frame, waiting for the next grab if it was not decoded yet. Seeking is not supported,
+        the grabber always follows the live edge.
+        :param position_ms: ignored
+        :return: (frame_read_correctly, frame) like cv2.VideoCapture.read()
+        """
+
+        self.ensure_open()
+
+        with self._slot_condition:
+            if self._slot_frame is not None and self._slot_grab_count == self.grab_count:
+                return True, self._slot_frame
+
+            self._frame_requested = True
+            requested_slot_grab_count = self._slot_grab_count
+
+            # a stalled source is reported as a read failure once no frame was grabbed for GRABBER_STALE_AFTER_S
+            self._slot_condition.wait_for(
+                lambda: self._slot_grab_count != requested_slot_grab_count or not self._frame_requested,
+                timeout=max(0.0, self.last_grab_at + GRABBER_STALE_AFTER_S - time.monotonic())
+            )
+
+            if self._slot_grab_count == requested_slot_grab_count:
+                self.read_failure_count += 1
+                return False, None
+
+            return True, self._slot_frame
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "grab_count": self.grab_count,
+            "grab_failure_count": self.grab_failure_count,
+        }
+
+    def _release_capture(self):
+        super()._release_capture()
+
+        with self._slot_condition:
+            self._slot_frame = None
+
+    def release(self):
+        """
+        Stop the grab thread, which releases the capture once its current grab() returns.
+        """
+
+        self._stop_event.set()
+
+        if self._grab_thread is None or not self._grab_thread.is_alive():
+            self._release_capture()
+            return
+
+        if self._grab_thread is not threading.current_thread():
+            self._grab_thread.join(timeout=GRABBER_STALE_AFTER_S)
+
+            if self._grab_thread.is_alive():
+                logging.warning(
+                    self.logging_prefix + "Grabber is still blocked in grab(), it releases the capture once it returns"
+                )
@@ -0,0 +1,54 @@
+import numpy as np
+
+from multiprocessing import shared_memory
+
+
+class SharedFrameRing:
+    """
+    Fixed number of frame slots in one multiprocessing.shared_memory block.
+
+    The owning process creates the ring; other processes attach to it by name. Frames are written to and read from
+    ndarray views of the slots, so only slot indices and frame shapes have to cross process boundaries.
+    """
+
+    def __init__(self, slot_count, slot_bytes, name=None):
+        """
+        :param slot_count: number of frame slots
+        :param slot_bytes: max size of a frame in bytes
+        :param name: name of an existing ring to attach to; a new ring is created if None
+        """
+
+        self.slot_count = slot_count
+        self.slot_bytes = slot_bytes
+        self.is_owner = name is None
+
+        self.shared_memory = shared_memory.SharedMemory(
+            name=name, create=self.is_owner, size=slot_count * slot_bytes
+        )
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def fits(self, frame):
+        return frame.nbytes <= self.slot_bytes
+
+    def view(self, slot, shape, dtype=np.uint8):
+        """
+        :return: ndarray of the given shape backed by the slot's memory (no copy)
+        """
+
+        return np.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf, offset=slot * self.slot_bytes)
+
+    def write(self, slot, frame):
+        """
+        Copy a frame into a slot.
+        """
+
+        self.view(slot, frame.shape, frame.dtype)[...] = frame
+
+    def close(self):
+        self.shared_memory.close()
+
+        if self.is_owner:
+            self.shared_memory.unlink()
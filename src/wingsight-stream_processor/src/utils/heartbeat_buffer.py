@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import update
+
+from models import StreamSubscription
+
+from config import HEARTBEAT_FLUSH_INTERVAL_S
+
+
+class HeartbeatBuffer:
+    """
+    Write-behind buffer for the per-frame heartbeat of subscriptions (last_frame_fetched_at, target_timestamp_ms).
+
+    Only the latest heartbeat of each subscription is kept. A background thread writes all of them every
+    flush_interval_s as one bulk UPDATE by primary key, so the commit rate doesn't grow with the number of streams.
+    Heartbeats in the DB are at most flush_interval_s stale, or longer while the DB is unreachable; shutdown() does a
+    final flush.
+    """
+
+    def __init__(self, session_factory, flush_interval_s=HEARTBEAT_FLUSH_INTERVAL_S):
+        """
+        :param session_factory: callable returning a new SQLAlchemy session
+        :param flush_interval_s: delay between two flushes
+        """
+
+        self.session_factory = session_factory
+        self.flush_interval_s = flush_interval_s
+
+        # subscription id -> (last_frame_fetched_at, target_timestamp_ms)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_flushes = 0
+        self.max_flush_s = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="heartbeat-flush", daemon=True)
+        self._thread.start()
+
+    def record(self, subscription_id, last_frame_fetched_at, target_timestamp_ms):
+        with self._lock:
+            self._pending[subscription_id] = (last_frame_fetched_at, target_timestamp_ms)
+
+    def flush(self):
+        """
+        Write the pending heartbeats. Heartbeats that fail to be written are kept for the next flush, unless a newer
+        one was recorded meanwhile.
+        :return: number of rows written
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            if not pending:
+                return 0
+
+            started_at = time.monotonic()
+            session = self.session_factory()
+
+            try:
+                session.execute(
+                    update(StreamSubscription),
+                    [
+                        {"id": subscription_id, "last_frame_fetched_at": fetched_at, "target_timestamp_ms": timestamp_ms}
+                        for subscription_id, (fetched_at, timestamp_ms) in pending.items()
+                    ]
+                )
+                session.commit()
+
+            except Exception as e:
+                session.rollback()
+                self.failed_flushes += 1
+                logging.error(f"[HeartbeatBuffer] Could not write {len(pending)} heartbeats, will retry: {e}")
+
+                with self._lock:
+                    for subscription_id, heartbeat in pending.items():
+                        self._pending.setdefault(subscription_id, heartbeat)
+                return 0
+
+            finally:
+                session.close()
+
+            self.flushes += 1
+            self.rows_written += len(pending)
+            self.max_flush_s = max(self.max_flush_s, time.monotonic() - started_at)
+
+            return len(pending)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval_s):
+            self.flush()
+
+    def shutdown(self):
+        self._stopping.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failed_flushes": self.failed_flushes,
+            "max_flush_s": round(self.max_flush_s, 3),
+        }
@@ -0,0 +1,109 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from config import (
+    MOTION_GATE_THRESHOLD, MOTION_GATE_PIXEL_DELTA, MOTION_GATE_FRAME_WIDTH,
+    MOTION_GATE_BACKGROUND_ALPHA, MOTION_GATE_MAX_SKIP_S, MOTION_GATE_STATS_EVERY
+)
+
+
+class MotionGate:
+    """
+    Pre-recognition gate of one subscription that only lets through frames whose scene changed.
+
+    Keeps a small grayscale running-average background of the stream. The change score of a frame is the fraction
+    of its downscaled pixels that differ from the background by more than MOTION_GATE_PIXEL_DELTA; frames scoring
+    below the threshold are skipped. A frame is forwarded at least every MOTION_GATE_MAX_SKIP_S seconds anyway.
+    """
+
+    def __init__(self, threshold=MOTION_GATE_THRESHOLD, logging_prefix=""):
+        """
+        :param threshold: fraction of changed pixels (0-1) a frame needs to be forwarded
+        :param logging_prefix: prefix for log messages of the owning stream
+        """
+
+        self.threshold = threshold
+        self.logging_prefix = logging_prefix
+
+        self.background = None
+        self.last_forwarded_at = 0.0
+
+        self.last_score = None
+        self.score_sum = 0.0
+        self.frames_seen = 0
+        self.frames_forwarded = 0
+        self.frames_skipped = 0
+
+    def _prepare(self, image):
+        height, width = image.shape[:2]
+        small_height = max(1, round(height * MOTION_GATE_FRAME_WIDTH / width))
+
+        small_image = cv2.resize(image, (MOTION_GATE_FRAME_WIDTH, small_height), interpolation=cv2.INTER_AREA)
+        if small_image.ndim == 3:
+            small_image = cv2.cvtColor(small_image, cv2.COLOR_BGR2GRAY)
+
+        return small_image.astype(np.float32)
+
+    def change_score(self, image):
+        """
+        Score a frame against the background and fold it into the background.
+        :param image: BGR or grayscale ndarray
+        :return: fraction of changed pixels (0-1); 1.0 for the first frame or a change of resolution
+        """
+
+        gray = self._prepare(image)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return 1.0
+
+        difference = cv2.absdiff(gray, self.background)
+        score = np.count_nonzero(difference > MOTION_GATE_PIXEL_DELTA) / difference.size
+
+        cv2.accumulateWeighted(gray, self.background, MOTION_GATE_BACKGROUND_ALPHA)
+
+        return float(score)
+
+    def should_recognize(self, image):
+        """
+        :param image: BGR or grayscale ndarray
+        :return: whether the frame changed enough to be recognized
+        """
+
+        score = self.change_score(image)
+        now = time.monotonic()
+
+        self.last_score = score
+        self.score_sum += score
+        self.frames_seen += 1
+
+        forward = score >= self.threshold or now - self.last_forwarded_at >= MOTION_GATE_MAX_SKIP_S
+
+        if forward:
+            self.frames_forwarded += 1
+            self.last_forwarded_at = now
+        else:
+            self.frames_skipped += 1
+
+        logging.debug(
+            self.logging_prefix + f"Motion gate score {score:.4f} (threshold {self.threshold}): "
+                                  f"{'forwarded' if forward else 'skipped'}"
+        )
+
+        if self.frames_seen % MOTION_GATE_STATS_EVERY == 0:
+            logging.info(self.logging_prefix + f"Motion gate stats: {self.stats()}")
+
+        return forward
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "last_score": self.last_score,
+            "mean_score": self.score_sum / self.frames_seen if self.frames_seen else None,
+            "frames_seen": self.frames_seen,
+            "frames_forwarded": self.frames_forwarded,
+            "frames_skipped": self.frames_skipped,
+        }
@@ -0,0 +1,343 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import requests
+
+from botocore.config import Config
+
+from config import (
+    AWS_REGION, API_URL, NOTIFICATION_COALESCE_WINDOW_S, NOTIFICATION_QUEUE_SIZE, NOTIFICATION_PUBLISH_WORKERS,
+    NOTIFICATION_STATS_EVERY, POLLY_API_TIMEOUT_S
+)
+
+
+class DetectionNotification:
+    """
+    One detection to notify a user about, with everything needed to render the message.
+    """
+
+    __slots__ = (
+        "user_id", "topic_arn", "email", "stream_subscription_id", "stream_url", "stream_ordinal", "species",
+        "confidence", "detected_at", "queued_at"
+    )
+
+    def __init__(self, user_id, topic_arn, email, stream_subscription_id, stream_url, stream_ordinal, species,
+                 confidence, detected_at):
+        self.user_id = user_id
+        self.topic_arn = topic_arn
+        self.email = email
+        self.stream_subscription_id = stream_subscription_id
+        self.stream_url = stream_url
+        self.stream_ordinal = stream_ordinal
+        self.species = species
+        self.confidence = confidence
+        self.detected_at = detected_at
+        self.queued_at = time.monotonic()
+
+    @property
+    def stream_name(self):
+        return "Your Stream" if self.stream_ordinal is None else f"Your Stream #{self.stream_ordinal}"
+
+
+def group_repeats(notifications):
+    """
+    Collapse detections of the same species in the same stream.
+    :param notifications: detections of one user, oldest first
+    :return: [(first DetectionNotification, count, max confidence, last detected at)], in order of first detection
+    """
+
+    groups = {}
+    for notification in notifications:
+        key = (notification.stream_subscription_id, notification.species)
+
+        if key not in groups:
+            groups[key] = (notification, 0, notification.confidence, notification.detected_at)
+
+        first, count, confidence, _ = groups[key]
+        groups[key] = (first, count + 1, max(confidence, notification.confidence), notification.detected_at)
+
+    return list(groups.values())
+
+
+def render_message(notifications):
+    """
+    :param notifications: detections of one user, oldest first
+    :return: (subject, message) of the SNS message
+    """
+
+    if len(notifications) == 1:
+        notification = notifications[0]
+        subject = f"WingSight: {notification.species} Detected in {notification.stream_name}!"
+        message = f"""
+                        🦜 Bird Detection Alert! 🦜
+
+                        A {notification.species} was detected in your stream! (Confidence: {notification.confidence:.2f}%)
+                        Stream: {notification.stream_url}
+                        Detected at: {notification.detected_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+                        Log in to WingSight to view more details.
+                        """
+        return subject, message
+
+    species = list(dict.fromkeys(notification.species for notification in notifications))
+    subject = f"WingSight: {len(notifications)} Bird Detections in Your Streams!"
+    if len(species) == 1:
+        subject = f"WingSight: {species[0]} Detected {len(notifications)} Times in Your Streams!"
+
+    lines = []
+    for notification, count, confidence, detected_at in group_repeats(notifications):
+        details = f"{confidence:.2f}%) at" if count == 1 else f"{count} times, up to {confidence:.2f}%) last at"
+        lines.append(
+            f"                        - {notification.species} in {notification.stream_name.replace('Your ', '')} "
+            f"({details} {detected_at.strftime('%Y-%m-%d %H:%M:%S')}: {notification.stream_url}"
+        )
+    detection_lines = "\n".join(lines)
+    message = f"""
+                        🦜 Bird Detection Alert! 🦜
+
+                        {len(notifications)} birds were detected in your streams:
+{detection_lines}
+
+                        Log in to WingSight to view more details.
+                        """
+
+    # SNS subjects are limited to 100 characters
+    return subject[:100], message
+
+
+class NotificationDispatcher:
+    """
+    Sends detection notifications in the background, so frame processing never waits for SNS or the Polly API.
+
+    Notifications are queued and coalesced per user: the first detection of a user is sent right away and opens a
+    window of NOTIFICATION_COALESCE_WINDOW_S; everything detected for that user until it closes is sent as one message,
+    with repeats of a species in a stream counted instead of listed. A window that sent a message is followed by
+    another one, so a busy user gets at most one message per window. Messages are published by a small pool sharing
+    one SNS client. Delivery latency and per-user rates are logged every NOTIFICATION_STATS_EVERY messages.
+    """
+
+    def __init__(self, coalesce_window_s=NOTIFICATION_COALESCE_WINDOW_S):
+        self.coalesce_window_s = coalesce_window_s
+
+        self.sns = boto3.client(
+            "sns",
+            region_name=AWS_REGION,
+            config=Config(max_pool_connections=NOTIFICATION_PUBLISH_WORKERS)
+        )
+        self.http = requests.Session()
+        self.publish_pool = ThreadPoolExecutor(
+            max_workers=NOTIFICATION_PUBLISH_WORKERS, thread_name_prefix="notification-publish"
+        )
+
+        self._notifications = queue.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+        # user id -> (window closes at, [DetectionNotification] detected since the window opened)
+        self._pending = {}
+
+        self._stats_lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.detections = 0
+        self.dropped = 0
+        self.messages_sent = 0
+        self.publish_failures = 0
+        self.latency_s_total = 0.0
+        self.latency_s_max = 0.0
+        self.detections_per_user = defaultdict(int)
+        self.messages_per_user = defaultdict(int)
+
+        self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+        self._thread.start()
+
+    def notify(self, notification):
+        """
+        Queue a detection without waiting for it to be sent.
+        :return: whether the detection was queued
+        """
+
+        try:
+            self._notifications.put_nowait(notification)
+
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+
+            logging.error(f"[NotificationDispatcher] Queue is full, dropping notification for user {notification.user_id}")
+            return False
+
+        return True
+
+    def _run(self):
+        while True:
+            next_due_at = min((due_at for due_at, _ in self._pending.values()), default=None)
+            timeout_s = None if next_due_at is None else max(0.0, next_due_at - time.monotonic())
+
+            try:
+                notification = self._notifications.get(timeout=timeout_s)
+
+            except queue.Empty:
+                self._flush_due()
+                continue
+
+            # None is queued by shutdown()
+            if notification is None:
+                self._flush_due(flush_all=True)
+                return
+
+            self._add(notification)
+            self._flush_due()
+
+    def _add(self, notification):
+        with self._stats_lock:
+            self.detections += 1
+            self.detections_per_user[notification.user_id] += 1
+
+        # the Polly audio is requested right away, it doesn't go out to the user
+        self.publish_pool.submit(self._request_audio, notification.species)
+
+        if notification.user_id not in self._pending:
+            # nothing was sent to the user lately, so the detection goes out right away
+            self._pending[notification.user_id] = (time.monotonic() + self.coalesce_window_s, [])
+            self.publish_pool.submit(self._publish, [notification])
+            return
+
+        self._pending[notification.user_id][1].append(notification)
+
+    def _flush_due(self, flush_all=False):
+        now = time.monotonic()
+        due_user_ids = [user_id for user_id, (due_at, _) in self._pending.items() if flush_all or due_at <= now]
+
+        for user_id in due_user_ids:
+            _, notifications = self._pending.pop(user_id)
+            if not notifications:
+                continue
+
+            self.publish_pool.submit(self._publish, notifications)
+
+            if not flush_all:
+                self._pending[user_id] = (now + self.coalesce_window_s, [])
+
+    def _request_audio(self, species):
+        """
+        Create a new audio file of the species name if it does not exist already.
+        """
+
+        try:
+            response = self.http.post(
+                API_URL,
+                headers={"Content-Type": "application/json"},
+                data=json.dumps({"text": str(species)}),
+                timeout=POLLY_API_TIMEOUT_S
+            )
+            if response.status_code == 200:
+                logging.info(f"{response.text}")
+            else:
+                logging.error(f"Failed to send bird type to Lambda: {response.status_code}, {response.text}")
+
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error while calling Lambda function: {str(e)}")
+
+    def _publish(self, notifications):
+        """
+        :param notifications: detections of one user to send as one message, oldest first
+        """
+
+        topic_arn = notifications[0].topic_arn
+        subject, message = render_message(notifications)
+
+        try:
+            self.sns.publish(TopicArn=topic_arn, Message=message, Subject=subject)
+
+        except Exception as e:
+            logging.error(f"Failed to send notification about {len(notifications)} detections to {topic_arn}: {str(e)}")
+            self._record(notifications, failed=True)
+            return
+
+        logging.info(f"Notification about {len(notifications)} detections sent to {notifications[0].email}")
+        self._record(notifications, failed=False)
+
+    def _record(self, notifications, failed):
+        # delivery latency is measured from the oldest detection in the message
+        latency_s = time.monotonic() - notifications[0].queued_at
+
+        with self._stats_lock:
+            if failed:
+                self.publish_failures += 1
+                return
+
+            self.messages_sent += 1
+            self.messages_per_user[notifications[0].user_id] += 1
+            self.latency_s_total += latency_s
+            self.latency_s_max = max(self.latency_s_max, latency_s)
+
+            log_stats = self.messages_sent % NOTIFICATION_STATS_EVERY == 0
+
+        if log_stats:
+            logging.info(f"[NotificationDispatcher] Stats: {self.stats()}")
+
+    def shutdown(self, timeout_s=10):
+        """
+        Send the notifications still waiting for their coalescing window to close.
+        """
+
+        try:
+            self._notifications.put(None, timeout=timeout_s)
+        except queue.Full:
+            logging.error("[NotificationDispatcher] Queue is full, pending notifications are lost")
+            return
+
+        self._thread.join(timeout_s)
+        self.publish_pool.shutdown(wait=True)
+
+    def stats(self, top_users=5):
+        with self._stats_lock:
+            elapsed_h = max(time.monotonic() - self.started_at, 1.0) / 3600
+            busiest_user_ids = sorted(
+                self.detections_per_user, key=self.detections_per_user.get, reverse=True
+            )[:top_users]
+
+            return {
+                "detections": self.detections,
+                "dropped": self.dropped,
+                "messages_sent": self.messages_sent,
+                "publish_failures": self.publish_failures,
+                "queued": self._notifications.qsize(),
+                "mean_latency_s": round(self.latency_s_total / self.messages_sent, 3) if self.messages_sent else None,
+                "max_latency_s": round(self.latency_s_max, 3),
+                "busiest_users_per_h": {
+                    user_id: {
+                        "detections": round(self.detections_per_user[user_id] / elapsed_h, 1),
+                        "messages": round(self.messages_per_user[user_id] / elapsed_h, 1),
+                    }
+                    for user_id in busiest_user_ids
+                },
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_notification_dispatcher():
+    """
+    The dispatcher is created once per process and shared by all streams.
+    """
+
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+
+        return _dispatcher
+
+
+def shutdown_notification_dispatcher():
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.shutdown()
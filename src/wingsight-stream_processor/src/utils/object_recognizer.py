@@ -1,17 +1,24 @@
+import time
 import logging
-import boto3
 import json
-import requests
 import numpy as np
 
 from .s3_thumbnail_uploader import put_to_bucket
 
 from datetime import datetime, UTC
 
-from utils.rekognition_client import RekognitionClient
-from models import StreamSubscription, RecognitionEntry, User
+from utils.recognizer_backends import get_recognizer_backend
+from utils.motion_gate import MotionGate
+from utils.recognition_cache import PerceptualHashCache
+from utils.frame_encoder import EncodedFrame
+from utils.payload_planner import PayloadStats
+from utils.detection_state import DetectionState
+from utils.detection_sink import get_detection_sink
+from utils.notification_dispatcher import DetectionNotification, get_notification_dispatcher
+from models import StreamSubscription, User
 
-from config import AWS_REGION, API_URL
+from config import MOTION_GATE_ENABLED, MOTION_GATE_THRESHOLD, MOTION_GATE_THRESHOLD_OVERRIDES
+from config import RECOGNITION_CACHE_ENABLED
 
 
 class ObjectRecognizer:
@@ -21,25 +28,61 @@ class ObjectRecognizer:
 
     def __init__(
             self,
-            db_session,
-            stream_subscription_id
+            session_factory,
+            stream_subscription_id,
+            shared_results=None
     ):
-        self.db_session = db_session
+        self.session_factory = session_factory
         self.stream_subscription_id = stream_subscription_id
-        self.rekognition_client = RekognitionClient()
+        # SharedRecognitionResults of the stream, shared with the other subscriptions to the same source
+        self.shared_results = shared_results
+        self.recognizer_backend = get_recognizer_backend()
 
-    def handle_image_objects(self, image=None, target_species=None):
+        self.motion_gate = None
+        if MOTION_GATE_ENABLED:
+            self.motion_gate = MotionGate(
+                threshold=MOTION_GATE_THRESHOLD_OVERRIDES.get(str(stream_subscription_id), MOTION_GATE_THRESHOLD),
+                logging_prefix=f"[StreamSubscription {stream_subscription_id}] "
+            )
+
+        self.recognition_cache = PerceptualHashCache() if RECOGNITION_CACHE_ENABLED else None
+        self.detection_state = None
+        self.detection_sink = get_detection_sink(session_factory)
+        self.payload_stats = PayloadStats(logging_prefix=f"[StreamSubscription {stream_subscription_id}] ")
+
+    def _classify_with_backend(self, encoded_frame):
+        started_at = time.monotonic()
+        result = self.recognizer_backend.classify_frame(encoded_frame)
+
+        # the payload is only encoded by backends that send it
+        payload_bytes = len(encoded_frame.rekognition_jpeg) if encoded_frame.has_rekognition_jpeg else 0
+        self.payload_stats.record(payload_bytes, time.monotonic() - started_at)
+
+        return result
+
+    def _classify(self, encoded_frame):
+        """Classify the frame, reusing the result of a near-identical earlier frame if there is one"""
+        if self.recognition_cache is None:
+            return self._classify_with_backend(encoded_frame)
+
+        return self.recognition_cache.get_or_classify(
+            encoded_frame.image, lambda _: self._classify_with_backend(encoded_frame)
+        )
+
+    def handle_image_objects(self, image=None, target_species=None, frame_id=None, region_key=None):
         """
-        Analyze the image for birds using Rekognition and create recognition entries
+        Analyze the image for birds using the recognizer backend and create recognition entries
         for any birds detected.
         
-        1. Analyze the image for birds using Rekognition;
+        1. Analyze the image for birds using the recognizer backend (Rekognition or local model);
         2. Create recognition entries in the DB for any birds detected;
         3. Notify user through SNS if matches with desired species.
         
         Args:
             image: The image data as numpy array (uses last_fetched_frame if None)
             target_species: Optional list of specific bird species to detect (uses stored targets if None)
+            frame_id: Optional id of the frame in the shared stream, to reuse a result computed for another subscriber
+            region_key: Optional key of the region of interest the image was cropped to
         
         Returns:
             (success, message) tuple
@@ -53,11 +96,23 @@ class ObjectRecognizer:
                 logging.error(f"Invalid image type: {type(img)}, expected numpy array")
                 return False, "Invalid image format"
 
+            # Skip frames whose scene didn't change since the previous ones
+            if self.motion_gate is not None and not self.motion_gate.should_recognize(img):
+                return False, "No scene change"
+
             # Get target species (from parameter, database, or empty list)
             species_targets = self._get_target_species(target_species)
+
+            # JPEG payloads for recognition and thumbnail are encoded at most once per frame
+            encoded_frame = EncodedFrame(img)
             
-            # Process image with Rekognition
-            result = self.rekognition_client.classify_numpy_array(img)
+            # Classify the image, once per frame for all subscribers of the same stream
+            if self.shared_results is not None and frame_id is not None:
+                result = self.shared_results.get_recognition_result(
+                    frame_id, lambda: self._classify(encoded_frame), key=region_key
+                )
+            else:
+                result = self._classify(encoded_frame)
             
             # Exit early if no birds detected
             if not result.get("bird_detected", False) or not result.get("primary_species"):
@@ -66,18 +121,11 @@ class ObjectRecognizer:
             # Extract bird detection details
             primary_species = result.get('primary_species')
             primary_confidence = result.get('primary_confidence', 0)
-            is_specific_bird = primary_species in self.rekognition_client.specific_bird_species
+            is_specific_bird = primary_species in self.recognizer_backend.specific_bird_species
             
-            # Simple anti-spam filter: Check if the most recent detection is the same species
-            last_entry = (
-            self.db_session.query(RecognitionEntry)
-            .filter_by(stream_subscription_id=self.stream_subscription_id)
-            .order_by(RecognitionEntry.earth_timestamp.desc())
-            .first()
-        )
-            
-            # If the last detection was the same species, skip
-            if last_entry and last_entry.recognized_specie_name == primary_species:
+            # Anti-spam filter: skip the species detected last until its cooldown has passed
+            detection_state = self._get_detection_state()
+            if detection_state.is_duplicate(primary_species):
                 logging.info(f"[StreamSubscription {self.stream_subscription_id}] Skipping duplicate detection for {primary_species}")
                 return False, f"Duplicate detection of {primary_species} skipped"
             
@@ -93,26 +141,26 @@ class ObjectRecognizer:
             # Log detection
             logging.info(f"Bird detected: {primary_species} with confidence {primary_confidence:.2f}%")
             
-            # Save detection to database with S3 image
+            # Save detection to database with S3 image, inserted in bulk by the detection sink
             try:
-                s3_img_url = put_to_bucket(image, self.stream_subscription_id)
-
-                entry = RecognitionEntry(
-                        stream_subscription_id=self.stream_subscription_id,
-                        earth_timestamp=datetime.now(UTC),
-                        stream_timestamp=datetime.now(UTC),
-                        recognized_specie_name=result.get('primary_species'),
-                        recognized_specie_img_url=s3_img_url
-                )
-                self.db_session.add(entry)
-                self.db_session.commit()
+                s3_img_url = put_to_bucket(encoded_frame.thumbnail_jpeg, self.stream_subscription_id)
+
+                detected_at = datetime.now(UTC)
+                self.detection_sink.add({
+                    "stream_subscription_id": self.stream_subscription_id,
+                    "earth_timestamp": detected_at,
+                    "stream_timestamp": detected_at,
+                    "recognized_specie_name": result.get('primary_species'),
+                    "recognized_specie_img_url": s3_img_url
+                })
+                detection_state.record(primary_species, detected_at)
             
             except Exception as e:
                 logging.error(f"Error saving bird detection: {str(e)}")
                 return False, f"Error saving detection: {str(e)}"
             
             try:
-                stream_subscription = self.db_session.get(StreamSubscription, self.stream_subscription_id)
+                stream_subscription = self._get(StreamSubscription, self.stream_subscription_id)
             except Exception as e:
                 logging_prefix = f"[StreamSubscription {self.stream_subscription_id}] "
                 logging.error(logging_prefix + f"Error while accessing database: {e}")
@@ -121,7 +169,7 @@ class ObjectRecognizer:
             # Send notification if confidence is high enough
             should_notify = (primary_confidence > 90 or is_specific_bird) and stream_subscription.provide_notification
             if should_notify:
-                return self.notify_user(primary_species, primary_confidence)
+                return self.notify_user(primary_species, primary_confidence, stream_subscription=stream_subscription)
                 
             return True, f"Bird {primary_species} detected and recorded"
             
@@ -129,6 +177,19 @@ class ObjectRecognizer:
             logging.error(f"Error in bird recognition: {str(e)}")
             return False, f"Error in recognition: {str(e)}"
         
+    def _get(self, model, object_id):
+        """Load an object in a short-lived session, it stays readable after the session is closed"""
+        with self.session_factory() as session:
+            return session.get(model, object_id)
+
+    def _get_detection_state(self):
+        """Load the last detection from the database the first time it is needed, then keep it in memory"""
+        if self.detection_state is None:
+            with self.session_factory() as session:
+                self.detection_state = DetectionState.load(session, self.stream_subscription_id)
+
+        return self.detection_state
+
     def _get_target_species(self, target_species=None):
         """Helper method to get target species from parameter or database"""
         if target_species is not None:
@@ -136,7 +197,7 @@ class ObjectRecognizer:
             
         try:
             # Refresh subscription data from database
-            fresh_subscription = self.db_session.get(StreamSubscription, self.stream_subscription_id)
+            fresh_subscription = self._get(StreamSubscription, self.stream_subscription_id)
             if fresh_subscription.target_bird_species:
                 return json.loads(fresh_subscription.target_bird_species)
         except (json.JSONDecodeError, Exception) as e:
@@ -145,41 +206,27 @@ class ObjectRecognizer:
         return []  # Default to empty list if no targets found
             
 
-    def notify_user(self, species, confidence):
+    def notify_user(self, species, confidence, stream_subscription=None):
+        """
+        Queue a notification about the detection; it is sent in the background by the NotificationDispatcher.
+        :param stream_subscription: the subscription if already loaded, it is loaded otherwise
+        """
+
         logging_prefix = f"[StreamSubscription {self.stream_subscription_id}] "
 
-        try:
-            stream_subscription = self.db_session.get(StreamSubscription, self.stream_subscription_id)
-        except Exception as e:
-            logging.error(logging_prefix + f"Error while accessing database: {e}")
-            return False, f"Error accessing database: {str(e)}"
+        if stream_subscription is None:
+            try:
+                stream_subscription = self._get(StreamSubscription, self.stream_subscription_id)
+            except Exception as e:
+                logging.error(logging_prefix + f"Error while accessing database: {e}")
+                return False, f"Error accessing database: {str(e)}"
         
         if not stream_subscription.provide_notification:
             return False, "Notifications are disabled for this subscription"
-        
-        apiUrl = API_URL   # Create a new audio file if it does not exist already.
-        logging.info(f"Polly API: {apiUrl}")
-        headers = {
-            "Content-Type": "application/json"
-        }
-        payload = { 
-            "text" : str(species)
-        }
-        # FRONTEND will use lambda GET to get the bird type from DB
-        try:
-            response = requests.post(apiUrl, headers=headers, data=json.dumps(payload))
-            if response.status_code == 200:
-                logging.info(f"{response.text}")
-            else:
-                logging.error(f"Failed to send bird type to Lambda: {response.status_code}, {response.text}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error while calling Lambda function: {str(e)}")
 
         try:
-            sns = boto3.client("sns", region_name=AWS_REGION)
-            
             try:
-                user = self.db_session.get(User, stream_subscription.user_id)
+                user = self._get(User, stream_subscription.user_id)
             except Exception as e:
                 logging.error(f"Error accessing user: {e}")
                 return False, f"Error accessing user: {str(e)}"
@@ -187,58 +234,29 @@ class ObjectRecognizer:
             if not user.sns_topic_arn:
                 logging.warning(f"User {user.id} doesn't have an SNS topic ARN")
                 return False, "User doesn't have an SNS topic configured"
-                
-            # Get count of user's streams for better notification
-            user_stream_count = (
-                self.db_session.query(StreamSubscription)
-                .filter_by(user_id=user.id)
-                .count()
-            )
 
-            logging.info(logging_prefix + f'user stream count : {user_stream_count}')
-            
-            # Get position of this stream in user's streams
-            user_stream_position = 1  # Default to 1 if we can't determine position
-            if user_stream_count > 1:
-                try:
-                    # Find this stream's position for the user
-                    user_streams = (
-                        self.db_session.query(StreamSubscription)
-                        .filter_by(user_id=user.id)
-                        .order_by(StreamSubscription.created_at)
-                        .all()
-                    )
-                    for i, sub in enumerate(user_streams, 1):
-                        if sub.id == self.stream_subscription_id:
-                            user_stream_position = i
-                            break
-                except Exception as e:
-                    logging.error(f"Error determining stream position: {e}")
-            
-            # Create a more informative subject line
-            if user_stream_count == 1:
-                subject = f"WingSight: {species} Detected in Your Stream!"
-            else:
-                subject = f"WingSight: {species} Detected in Your Stream #{user_stream_position}!"
+            # users with a single stream just read "Your Stream", the ordinal only tells several streams apart; both the
+            # count and the ordinals are kept by the server over the user's active subscriptions
+            stream_ordinal = None
+            if (user.active_subscription_count or 0) > 1:
+                stream_ordinal = stream_subscription.display_ordinal
                 
-            message = f"""
-                        🦜 Bird Detection Alert! 🦜
-                        
-                        A {species} was detected in your stream! (Confidence: {confidence:.2f}%)
-                        Stream: {stream_subscription.url}
-                        Detected at: {datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')}
-                        
-                        Log in to WingSight to view more details.
-                        """
-
-            response = sns.publish(
-                TopicArn=user.sns_topic_arn,
-                Message=message,
-                Subject=subject
+            notification = DetectionNotification(
+                user_id=user.id,
+                topic_arn=user.sns_topic_arn,
+                email=user.email,
+                stream_subscription_id=self.stream_subscription_id,
+                stream_url=stream_subscription.url,
+                stream_ordinal=stream_ordinal,
+                species=species,
+                confidence=confidence,
+                detected_at=datetime.now(UTC)
             )
-            return True, f"Notification about {species} sent to {user.email}"
+
+            if not get_notification_dispatcher().notify(notification):
+                return False, "Notification queue is full"
+
+            return True, f"Notification about {species} queued for {user.email}"
         except Exception as e:
             logging.error(f"Failed to send notification: {str(e)}")
             return False, f"Failed to send notification: {str(e)}"
-            
-
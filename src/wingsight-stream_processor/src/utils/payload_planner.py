@@ -0,0 +1,116 @@
+import logging
+
+import cv2
+
+from config import (
+    REKOGNITION_JPEG_QUALITY, REKOGNITION_TARGET_LONG_EDGE, REKOGNITION_PAYLOAD_BYTE_BUDGET,
+    REKOGNITION_MIN_JPEG_QUALITY, PAYLOAD_STATS_EVERY
+)
+
+
+# DetectLabels rejects inline images larger than this
+REKOGNITION_MAX_INLINE_BYTES = 5 * 1024 * 1024
+
+
+class PayloadPlanner:
+    """
+    Picks the size and JPEG quality of the image sent to Rekognition.
+
+    The frame is downscaled to a target long edge, then encoded at decreasing quality until it fits the byte budget.
+    If it still exceeds the 5 MB inline limit at the lowest quality, it is downscaled further until it fits.
+    """
+
+    def __init__(self, target_long_edge=REKOGNITION_TARGET_LONG_EDGE, byte_budget=REKOGNITION_PAYLOAD_BYTE_BUDGET,
+                 max_quality=REKOGNITION_JPEG_QUALITY, min_quality=REKOGNITION_MIN_JPEG_QUALITY):
+        """
+        :param target_long_edge: max length of the longer image edge in pixels, 0 to keep the frame size
+        :param byte_budget: preferred max payload size in bytes
+        :param max_quality: JPEG quality tried first
+        :param min_quality: lowest JPEG quality tried
+        :raises ValueError: if min_quality is above max_quality
+        """
+
+        if min_quality > max_quality:
+            raise ValueError(f"Min JPEG quality {min_quality} is above max JPEG quality {max_quality}")
+
+        self.target_long_edge = target_long_edge
+        self.byte_budget = min(byte_budget, REKOGNITION_MAX_INLINE_BYTES)
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+
+        # steps of 10 from the max, always ending with the min
+        self.qualities = list(range(max_quality, min_quality, -10)) + [min_quality]
+
+    @staticmethod
+    def _downscale(image, long_edge):
+        height, width = image.shape[:2]
+        scale = long_edge / max(height, width)
+
+        if scale >= 1:
+            return image
+
+        return cv2.resize(
+            image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA
+        )
+
+    def plan(self, image):
+        """
+        :param image: BGR or grayscale ndarray
+        :return: JPEG bytes within the byte budget where possible, and always within the inline limit
+        :raises ValueError: if the image could not be encoded
+        """
+
+        if self.target_long_edge:
+            image = self._downscale(image, self.target_long_edge)
+
+        while True:
+            for quality in self.qualities:
+                encoded, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if not encoded:
+                    raise ValueError(f"Could not encode image of shape {image.shape} to JPEG")
+
+                payload = buffer.tobytes()
+                if len(payload) <= self.byte_budget:
+                    return payload
+
+            if len(payload) <= REKOGNITION_MAX_INLINE_BYTES:
+                return payload
+
+            image = self._downscale(image, int(max(image.shape[:2]) * 0.75))
+
+
+class PayloadStats:
+    """
+    Sizes and recognition latencies of the payloads of one stream, logged every PAYLOAD_STATS_EVERY calls.
+    """
+
+    def __init__(self, logging_prefix=""):
+        self.logging_prefix = logging_prefix
+
+        self.calls = 0
+        self.bytes_total = 0
+        self.bytes_max = 0
+        self.latency_s_total = 0.0
+        self.latency_s_max = 0.0
+
+    def record(self, payload_bytes, latency_s):
+        self.calls += 1
+        self.bytes_total += payload_bytes
+        self.bytes_max = max(self.bytes_max, payload_bytes)
+        self.latency_s_total += latency_s
+        self.latency_s_max = max(self.latency_s_max, latency_s)
+
+        if self.calls % PAYLOAD_STATS_EVERY == 0:
+            logging.info(self.logging_prefix + f"Recognition payload stats: {self.stats()}")
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "mean_bytes": self.bytes_total // self.calls if self.calls else None,
+            "max_bytes": self.bytes_max,
+            "mean_latency_s": round(self.latency_s_total / self.calls, 3) if self.calls else None,
+            "max_latency_s": round(self.latency_s_max, 3),
+        }
+
+
+default_payload_planner = PayloadPlanner()
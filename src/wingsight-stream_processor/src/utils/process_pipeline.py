@@ -0,0 +1,272 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+from utils.frame_ring import SharedFrameRing
+from utils.rekognition_dispatcher import SharedTokenBucket, use_shared_token_bucket
+
+from config import FRAME_RING_FREE_SLOT_TIMEOUT_S, ANALYSIS_PROCESS_CHECK_INTERVAL_S, REKOGNITION_TPS, REKOGNITION_BURST
+
+
+def analysis_worker(ring_name, slot_count, slot_bytes, task_queue, done_queue, token_bucket):
+    """
+    Entry point of an analysis process. Recognizes objects in frames taken from shared memory slots.
+
+    All subscriptions to the same source are routed to the same process, so each subscription's motion gate,
+    recognition cache and detection state see all of its frames, and a frame shared by several subscriptions is
+    classified once. A ("release", subscription_id, source_url) task drops the subscription's ObjectRecognizer.
+    """
+
+    # imported here so that only analysis processes pay for DB and AWS client setup
+    from utils.object_recognizer import ObjectRecognizer
+    from utils.stream_registry import SharedRecognitionResults
+    from utils.detection_sink import shutdown_detection_sink
+    from utils.notification_dispatcher import shutdown_notification_dispatcher
+    from utils.s3_thumbnail_uploader import shutdown_thumbnail_uploader
+    from utils.database import create_session_factory
+    from config import ANALYSIS_DB_POOL_SIZE
+
+    logging.basicConfig(level=logging.INFO)
+
+    # all processes together stay under REKOGNITION_TPS
+    use_shared_token_bucket(token_bucket)
+
+    ring = SharedFrameRing(slot_count, slot_bytes, name=ring_name)
+    Session = create_session_factory(pool_size=ANALYSIS_DB_POOL_SIZE, max_overflow=2)
+    object_recognizers = {}
+    # source url -> (SharedRecognitionResults, ids of the subscriptions to the source)
+    shared_results = {}
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        if task[0] == "release":
+            _, subscription_id, source_url = task
+            object_recognizers.pop(subscription_id, None)
+
+            if source_url in shared_results:
+                shared_results[source_url][1].discard(subscription_id)
+                if not shared_results[source_url][1]:
+                    del shared_results[source_url]
+            continue
+
+        _, slot, ticket, shape, dtype, subscription_id, source_url, frame_id, region_key, target_species = task
+
+        try:
+            if subscription_id not in object_recognizers:
+                results, subscription_ids = shared_results.setdefault(source_url, (SharedRecognitionResults(), set()))
+                subscription_ids.add(subscription_id)
+
+                object_recognizers[subscription_id] = ObjectRecognizer(
+                    session_factory=Session,
+                    stream_subscription_id=subscription_id,
+                    shared_results=results
+                )
+
+            frame = ring.view(slot, shape, dtype)
+            result = object_recognizers[subscription_id].handle_image_objects(
+                frame, target_species, frame_id=frame_id, region_key=region_key
+            )
+
+        except Exception as e:
+            result = (False, f"Error in analysis process: {e}")
+
+        done_queue.put((slot, ticket, result))
+
+    shutdown_detection_sink()
+    shutdown_notification_dispatcher()
+    shutdown_thumbnail_uploader()
+
+    ring.close()
+
+
+class ProcessFramePipeline:
+    """
+    Runs object recognition in a pool of analysis processes, so that colour conversion, encoding and resizing
+    scale with the number of cores instead of sharing one interpreter's GIL.
+
+    Frames are copied once into a SharedFrameRing slot; only the slot index, the frame shape and the subscription
+    metadata are sent to the analysis processes. A slot is reused once its frame has been processed. Each process
+    has its own task queue, and all subscriptions to a source always go to the same one (see route()).
+
+    A process that dies is respawned with a new task queue; the frames it had not handled fail and their slots are
+    reused. Each frame carries a ticket, so a late result of a dead process never resolves a newer frame's Future.
+    """
+
+    def __init__(self, process_count, slot_count, slot_bytes):
+        """
+        :param process_count: number of analysis processes
+        :param slot_count: number of shared frame slots, i.e. max frames in flight
+        :param slot_bytes: max size of a frame in bytes
+        """
+
+        self.ring = SharedFrameRing(slot_count, slot_bytes)
+
+        # spawn, since forking a process that already runs threads is unsafe
+        self._context = multiprocessing.get_context("spawn")
+
+        # Rekognition calls of the analysis processes and of this process share one rate
+        self.token_bucket = SharedTokenBucket(rate=REKOGNITION_TPS, capacity=REKOGNITION_BURST, context=self._context)
+        use_shared_token_bucket(self.token_bucket)
+        self.done_queue = self._context.Queue()
+
+        self.free_slots = queue.Queue()
+        for slot in range(slot_count):
+            self.free_slots.put(slot)
+
+        # slot -> (ticket, index of the analysis process, Future)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_ticket = 0
+        self._stopping = False
+
+        self.respawn_count = 0
+
+        self.task_queues = []
+        self.processes = []
+        for _ in range(process_count):
+            task_queue, process = self._spawn()
+            self.task_queues.append(task_queue)
+            self.processes.append(process)
+
+        self._collector_thread = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector_thread.start()
+
+    def _spawn(self):
+        task_queue = self._context.Queue()
+        process = self._context.Process(
+            target=analysis_worker,
+            args=(
+                self.ring.name, self.ring.slot_count, self.ring.slot_bytes, task_queue, self.done_queue,
+                self.token_bucket
+            ),
+            daemon=True
+        )
+        process.start()
+
+        return task_queue, process
+
+    def _collect_results(self):
+        checked_at = time.monotonic()
+
+        while True:
+            try:
+                item = self.done_queue.get(timeout=ANALYSIS_PROCESS_CHECK_INTERVAL_S)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+
+            if item:
+                slot, ticket, result = item
+
+                with self._pending_lock:
+                    # a late result of a dead process whose slot was reused meanwhile
+                    if slot not in self._pending or self._pending[slot][0] != ticket:
+                        continue
+                    _, _, future = self._pending.pop(slot)
+
+                self.free_slots.put(slot)
+                future.set_result(result)
+
+            if time.monotonic() - checked_at >= ANALYSIS_PROCESS_CHECK_INTERVAL_S:
+                checked_at = time.monotonic()
+                self._respawn_dead_processes()
+
+    def _respawn_dead_processes(self):
+        for index, process in enumerate(self.processes):
+            if self._stopping or process.is_alive():
+                continue
+
+            logging.error(f"[ProcessFramePipeline] Analysis process {index} died with exit code {process.exitcode}")
+            task_queue, process = self._spawn()
+            self.respawn_count += 1
+
+            # frames submitted from now on go to the new process, the ones routed to the dead process are lost
+            with self._pending_lock:
+                self.task_queues[index] = task_queue
+                self.processes[index] = process
+                lost = [slot for slot, (_, process_index, _) in self._pending.items() if process_index == index]
+                futures = [self._pending.pop(slot)[2] for slot in lost]
+
+            for slot in lost:
+                self.free_slots.put(slot)
+
+            for future in futures:
+                future.set_exception(RuntimeError(f"Analysis process {index} died before handling the frame"))
+
+    def route(self, source_url):
+        """
+        :return: index of the analysis process that handles the subscriptions to the source
+        """
+
+        return hash(source_url) % len(self.task_queues)
+
+    def submit(self, subscription_id, source_url, frame, target_species, frame_id=None, region_key=None):
+        """
+        Hand a frame to the analysis processes. Blocks while all slots are in use.
+        :param source_url: normalized url of the subscription's SharedStream
+        :param frame_id: id of the frame in the SharedStream, to classify it once for all subscriptions to the source
+        :param region_key: key of the region of interest the frame was cropped to
+        :return: Future resolving to the (success, message) result of ObjectRecognizer.handle_image_objects
+        :raises ValueError: if the frame doesn't fit into a slot
+        :raises queue.Empty: if no slot became free in time
+        """
+
+        if not self.ring.fits(frame):
+            raise ValueError(f"Frame of {frame.nbytes} bytes doesn't fit into a {self.ring.slot_bytes} bytes slot")
+
+        slot = self.free_slots.get(timeout=FRAME_RING_FREE_SLOT_TIMEOUT_S)
+        self.ring.write(slot, frame)
+
+        index = self.route(source_url)
+        future = Future()
+
+        with self._pending_lock:
+            self._next_ticket += 1
+            ticket = self._next_ticket
+            self._pending[slot] = (ticket, index, future)
+            task_queue = self.task_queues[index]
+
+        task_queue.put((
+            "frame", slot, ticket, frame.shape, frame.dtype.str, subscription_id, source_url, frame_id, region_key,
+            target_species
+        ))
+
+        return future
+
+    def release(self, subscription_id, source_url):
+        """
+        Drop the state the analysis process keeps for a stopped subscription.
+        """
+
+        self.task_queues[self.route(source_url)].put(("release", subscription_id, source_url))
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "free_slots": self.free_slots.qsize(),
+            "respawn_count": self.respawn_count,
+        }
+
+    def shutdown(self):
+        self._stopping = True
+
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+
+        for process in self.processes:
+            process.join()
+
+        self.done_queue.put(None)
+        self._collector_thread.join()
+
+        self.ring.close()
+        logging.info(f"[ProcessFramePipeline] Analysis processes stopped. Stats: {self.stats()}")
@@ -0,0 +1,101 @@
+import time
+
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from config import RECOGNITION_CACHE_SIZE, RECOGNITION_CACHE_TTL_S, RECOGNITION_CACHE_MAX_DISTANCE
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash of an image: one bit per horizontally adjacent pixel pair of a (hash_size+1) x hash_size
+    grayscale thumbnail. Compression noise and small lighting changes flip few or no bits.
+
+    :param image: BGR or grayscale ndarray
+    :return: hash as int of hash_size * hash_size bits
+    """
+
+    small_image = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    if small_image.ndim == 3:
+        small_image = cv2.cvtColor(small_image, cv2.COLOR_BGR2GRAY)
+
+    bits = small_image[:, 1:] > small_image[:, :-1]
+
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class PerceptualHashCache:
+    """
+    Per-subscription LRU of recognition results keyed by the dHash of the classified frame.
+
+    A frame whose hash is within RECOGNITION_CACHE_MAX_DISTANCE bits of a cached, unexpired entry reuses that
+    entry's result instead of calling the recognizer again.
+    """
+
+    def __init__(self, max_size=RECOGNITION_CACHE_SIZE, ttl_s=RECOGNITION_CACHE_TTL_S,
+                 max_distance=RECOGNITION_CACHE_MAX_DISTANCE):
+        """
+        :param max_size: max number of cached results
+        :param ttl_s: lifetime of a cached result in seconds
+        :param max_distance: max Hamming distance between hashes of frames considered identical
+        """
+
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.max_distance = max_distance
+
+        # frame hash -> (cached_at, result)
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, frame_hash):
+        now = time.monotonic()
+
+        for cached_hash, (cached_at, result) in list(self._entries.items()):
+            if now - cached_at > self.ttl_s:
+                del self._entries[cached_hash]
+                continue
+
+            if (cached_hash ^ frame_hash).bit_count() <= self.max_distance:
+                self._entries.move_to_end(cached_hash)
+                return result
+
+        return None
+
+    def get_or_classify(self, image, classify):
+        """
+        :param image: BGR or grayscale ndarray
+        :param classify: callable taking the image and returning the recognition result dict
+        :return: cached or freshly computed recognition result
+        """
+
+        frame_hash = dhash(image)
+
+        result = self._lookup(frame_hash)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = classify(image)
+
+        # errors are not cached, the next frame should try again
+        if "error" not in result:
+            self._entries[frame_hash] = (time.monotonic(), result)
+            self._entries.move_to_end(frame_hash)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return result
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
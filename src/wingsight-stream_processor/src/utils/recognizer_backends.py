@@ -0,0 +1,325 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from utils.batch_queue import BatchQueue
+from utils.frame_encoder import EncodedFrame
+from utils.payload_planner import default_payload_planner
+from utils.rekognition_dispatcher import get_rekognition_dispatcher
+from utils.rekognition_client import RekognitionClient, SPECIFIC_BIRD_SPECIES, summarize_bird_labels, is_bird_label
+
+from config import (
+    RECOGNIZER_BACKEND, LOCAL_MODEL_PATH, LOCAL_MODEL_LABELS_PATH, LOCAL_MODEL_INPUT_SIZE, LOCAL_MODEL_SCALE,
+    LOCAL_MODEL_MEAN, LOCAL_MODEL_MIN_CONFIDENCE, LOCAL_MODEL_BATCH_SIZE, LOCAL_MODEL_BATCH_WAIT_MS,
+    CASCADE_LOWER_SCORE, CASCADE_UPPER_SCORE, CASCADE_ESCALATE_ABOVE_BAND, CASCADE_STATS_EVERY,
+    REKOGNITION_MOSAIC_BATCHING, MOSAIC_MAX_TILES, MOSAIC_TILE_WIDTH, MOSAIC_TILE_HEIGHT, MOSAIC_BATCH_WAIT_MS,
+    REKOGNITION_JPEG_QUALITY
+)
+
+
+class RecognizerBackend:
+    """
+    Interface of the recognizers used by ObjectRecognizer.
+
+    classify_numpy_array() takes a BGR (or grayscale) ndarray and returns the result dict built by
+    summarize_bird_labels(): bird_detected, top_species, has_specific_species, primary_species and
+    primary_confidence (0-100), or {"error": ...} if the frame could not be classified.
+    """
+
+    name = None
+    specific_bird_species = SPECIFIC_BIRD_SPECIES
+
+    def classify_numpy_array(self, numpy_array):
+        raise NotImplementedError
+
+    def classify_frame(self, encoded_frame):
+        """
+        Classify an EncodedFrame. Backends that send encoded images reuse its payload instead of encoding again.
+        """
+
+        return self.classify_numpy_array(encoded_frame.image)
+
+    def classify_batch(self, numpy_arrays):
+        """
+        Classify several frames at once. Backends that can't batch classify them one by one.
+        """
+
+        return [self.classify_numpy_array(numpy_array) for numpy_array in numpy_arrays]
+
+
+class RekognitionBackend(RecognizerBackend):
+    """
+    AWS Rekognition DetectLabels, one API call per frame.
+
+    With REKOGNITION_MOSAIC_BATCHING, frames of all streams are queued instead, and up to MOSAIC_MAX_TILES of them
+    are sent as one mosaic image per call (see RekognitionClient.classify_mosaic).
+    """
+
+    name = "rekognition"
+
+    def __init__(self, rekognition_client=None):
+        self.rekognition_client = rekognition_client or get_rekognition_client()
+
+    def classify_frame(self, encoded_frame):
+        if REKOGNITION_MOSAIC_BATCHING:
+            return self.classify_numpy_array(encoded_frame.image)
+
+        try:
+            return self.rekognition_client.classify_bytes(encoded_frame.rekognition_jpeg)
+
+        except ValueError as e:
+            return {"error": str(e)}
+
+    def classify_numpy_array(self, numpy_array):
+        if not REKOGNITION_MOSAIC_BATCHING:
+            return self.rekognition_client.classify_numpy_array(numpy_array, jpeg_quality=REKOGNITION_JPEG_QUALITY)
+
+        if not isinstance(numpy_array, np.ndarray):
+            return {"error": f"Expected numpy.ndarray, got {type(numpy_array)}"}
+
+        try:
+            return get_mosaic_batch_queue().submit(numpy_array).result()
+
+        except Exception as e:
+            return {"error": str(e)}
+
+
+class LocalDnnBackend(RecognizerBackend):
+    """
+    Image classifier (ONNX or any other format cv2.dnn reads) running on the CPU of the instance.
+
+    The model's class names are read from a labels file, one per line, and mapped to the result shape with the same
+    bird/species rules as Rekognition labels. Frames of all streams go through one queue; a batching thread runs
+    them through the network in batches of up to LOCAL_MODEL_BATCH_SIZE frames, waiting at most
+    LOCAL_MODEL_BATCH_WAIT_MS for a batch to fill.
+    """
+
+    name = "local"
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH, labels_path=LOCAL_MODEL_LABELS_PATH):
+        """
+        :param model_path: path of the model file
+        :param labels_path: path of the text file with one class name per line, in model output order
+        """
+
+        self.net = cv2.dnn.readNet(model_path)
+
+        with open(labels_path) as labels_file:
+            self.labels = [line.strip() for line in labels_file if line.strip()]
+
+        self.batch_queue = BatchQueue(
+            process_batch=self.classify_batch,
+            max_batch_size=LOCAL_MODEL_BATCH_SIZE,
+            max_wait_ms=LOCAL_MODEL_BATCH_WAIT_MS,
+            name="LocalDnnBackend"
+        )
+
+        logging.info(f"[LocalDnnBackend] Loaded {model_path} with {len(self.labels)} classes")
+
+    def classify_numpy_array(self, numpy_array):
+        if not isinstance(numpy_array, np.ndarray):
+            return {"error": f"Expected numpy.ndarray, got {type(numpy_array)}"}
+
+        try:
+            return self.batch_queue.submit(numpy_array).result()
+
+        except Exception as e:
+            return {"error": str(e)}
+
+    def classify_batch(self, numpy_arrays):
+        images = [
+            cv2.cvtColor(numpy_array, cv2.COLOR_GRAY2BGR) if numpy_array.ndim == 2 else numpy_array
+            for numpy_array in numpy_arrays
+        ]
+
+        blob = cv2.dnn.blobFromImages(
+            images,
+            scalefactor=LOCAL_MODEL_SCALE,
+            size=(LOCAL_MODEL_INPUT_SIZE, LOCAL_MODEL_INPUT_SIZE),
+            mean=LOCAL_MODEL_MEAN,
+            swapRB=True,
+            crop=False
+        )
+        self.net.setInput(blob)
+        scores = self.net.forward().reshape(len(images), -1)
+
+        # models exported without a softmax layer return logits
+        if not np.allclose(scores.sum(axis=1), 1.0, atol=1e-3):
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+
+        return [self._to_result(image_scores) for image_scores in scores]
+
+    def _to_result(self, image_scores):
+        confidences = image_scores * 100
+        top_indices = np.argsort(confidences)[::-1][:50]
+
+        labels = [
+            {'Name': self.labels[index], 'Confidence': float(confidences[index])}
+            for index in top_indices
+            if index < len(self.labels) and confidences[index] >= LOCAL_MODEL_MIN_CONFIDENCE
+        ]
+
+        result = summarize_bird_labels(labels)
+
+        # total probability of all bird classes, including those below the confidence threshold
+        result["bird_score"] = min(100.0, float(sum(
+            confidence for label, confidence in zip(self.labels, confidences) if is_bird_label(label)
+        )))
+
+        return result
+
+
+class CascadeBackend(RecognizerBackend):
+    """
+    Runs a cheap backend first and escalates to an expensive one only when the cheap one is unsure.
+
+    The cheap stage's bird score (0-100) decides: below CASCADE_LOWER_SCORE the frame is treated as having no bird,
+    above CASCADE_UPPER_SCORE the cheap result is kept (unless CASCADE_ESCALATE_ABOVE_BAND is set, for bird/no-bird
+    models that can't name species), and in between the frame is escalated. Frames the cheap stage fails on are
+    always escalated.
+    """
+
+    name = "cascade"
+
+    def __init__(self, cheap_backend, expensive_backend):
+        self.cheap_backend = cheap_backend
+        self.expensive_backend = expensive_backend
+
+        self.frames_seen = 0
+        self.cheap_negatives = 0
+        self.cheap_positives = 0
+        self.escalated = 0
+        self.escalated_bird_detected = 0
+
+    @staticmethod
+    def _bird_score(result):
+        if "bird_score" in result:
+            return result["bird_score"]
+
+        return result.get("primary_confidence", 0) if result.get("bird_detected") else 0
+
+    def classify_numpy_array(self, numpy_array):
+        return self.classify_frame(EncodedFrame(numpy_array))
+
+    def classify_frame(self, encoded_frame):
+        self.frames_seen += 1
+
+        cheap_result = self.cheap_backend.classify_frame(encoded_frame)
+
+        if "error" not in cheap_result:
+            bird_score = self._bird_score(cheap_result)
+
+            if bird_score < CASCADE_LOWER_SCORE:
+                self.cheap_negatives += 1
+                return self._finish(cheap_result)
+
+            if bird_score > CASCADE_UPPER_SCORE and not CASCADE_ESCALATE_ABOVE_BAND:
+                self.cheap_positives += 1
+                return self._finish(cheap_result)
+
+        self.escalated += 1
+        result = self.expensive_backend.classify_frame(encoded_frame)
+
+        if result.get("bird_detected"):
+            self.escalated_bird_detected += 1
+
+        return self._finish(result)
+
+    def _finish(self, result):
+        if self.frames_seen % CASCADE_STATS_EVERY == 0:
+            logging.info(f"[CascadeBackend] Stats: {self.stats()}")
+
+        return result
+
+    def stats(self):
+        return {
+            "frames_seen": self.frames_seen,
+            "cheap_negative_rate": self.cheap_negatives / self.frames_seen if self.frames_seen else None,
+            "cheap_positive_rate": self.cheap_positives / self.frames_seen if self.frames_seen else None,
+            "escalation_ratio": self.escalated / self.frames_seen if self.frames_seen else None,
+            "escalated_hit_rate": self.escalated_bird_detected / self.escalated if self.escalated else None,
+        }
+
+
+_local_backend = None
+_local_backend_lock = threading.Lock()
+
+
+_rekognition_client = None
+_rekognition_client_lock = threading.Lock()
+
+
+def get_rekognition_client():
+    """
+    One RekognitionClient per process; its calls go through the shared, rate-limited RekognitionDispatcher.
+    """
+
+    global _rekognition_client
+
+    with _rekognition_client_lock:
+        if _rekognition_client is None:
+            _rekognition_client = RekognitionClient(
+                rekognition=get_rekognition_dispatcher(),
+                payload_planner=default_payload_planner
+            )
+
+        return _rekognition_client
+
+
+_mosaic_batch_queue = None
+_mosaic_batch_queue_lock = threading.Lock()
+
+
+def get_mosaic_batch_queue():
+    """
+    Process-wide queue that groups frames of all streams into mosaic DetectLabels calls.
+    """
+
+    global _mosaic_batch_queue
+
+    with _mosaic_batch_queue_lock:
+        if _mosaic_batch_queue is None:
+            rekognition_client = get_rekognition_client()
+
+            _mosaic_batch_queue = BatchQueue(
+                process_batch=lambda numpy_arrays: rekognition_client.classify_mosaic(
+                    numpy_arrays, tile_width=MOSAIC_TILE_WIDTH, tile_height=MOSAIC_TILE_HEIGHT
+                ),
+                max_batch_size=MOSAIC_MAX_TILES,
+                max_wait_ms=MOSAIC_BATCH_WAIT_MS,
+                name="RekognitionMosaic"
+            )
+
+        return _mosaic_batch_queue
+
+
+def get_local_backend():
+    """
+    The local model is loaded once per process and shared by all streams, so their frames can be batched.
+    """
+
+    global _local_backend
+
+    with _local_backend_lock:
+        if _local_backend is None:
+            _local_backend = LocalDnnBackend()
+
+        return _local_backend
+
+
+def get_recognizer_backend(name=RECOGNIZER_BACKEND):
+    """
+    Get the recognizer backend for a new ObjectRecognizer.
+    :param name: "rekognition", "local" or "cascade" (local model first, Rekognition when unsure)
+    """
+
+    if name == LocalDnnBackend.name:
+        return get_local_backend()
+
+    if name == CascadeBackend.name:
+        return CascadeBackend(cheap_backend=get_local_backend(), expensive_backend=RekognitionBackend())
+
+    return RekognitionBackend()
@@ -0,0 +1,109 @@
+import json
+import logging
+
+import cv2
+import numpy as np
+
+
+class RegionOfInterest:
+    """
+    Part of the frame a subscription is interested in, in coordinates normalized to 0-1.
+
+    Stored as JSON on the subscription, either a rectangle:
+        {"type": "rect", "x": 0.25, "y": 0.1, "width": 0.5, "height": 0.6}
+    or a polygon:
+        {"type": "polygon", "points": [[0.2, 0.1], [0.8, 0.2], [0.5, 0.9]]}
+
+    A rectangle crops the frame to a view into it, without copying. A polygon crops the frame to its bounding
+    rectangle and blacks out the rest into a buffer reused across frames, so the result of apply() is only valid until
+    the next call.
+    """
+
+    def __init__(self, spec):
+        """
+        :param spec: parsed region of interest JSON
+        :raises ValueError: if the region is malformed
+        """
+
+        region_type = spec.get("type")
+
+        if region_type == "rect":
+            x, y = float(spec["x"]), float(spec["y"])
+            points = [(x, y), (x + float(spec["width"]), y + float(spec["height"]))]
+        elif region_type == "polygon":
+            points = [(float(x), float(y)) for x, y in spec["points"]]
+            if len(points) < 3:
+                raise ValueError("Polygon region of interest needs at least 3 points")
+        else:
+            raise ValueError(f"Unknown region of interest type: {region_type}")
+
+        if not all(0 <= coordinate <= 1 for point in points for coordinate in point):
+            raise ValueError("Region of interest coordinates must be normalized to 0-1")
+
+        self.is_polygon = region_type == "polygon"
+        self.points = points
+        self.left, self.top = min(x for x, _ in points), min(y for _, y in points)
+        self.right, self.bottom = max(x for x, _ in points), max(y for _, y in points)
+
+        if self.right <= self.left or self.bottom <= self.top:
+            raise ValueError("Region of interest is empty")
+
+        # identifies the region in results shared between subscribers of the same stream
+        self.key = json.dumps(spec, sort_keys=True)
+
+        self._mask = None
+        self._mask_shape = None
+        self._masked = None
+
+    def _crop_bounds(self, height, width):
+        top, bottom = int(self.top * height), max(int(self.top * height) + 1, round(self.bottom * height))
+        left, right = int(self.left * width), max(int(self.left * width) + 1, round(self.right * width))
+
+        return top, min(bottom, height), left, min(right, width)
+
+    def _get_mask(self, frame_shape, top, left, crop):
+        if self._mask_shape != frame_shape:
+            height, width = frame_shape[:2]
+            polygon = np.array(
+                [(round(x * width) - left, round(y * height) - top) for x, y in self.points], dtype=np.int32
+            )
+
+            self._mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+            cv2.fillPoly(self._mask, [polygon], 255)
+            self._masked = np.empty_like(crop)
+            self._mask_shape = frame_shape
+
+        return self._mask
+
+    def apply(self, frame):
+        """
+        :param frame: BGR or grayscale ndarray
+        :return: the part of the frame inside the region
+        """
+
+        top, bottom, left, right = self._crop_bounds(*frame.shape[:2])
+        crop = frame[top:bottom, left:right]
+
+        if not self.is_polygon:
+            return crop
+
+        mask = self._get_mask(frame.shape, top, left, crop)
+        return cv2.bitwise_and(crop, crop, dst=self._masked, mask=mask)
+
+
+def parse_region_of_interest(region_of_interest_json, logging_prefix=""):
+    """
+    :param region_of_interest_json: JSON stored on the subscription, or None
+    :param logging_prefix: prefix for log messages of the owning stream
+    :return: RegionOfInterest, or None to use the whole frame
+    """
+
+    if not region_of_interest_json:
+        return None
+
+    try:
+        return RegionOfInterest(json.loads(region_of_interest_json))
+
+    except (ValueError, KeyError, TypeError) as e:
+        logging.error(logging_prefix + f"Ignoring invalid region of interest {region_of_interest_json}: {e}")
+        return None
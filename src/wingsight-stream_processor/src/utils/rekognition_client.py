@@ -1,5 +1,8 @@
 import io
+import logging
 import os
+import math
+import cv2
 import boto3
 import base64
 import requests
@@ -8,16 +11,147 @@ import numpy as np
 from PIL import Image
 
 
+# List of general bird taxonomic labels that should be considered less specific
+GENERAL_BIRD_CATEGORIES = [
+    'Bird', 'Aves', 'Avian', 'Fowl'
+]
+
+# List of specific bird species/types that Rekognition can detect
+SPECIFIC_BIRD_SPECIES = [
+    'Eagle', 'Hawk', 'Falcon', 'Owl', 'Robin', 'Sparrow', 'Duck', 'Swan', 
+    'Goose', 'Hummingbird', 'Penguin', 'Seagull', 'Pelican', 'Woodpecker', 
+    'Jay', 'Cardinal', 'Flamingo', 'Pigeon', 'Dove', 'Parrot', 'Macaw', 
+    'Peacock', 'Crow', 'Raven', 'Chicken', 'Turkey', 'Ostrich', 'Finch', 
+    'Canary', 'Bluebird', 'Kingfisher', 'Bald Eagle', 'Blue Jay', 'Red Robin',
+    'Mockingbird', 'Warbler', 'Nightingale', 'Parakeet', 'Cockatoo', 'Toucan',
+    'Albatross', 'Heron', 'Egret', 'Stork', 'Ibis', 'Sandpiper', 'Puffin',
+    'Quail', 'Pheasant', 'Vulture', 'Condor', 'Hummingbird'
+]
+
+# Non-bird animals we want to explicitly exclude
+NON_BIRD_ANIMALS = [
+    'Dog', 'Cat', 'Mammal', 'Reptile', 'Fish', 'Amphibian', 'Insect', 
+    'Animal', 'Wildlife', 'Bear', 'Lion', 'Tiger', 'Deer', 'Fox', 'Wolf',
+    'Squirrel', 'Rabbit', 'Horse', 'Cow', 'Sheep', 'Goat', 'Elephant',
+    'Giraffe', 'Monkey', 'Ape', 'Gorilla', 'Chimpanzee', 'Snake', 'Lizard'
+]
+
+
+def is_bird_label(label_name):
+    """Whether a label names a bird species or a general bird category"""
+    return label_name in SPECIFIC_BIRD_SPECIES or label_name in GENERAL_BIRD_CATEGORIES or 'bird' in label_name.lower()
+
+
+def get_top_non_bird_objects(labels, max_objects=5):
+    """Extract top non-bird objects from recognition results"""
+    non_bird_objects = []
+    
+    for label in labels:
+        label_name = label['Name']
+        # Skip bird-related labels and focus on other objects
+        if not is_bird_label(label_name):
+            non_bird_objects.append({
+                'name': label_name,
+                'confidence': label['Confidence']
+            })
+            
+            # Limit to max_objects
+            if len(non_bird_objects) >= max_objects:
+                break
+                
+    return non_bird_objects
+
+
+def summarize_bird_labels(labels):
+    """
+    Build the recognition result from a list of labels
+    
+    Args:
+        labels: list of {'Name': str, 'Confidence': float (0-100)} dicts, as returned by DetectLabels
+    
+    Returns:
+        Dict with bird_detected, top_species, has_specific_species, primary_species and primary_confidence
+        (or other_objects if there is no bird)
+    """
+    # Check for presence of any bird label first
+    has_any_bird = any(is_bird_label(label['Name']) for label in labels)
+    
+    # If no birds at all, return early
+    if not has_any_bird:
+        return {
+            "bird_detected": False,
+            "top_species": [],
+            "other_objects": get_top_non_bird_objects(labels)
+        }
+    
+    # Process results to find bird-related labels
+    specific_bird_labels = []
+    general_bird_labels = []
+    
+    for label in labels:
+        label_name = label['Name']
+        
+        # Skip any known non-bird animals
+        if label_name in NON_BIRD_ANIMALS:
+            continue
+            
+        # Check if this is a specific bird species
+        if label_name in SPECIFIC_BIRD_SPECIES:
+            specific_bird_labels.append({
+                'species': label_name,
+                'confidence': label['Confidence'],
+                'is_specific': True
+            })
+        # Check if this is a general bird category
+        elif label_name in GENERAL_BIRD_CATEGORIES or 'bird' in label_name.lower():
+            general_bird_labels.append({
+                'species': label_name,
+                'confidence': label['Confidence'],
+                'is_specific': False
+            })
+    
+    # Combine and sort all bird labels, prioritizing specific species
+    all_bird_labels = specific_bird_labels + general_bird_labels
+    
+    # If we found bird labels
+    if all_bird_labels:
+        # Sort by confidence (highest first)
+        all_bird_labels.sort(key=lambda x: x['confidence'], reverse=True)
+        
+        # Take up to 5 labels
+        top_birds = all_bird_labels[:5]
+        
+        # Check if we have any specific species
+        has_specific_species = any(bird['is_specific'] for bird in top_birds)
+        
+        return {
+            "bird_detected": True,
+            "top_species": top_birds,
+            "has_specific_species": has_specific_species,
+            "primary_species": top_birds[0]['species'],
+            "primary_confidence": top_birds[0]['confidence']
+        }
+    else:
+        # No birds detected at all
+        return {
+            "bird_detected": False,
+            "top_species": [],
+            "other_objects": get_top_non_bird_objects(labels)
+        }
+
+
 class RekognitionClient:
     """Client for interacting with AWS Rekognition for bird detection and classification"""
     
-    def __init__(self, region_name="us-east-1", min_confidence=80.0):
+    def __init__(self, region_name="us-east-1", min_confidence=80.0, rekognition=None, payload_planner=None):
         """
         Initialize the Rekognition client
         
         Args:
             region_name: AWS region name
             min_confidence: Minimum confidence threshold for detection (0-100)
+            rekognition: Optional object with boto3's detect_labels() (e.g. a shared RekognitionDispatcher)
+            payload_planner: Optional PayloadPlanner that sizes images encoded from numpy arrays
         """
         # Try to get region from environment if not provided
         if region_name is None:
@@ -30,32 +164,12 @@ class RekognitionClient:
         # 1. Environment variables
         # 2. ~/.aws/credentials file
         # 3. IAM role if running on EC2/Lambda
-        self.rekognition = boto3.client('rekognition', region_name=self.region_name)
-        
-        # List of general bird taxonomic labels that should be considered less specific
-        self.general_bird_categories = [
-            'Bird', 'Aves', 'Avian', 'Fowl'
-        ]
-        
-        # List of specific bird species/types that Rekognition can detect
-        self.specific_bird_species = [
-            'Eagle', 'Hawk', 'Falcon', 'Owl', 'Robin', 'Sparrow', 'Duck', 'Swan', 
-            'Goose', 'Hummingbird', 'Penguin', 'Seagull', 'Pelican', 'Woodpecker', 
-            'Jay', 'Cardinal', 'Flamingo', 'Pigeon', 'Dove', 'Parrot', 'Macaw', 
-            'Peacock', 'Crow', 'Raven', 'Chicken', 'Turkey', 'Ostrich', 'Finch', 
-            'Canary', 'Bluebird', 'Kingfisher', 'Bald Eagle', 'Blue Jay', 'Red Robin',
-            'Mockingbird', 'Warbler', 'Nightingale', 'Parakeet', 'Cockatoo', 'Toucan',
-            'Albatross', 'Heron', 'Egret', 'Stork', 'Ibis', 'Sandpiper', 'Puffin',
-            'Quail', 'Pheasant', 'Vulture', 'Condor', 'Hummingbird'
-        ]
+        self.rekognition = rekognition or boto3.client('rekognition', region_name=self.region_name)
+        self.payload_planner = payload_planner
         
-        # Non-bird animals we want to explicitly exclude
-        self.non_bird_animals = [
-            'Dog', 'Cat', 'Mammal', 'Reptile', 'Fish', 'Amphibian', 'Insect', 
-            'Animal', 'Wildlife', 'Bear', 'Lion', 'Tiger', 'Deer', 'Fox', 'Wolf',
-            'Squirrel', 'Rabbit', 'Horse', 'Cow', 'Sheep', 'Goat', 'Elephant',
-            'Giraffe', 'Monkey', 'Ape', 'Gorilla', 'Chimpanzee', 'Snake', 'Lizard'
-        ]
+        self.general_bird_categories = GENERAL_BIRD_CATEGORIES
+        self.specific_bird_species = SPECIFIC_BIRD_SPECIES
+        self.non_bird_animals = NON_BIRD_ANIMALS
     
     def classify_image(self, image):
         """
@@ -70,8 +184,19 @@ class RekognitionClient:
         # Convert image to bytes
         img_byte_arr = io.BytesIO()
         image.save(img_byte_arr, format='JPEG')
-        img_bytes = img_byte_arr.getvalue()
         
+        return self.classify_bytes(img_byte_arr.getvalue())
+    
+    def classify_bytes(self, img_bytes):
+        """
+        Classify an encoded (JPEG or PNG) image using AWS Rekognition
+        
+        Args:
+            img_bytes: encoded image bytes
+        
+        Returns:
+            Dict containing species name and confidence
+        """
         try:
             # Call Rekognition DetectLabels API with higher MaxLabels to catch specific species
             response = self.rekognition.detect_labels(
@@ -80,100 +205,15 @@ class RekognitionClient:
                 MinConfidence=self.min_confidence
             )
             
-            # Check for presence of any bird label first
-            has_any_bird = False
-            for label in response['Labels']:
-                if label['Name'] in self.specific_bird_species or label['Name'] in self.general_bird_categories or 'bird' in label['Name'].lower():
-                    has_any_bird = True
-                    break
-            
-            # If no birds at all, return early
-            if not has_any_bird:
-                return {
-                    "bird_detected": False,
-                    "top_species": [],
-                    "other_objects": self._get_top_non_bird_objects(response['Labels'])
-                }
-            
-            # Process results to find bird-related labels
-            specific_bird_labels = []
-            general_bird_labels = []
-            
-            for label in response['Labels']:
-                label_name = label['Name']
-                
-                # Skip any known non-bird animals
-                if label_name in self.non_bird_animals:
-                    continue
-                    
-                # Check if this is a specific bird species
-                if label_name in self.specific_bird_species:
-                    specific_bird_labels.append({
-                        'species': label_name,
-                        'confidence': label['Confidence'],
-                        'is_specific': True
-                    })
-                # Check if this is a general bird category
-                elif label_name in self.general_bird_categories or 'bird' in label_name.lower():
-                    general_bird_labels.append({
-                        'species': label_name,
-                        'confidence': label['Confidence'],
-                        'is_specific': False
-                    })
-            
-            # Combine and sort all bird labels, prioritizing specific species
-            all_bird_labels = specific_bird_labels + general_bird_labels
-            
-            # If we found bird labels
-            if all_bird_labels:
-                # Sort by confidence (highest first)
-                all_bird_labels.sort(key=lambda x: x['confidence'], reverse=True)
-                
-                # Take up to 5 labels
-                top_birds = all_bird_labels[:5]
-                
-                # Check if we have any specific species
-                has_specific_species = any(bird['is_specific'] for bird in top_birds)
-                
-                return {
-                    "bird_detected": True,
-                    "top_species": top_birds,
-                    "has_specific_species": has_specific_species,
-                    "primary_species": top_birds[0]['species'],
-                    "primary_confidence": top_birds[0]['confidence']
-                }
-            else:
-                # No birds detected at all
-                return {
-                    "bird_detected": False,
-                    "top_species": [],
-                    "other_objects": self._get_top_non_bird_objects(response['Labels'])
-                }
+            return summarize_bird_labels(response['Labels'])
             
         except Exception as e:
-            print(f"Error calling AWS Rekognition: {str(e)}")
+            logging.error(f"Error calling AWS Rekognition: {str(e)}")
             return {"error": str(e)}
     
     def _get_top_non_bird_objects(self, labels, max_objects=5):
         """Extract top non-bird objects from recognition results"""
-        non_bird_objects = []
-        
-        for label in labels:
-            label_name = label['Name']
-            # Skip bird-related labels and focus on other objects
-            if (label_name not in self.specific_bird_species and 
-                label_name not in self.general_bird_categories and 
-                'bird' not in label_name.lower()):
-                non_bird_objects.append({
-                    'name': label_name,
-                    'confidence': label['Confidence']
-                })
-                
-                # Limit to max_objects
-                if len(non_bird_objects) >= max_objects:
-                    break
-                    
-        return non_bird_objects
+        return get_top_non_bird_objects(labels, max_objects)
     
     def classify_image_file(self, image_path):
         """Classify a bird image from a file path"""
@@ -181,7 +221,7 @@ class RekognitionClient:
             image = Image.open(image_path)
             return self.classify_image(image)
         except Exception as e:
-            print(f"Error processing image file: {str(e)}")
+            logging.error(f"Error processing image file: {str(e)}")
             return {"error": str(e)}
     
     def classify_base64_image(self, base64_string):
@@ -196,7 +236,7 @@ class RekognitionClient:
             image = Image.open(io.BytesIO(image_data))
             return self.classify_image(image)
         except Exception as e:
-            print(f"Error processing base64 image: {str(e)}")
+            logging.error(f"Error processing base64 image: {str(e)}")
             return {"error": str(e)}
         
     def classify_image_url(self, image_url):
@@ -221,18 +261,19 @@ class RekognitionClient:
             return self.classify_image(image)
             
         except requests.RequestException as e:
-            print(f"Error downloading image from URL: {str(e)}")
+            logging.error(f"Error downloading image from URL: {str(e)}")
             return {"error": f"Failed to download image from URL: {str(e)}"}
         except Exception as e:
-            print(f"Error processing image from URL: {str(e)}")
+            logging.error(f"Error processing image from URL: {str(e)}")
             return {"error": str(e)}
     
-    def classify_numpy_array(self, numpy_array):
+    def classify_numpy_array(self, numpy_array, jpeg_quality=90):
         """
         Classify a bird image from a numpy array (OpenCV format)
         
         Args:
             numpy_array: numpy.ndarray in BGR format (OpenCV default)
+            jpeg_quality: quality of the JPEG sent to Rekognition
             
         Returns:
             Dict containing species name and confidence
@@ -242,18 +283,102 @@ class RekognitionClient:
             if not isinstance(numpy_array, np.ndarray):
                 raise ValueError(f"Expected numpy.ndarray, got {type(numpy_array)}")
             
-            # Convert BGR to RGB (OpenCV uses BGR, PIL uses RGB)
-            if len(numpy_array.shape) == 3 and numpy_array.shape[2] == 3:  # Ensure 3-channel color image
-                rgb_array = numpy_array[:, :, ::-1]  # Reverse color channels
-                image = Image.fromarray(rgb_array)
-            elif len(numpy_array.shape) == 2:  # Grayscale image
-                image = Image.fromarray(numpy_array)
-            else:
+            # 3-channel BGR or grayscale images are encoded directly, without converting to RGB for PIL
+            if not (numpy_array.ndim == 2 or (numpy_array.ndim == 3 and numpy_array.shape[2] == 3)):
                 raise ValueError("Unsupported numpy array shape for image")
+            
+            # Downscale and pick the quality to fit the byte budget, if a planner is set
+            if self.payload_planner is not None:
+                return self.classify_bytes(self.payload_planner.plan(numpy_array))
+            
+            encoded, buffer = cv2.imencode('.jpg', numpy_array, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            if not encoded:
+                raise ValueError("Could not encode numpy array to JPEG")
                 
             # Use existing method to classify
-            return self.classify_image(image)
+            return self.classify_bytes(buffer.tobytes())
             
         except Exception as e:
-            print(f"Error processing numpy array: {str(e)}")
+            logging.error(f"Error processing numpy array: {str(e)}")
             return {"error": str(e)}
+    
+    def classify_mosaic(self, numpy_arrays, tile_width=640, tile_height=360):
+        """
+        Classify several frames with a single DetectLabels call by tiling them into one mosaic image
+        
+        Every frame is downscaled into its own tile. Label instances are assigned back to the tile that contains
+        the center of their bounding box. Bird labels returned without instances can't be attributed to a tile,
+        so the tiles that got a bird instance (or all tiles, if none did) are classified again one by one.
+        
+        Args:
+            numpy_arrays: list of numpy.ndarray in BGR format (OpenCV default)
+            tile_width: width of a tile in the mosaic
+            tile_height: height of a tile in the mosaic
+            
+        Returns:
+            List of result dicts, one per frame, in the same shape as classify_numpy_array
+        """
+        if len(numpy_arrays) == 1:
+            return [self.classify_numpy_array(numpy_arrays[0])]
+        
+        columns = math.ceil(math.sqrt(len(numpy_arrays)))
+        rows = math.ceil(len(numpy_arrays) / columns)
+        mosaic = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+        
+        for index, numpy_array in enumerate(numpy_arrays):
+            if numpy_array.ndim == 2:
+                numpy_array = cv2.cvtColor(numpy_array, cv2.COLOR_GRAY2BGR)
+            
+            # Keep the aspect ratio, so that animals aren't distorted
+            scale = min(tile_width / numpy_array.shape[1], tile_height / numpy_array.shape[0])
+            tile_size = (max(1, int(numpy_array.shape[1] * scale)), max(1, int(numpy_array.shape[0] * scale)))
+            tile = cv2.resize(numpy_array, tile_size, interpolation=cv2.INTER_AREA)
+            
+            row, column = divmod(index, columns)
+            top, left = row * tile_height, column * tile_width
+            mosaic[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+        
+        try:
+            _, buffer = cv2.imencode('.jpg', mosaic)
+            response = self.rekognition.detect_labels(
+                Image={'Bytes': buffer.tobytes()},
+                MaxLabels=50,
+                MinConfidence=self.min_confidence
+            )
+        except Exception as e:
+            logging.error(f"Error calling AWS Rekognition with mosaic: {str(e)}")
+            return [{"error": str(e)}] * len(numpy_arrays)
+        
+        # Highest instance confidence of every label, per tile
+        tile_labels = [{} for _ in numpy_arrays]
+        has_unattributed_bird = False
+        
+        for label in response['Labels']:
+            instances = label.get('Instances', [])
+            
+            if not instances:
+                has_unattributed_bird = has_unattributed_bird or is_bird_label(label['Name'])
+                continue
+            
+            for instance in instances:
+                box = instance['BoundingBox']
+                center_x = (box['Left'] + box['Width'] / 2) * mosaic.shape[1]
+                center_y = (box['Top'] + box['Height'] / 2) * mosaic.shape[0]
+                index = int(center_y // tile_height) * columns + int(center_x // tile_width)
+                
+                if index < len(numpy_arrays):
+                    confidence = instance.get('Confidence', label['Confidence'])
+                    tile_labels[index][label['Name']] = max(tile_labels[index].get(label['Name'], 0), confidence)
+        
+        results = []
+        for labels in tile_labels:
+            labels = [{'Name': name, 'Confidence': confidence} for name, confidence in labels.items()]
+            labels.sort(key=lambda x: x['Confidence'], reverse=True)
+            results.append(summarize_bird_labels(labels))
+        
+        if has_unattributed_bird:
+            fallback_indices = [index for index, result in enumerate(results) if result['bird_detected']]
+            for index in fallback_indices or range(len(numpy_arrays)):
+                results[index] = self.classify_numpy_array(numpy_arrays[index])
+        
+        return results
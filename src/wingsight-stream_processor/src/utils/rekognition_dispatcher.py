@@ -0,0 +1,261 @@
+import logging
+import multiprocessing
+import queue
+import random
+import threading
+import time
+
+from concurrent.futures import Future
+
+import boto3
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from config import (
+    AWS_REGION, REKOGNITION_TPS, REKOGNITION_BURST, REKOGNITION_DISPATCHER_WORKERS, REKOGNITION_QUEUE_SIZE,
+    REKOGNITION_QUEUE_TIMEOUT_S, REKOGNITION_MAX_RETRIES, REKOGNITION_BACKOFF_BASE_S, REKOGNITION_BACKOFF_MAX_S,
+    REKOGNITION_STATS_EVERY
+)
+
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException", "ProvisionedThroughputExceededException", "LimitExceededException",
+    "TooManyRequestsException",
+}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `capacity` saved up for bursts.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        """
+
+        while True:
+            wait_s = self._take()
+            if wait_s is None:
+                return
+
+            time.sleep(wait_s)
+
+    def _take(self):
+        """
+        :return: None if a token was taken, else how long to wait for the next one
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+
+            return (1 - self._tokens) / self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state lives in shared memory, so that the analysis processes and their parent stay under one
+    rate together. Must be passed to the processes when they are created.
+    """
+
+    def __init__(self, rate, capacity, context=multiprocessing):
+        self.rate = rate
+        self.capacity = capacity
+
+        # tokens, updated at (time.monotonic() is system-wide, so it can be compared across processes)
+        self._state = context.Array("d", [capacity, time.monotonic()])
+
+    def _take(self):
+        with self._state.get_lock():
+            tokens, updated_at = self._state[0], self._state[1]
+
+            now = time.monotonic()
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+            wait_s = None
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait_s = (1 - tokens) / self.rate
+
+            self._state[0], self._state[1] = tokens, now
+
+        return wait_s
+
+
+class RekognitionDispatcher:
+    """
+    Process-wide gateway to the Rekognition API.
+
+    All calls go through a bounded queue served by a few worker threads that share one connection-pooled boto3
+    client. A token bucket keeps the process under the account's TPS quota (together with the analysis processes,
+    see SharedTokenBucket), and throttled calls are retried with jittered exponential backoff. Queue wait, call
+    latency and throttle counts are logged every REKOGNITION_STATS_EVERY calls.
+
+    Has the same detect_labels() signature as the boto3 client, so it can be used in its place.
+    """
+
+    def __init__(self, token_bucket=None):
+        """
+        :param token_bucket: TokenBucket limiting the calls; a bucket of REKOGNITION_TPS for this process by default
+        """
+
+        self.client = boto3.client(
+            "rekognition",
+            region_name=AWS_REGION or "us-east-1",
+            config=Config(
+                max_pool_connections=REKOGNITION_DISPATCHER_WORKERS,
+                # throttling is retried by the dispatcher, with the token bucket in the loop
+                retries={"mode": "standard", "max_attempts": 1}
+            )
+        )
+        self.token_bucket = token_bucket or TokenBucket(rate=REKOGNITION_TPS, capacity=REKOGNITION_BURST)
+        self._requests = queue.Queue(maxsize=REKOGNITION_QUEUE_SIZE)
+
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.throttles = 0
+        self.queue_wait_s_total = 0.0
+        self.queue_wait_s_max = 0.0
+        self.latency_s_total = 0.0
+        self.latency_s_max = 0.0
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"rekognition-{index}", daemon=True)
+            for index in range(REKOGNITION_DISPATCHER_WORKERS)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, operation, **kwargs):
+        """
+        Queue an API call.
+        :param operation: name of the boto3 client method, e.g. "detect_labels"
+        :return: Future resolving to the API response
+        :raises queue.Full: if the queue stayed full for REKOGNITION_QUEUE_TIMEOUT_S
+        """
+
+        future = Future()
+        self._requests.put((operation, kwargs, future, time.monotonic()), timeout=REKOGNITION_QUEUE_TIMEOUT_S)
+
+        return future
+
+    def detect_labels(self, **kwargs):
+        return self.submit("detect_labels", **kwargs).result()
+
+    def _work(self):
+        while True:
+            operation, kwargs, future, enqueued_at = self._requests.get()
+            queue_wait_s = time.monotonic() - enqueued_at
+
+            try:
+                response, latency_s = self._call_with_retries(operation, kwargs)
+
+            except Exception as e:
+                logging.error(f"[RekognitionDispatcher] {operation} failed: {e}")
+                self._record(queue_wait_s, 0.0, failed=True)
+                future.set_exception(e)
+                continue
+
+            self._record(queue_wait_s, latency_s, failed=False)
+            future.set_result(response)
+
+    def _call_with_retries(self, operation, kwargs):
+        for attempt in range(REKOGNITION_MAX_RETRIES + 1):
+            self.token_bucket.acquire()
+            started_at = time.monotonic()
+
+            try:
+                response = getattr(self.client, operation)(**kwargs)
+                return response, time.monotonic() - started_at
+
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in THROTTLING_ERROR_CODES:
+                    raise
+
+                with self._stats_lock:
+                    self.throttles += 1
+
+                if attempt == REKOGNITION_MAX_RETRIES:
+                    raise
+
+                # full jitter
+                time.sleep(random.uniform(0, min(REKOGNITION_BACKOFF_MAX_S, REKOGNITION_BACKOFF_BASE_S * 2 ** attempt)))
+
+    def _record(self, queue_wait_s, latency_s, failed):
+        with self._stats_lock:
+            self.calls += 1
+            self.failures += failed
+            self.queue_wait_s_total += queue_wait_s
+            self.queue_wait_s_max = max(self.queue_wait_s_max, queue_wait_s)
+            self.latency_s_total += latency_s
+            self.latency_s_max = max(self.latency_s_max, latency_s)
+
+            log_stats = self.calls % REKOGNITION_STATS_EVERY == 0
+
+        if log_stats:
+            logging.info(f"[RekognitionDispatcher] Stats: {self.stats()}")
+
+    def stats(self):
+        with self._stats_lock:
+            succeeded = self.calls - self.failures
+
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "throttles": self.throttles,
+                "queued": self._requests.qsize(),
+                "mean_queue_wait_s": round(self.queue_wait_s_total / self.calls, 3) if self.calls else None,
+                "max_queue_wait_s": round(self.queue_wait_s_max, 3),
+                "mean_latency_s": round(self.latency_s_total / succeeded, 3) if succeeded else None,
+                "max_latency_s": round(self.latency_s_max, 3),
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_shared_token_bucket = None
+
+
+def use_shared_token_bucket(token_bucket):
+    """
+    Make the dispatcher of this process draw from a SharedTokenBucket. Must be called before the dispatcher is created.
+    """
+
+    global _shared_token_bucket
+
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            logging.warning("[RekognitionDispatcher] Dispatcher already created, it keeps its own token bucket")
+
+        _shared_token_bucket = token_bucket
+
+
+def get_rekognition_dispatcher():
+    """
+    The dispatcher is created once per process and shared by all streams.
+    """
+
+    global _dispatcher
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = RekognitionDispatcher(token_bucket=_shared_token_bucket)
+
+        return _dispatcher
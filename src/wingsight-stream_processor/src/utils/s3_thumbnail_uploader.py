@@ -1,35 +1,296 @@
 import os
+import uuid
+import queue
+import random
+import logging
+import threading
+import time
+import urllib.parse
+
 import boto3
-import cv2
 
-from datetime import datetime
+from botocore.config import Config
+from datetime import datetime, UTC
 from dotenv import load_dotenv
 
-load_dotenv()
+from config import (
+    THUMBNAIL_UPLOAD_WORKERS, THUMBNAIL_UPLOAD_QUEUE_SIZE, THUMBNAIL_UPLOAD_MAX_RETRIES,
+    THUMBNAIL_UPLOAD_BACKOFF_BASE_S, THUMBNAIL_UPLOAD_BACKOFF_MAX_S, THUMBNAIL_UPLOAD_STATS_EVERY,
+    THUMBNAIL_SPILL_DIR, THUMBNAIL_SPILL_DRAIN_INTERVAL_S
+)
 
-s3_client = boto3.client('s3')
+load_dotenv()
 
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 
+# spilled thumbnails being drained by some process are renamed with this suffix, so no other process picks them up
+DRAINING_SUFFIX = ".draining"
+# claims older than this are left over from a process that died while draining
+ABANDONED_CLAIM_AGE_S = 10 * 60
 
-def put_to_bucket(image, stream_subscription_id):
+
+def make_thumbnail_key(stream_subscription_id):
     """
-    Create thumbnail and put into bucket.
+    Unique S3 object key for a thumbnail of the subscription.
     """
 
-    small_image = cv2.resize(image, (320, 240))
-    _, buffer = cv2.imencode('.jpg', small_image)
-    image_data = buffer.tobytes()
-
-    # Generate a unique S3 object key (e.g., using timestamp or unique ID)
-    image_key = f"thumbnails/{stream_subscription_id}/{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
+    return f"thumbnails/{stream_subscription_id}/{datetime.now(UTC).strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}.jpg"
 
-    # Upload to S3
-    s3_client.put_object(
-        Bucket=S3_BUCKET_NAME,
-        Key=image_key,
-        Body=image_data,
-        ContentType='image/jpeg'
-    )
 
+def get_thumbnail_url(image_key):
     return f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{image_key}"
+
+
+class ThumbnailUploader:
+    """
+    Uploads thumbnails to S3 in the background.
+
+    Thumbnails are queued in a bounded queue served by worker threads sharing one connection-pooled S3 client; failed
+    uploads are retried with jittered exponential backoff. Thumbnails that still fail, or that don't fit the queue,
+    are spilled to THUMBNAIL_SPILL_DIR and uploaded by a drain thread every THUMBNAIL_SPILL_DRAIN_INTERVAL_S.
+    """
+
+    def __init__(self, spill_dir=THUMBNAIL_SPILL_DIR):
+        self.spill_dir = spill_dir
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self.client = boto3.client(
+            "s3",
+            config=Config(
+                max_pool_connections=THUMBNAIL_UPLOAD_WORKERS + 1,
+                # failures are retried by the uploader, with backoff between attempts
+                retries={"mode": "standard", "max_attempts": 1}
+            )
+        )
+        self._uploads = queue.Queue(maxsize=THUMBNAIL_UPLOAD_QUEUE_SIZE)
+        self._stopping = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self.uploaded = 0
+        self.failed_attempts = 0
+        self.spilled = 0
+        self.drained = 0
+        self.latency_s_total = 0.0
+        self.latency_s_max = 0.0
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"thumbnail-upload-{index}", daemon=True)
+            for index in range(THUMBNAIL_UPLOAD_WORKERS)
+        ]
+        self._threads.append(threading.Thread(target=self._drain, name="thumbnail-spill-drain", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image_data, stream_subscription_id):
+        """
+        Queue a thumbnail for upload without waiting for it.
+        :param image_data: JPEG bytes of the thumbnail (see EncodedFrame.thumbnail_jpeg)
+        :return: URL the thumbnail will be available at
+        """
+
+        image_key = make_thumbnail_key(stream_subscription_id)
+
+        try:
+            self._uploads.put_nowait((image_key, image_data))
+
+        except queue.Full:
+            logging.warning(f"[ThumbnailUploader] Upload queue is full, spilling {image_key} to disk")
+            self._spill(image_key, image_data)
+
+        return get_thumbnail_url(image_key)
+
+    def _put_object(self, image_key, image_data):
+        started_at = time.monotonic()
+
+        self.client.put_object(Bucket=S3_BUCKET_NAME, Key=image_key, Body=image_data, ContentType='image/jpeg')
+
+        latency_s = time.monotonic() - started_at
+        with self._stats_lock:
+            self.uploaded += 1
+            self.latency_s_total += latency_s
+            self.latency_s_max = max(self.latency_s_max, latency_s)
+
+            log_stats = self.uploaded % THUMBNAIL_UPLOAD_STATS_EVERY == 0
+
+        if log_stats:
+            logging.info(f"[ThumbnailUploader] Stats: {self.stats()}")
+
+    def _upload_with_retries(self, image_key, image_data):
+        for attempt in range(THUMBNAIL_UPLOAD_MAX_RETRIES + 1):
+            try:
+                self._put_object(image_key, image_data)
+                return True
+
+            except Exception as e:
+                with self._stats_lock:
+                    self.failed_attempts += 1
+
+                logging.warning(f"[ThumbnailUploader] Upload of {image_key} failed (attempt {attempt + 1}): {e}")
+
+                if attempt == THUMBNAIL_UPLOAD_MAX_RETRIES or self._stopping.is_set():
+                    return False
+
+                # full jitter
+                time.sleep(random.uniform(
+                    0, min(THUMBNAIL_UPLOAD_BACKOFF_MAX_S, THUMBNAIL_UPLOAD_BACKOFF_BASE_S * 2 ** attempt)
+                ))
+
+    def _work(self):
+        while not (self._stopping.is_set() and self._uploads.empty()):
+            try:
+                image_key, image_data = self._uploads.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if not self._upload_with_retries(image_key, image_data):
+                self._spill(image_key, image_data)
+
+    def _spill(self, image_key, image_data):
+        path = os.path.join(self.spill_dir, urllib.parse.quote(image_key, safe=""))
+
+        try:
+            # written under a temporary name, so the drain never sees a partial file
+            with open(path + ".tmp", "wb") as spill_file:
+                spill_file.write(image_data)
+            os.replace(path + ".tmp", path)
+
+        except OSError as e:
+            logging.error(f"[ThumbnailUploader] Could not spill {image_key} to disk, thumbnail is lost: {e}")
+            return
+
+        with self._stats_lock:
+            self.spilled += 1
+
+    def drain_spilled(self):
+        """
+        Upload the thumbnails spilled to disk, stopping at the first failure since S3 is likely still unreachable.
+        :return: number of thumbnails uploaded
+        """
+
+        drained = 0
+
+        for file_name in sorted(os.listdir(self.spill_dir)):
+            if file_name.endswith(DRAINING_SUFFIX):
+                self._release_abandoned_claim(os.path.join(self.spill_dir, file_name))
+                continue
+
+            if file_name.endswith(".tmp"):
+                continue
+
+            path = os.path.join(self.spill_dir, file_name)
+            claimed_path = path + DRAINING_SUFFIX
+
+            try:
+                # claim the file, other processes may drain the same directory
+                os.rename(path, claimed_path)
+                os.utime(claimed_path)
+                with open(claimed_path, "rb") as spill_file:
+                    image_data = spill_file.read()
+
+            except OSError:
+                continue
+
+            image_key = urllib.parse.unquote(file_name)
+
+            try:
+                self._put_object(image_key, image_data)
+
+            except Exception as e:
+                logging.warning(f"[ThumbnailUploader] S3 still unreachable, keeping spilled thumbnails: {e}")
+                os.rename(claimed_path, path)
+                break
+
+            os.remove(claimed_path)
+            drained += 1
+
+        with self._stats_lock:
+            self.drained += drained
+
+        return drained
+
+    @staticmethod
+    def _release_abandoned_claim(claimed_path):
+        """
+        Return a thumbnail claimed by a process that died while draining it to the spill directory.
+        """
+
+        try:
+            if time.time() - os.path.getmtime(claimed_path) > ABANDONED_CLAIM_AGE_S:
+                os.rename(claimed_path, claimed_path[:-len(DRAINING_SUFFIX)])
+        except OSError:
+            pass
+
+    def _drain(self):
+        while not self._stopping.wait(THUMBNAIL_SPILL_DRAIN_INTERVAL_S):
+            try:
+                drained = self.drain_spilled()
+
+            except Exception as e:
+                logging.error(f"[ThumbnailUploader] Error while draining spilled thumbnails: {e}")
+                continue
+
+            if drained:
+                logging.info(f"[ThumbnailUploader] Uploaded {drained} spilled thumbnails")
+
+    def shutdown(self, timeout_s=10):
+        """
+        Finish queued uploads, spilling what is left after the timeout to disk for the next run.
+        """
+
+        self._stopping.set()
+        deadline = time.monotonic() + timeout_s
+
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        while True:
+            try:
+                self._spill(*self._uploads.get_nowait())
+            except queue.Empty:
+                break
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "uploaded": self.uploaded,
+                "failed_attempts": self.failed_attempts,
+                "spilled": self.spilled,
+                "drained": self.drained,
+                "queued": self._uploads.qsize(),
+                "mean_latency_s": round(self.latency_s_total / self.uploaded, 3) if self.uploaded else None,
+                "max_latency_s": round(self.latency_s_max, 3),
+            }
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_thumbnail_uploader():
+    """
+    The uploader is created once per process and shared by all streams.
+    """
+
+    global _uploader
+
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = ThumbnailUploader()
+
+        return _uploader
+
+
+def shutdown_thumbnail_uploader():
+    with _uploader_lock:
+        if _uploader is not None:
+            _uploader.shutdown()
+
+
+def put_to_bucket(image_data, stream_subscription_id):
+    """
+    Put thumbnail into bucket. The upload happens in the background.
+    :param image_data: JPEG bytes of the thumbnail (see EncodedFrame.thumbnail_jpeg)
+    :return: URL of the thumbnail
+    """
+
+    return get_thumbnail_uploader().submit(image_data, stream_subscription_id)
@@ -0,0 +1,222 @@
+import logging
+import os
+import socket
+import threading
+
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import StreamLease, StreamSubscription
+
+from config import (
+    PROCESSOR_INSTANCE_ID, STREAM_LEASE_TTL_S, STREAM_LEASE_HEARTBEAT_S, STREAM_LEASE_RECLAIM_INTERVAL_S
+)
+
+
+class LeaseManager:
+    """
+    Records in the stream_lease table which instance runs each subscription.
+
+    A subscription is only started after its lease is acquired. Leases of this instance are renewed every
+    STREAM_LEASE_HEARTBEAT_S for STREAM_LEASE_TTL_S; if the instance dies, its leases expire and other instances
+    reclaim the active subscriptions among them every STREAM_LEASE_RECLAIM_INTERVAL_S, along with active subscriptions
+    that have no lease, like the ones running before leases were introduced. Expiry is compared against each
+    instance's clock, so the clocks must be kept in sync.
+    """
+
+    def __init__(self, session_factory, on_lease_lost, on_reclaimable, instance_id=PROCESSOR_INSTANCE_ID):
+        """
+        :param session_factory: callable returning a new SQLAlchemy session
+        :param on_lease_lost: callable (subscription_id), called when a lease of this instance was taken over
+        :param on_reclaimable: callable ([subscription_id]), called with active subscriptions whose lease expired
+        :param instance_id: ID of this instance, host name and PID by default
+        """
+
+        self.session_factory = session_factory
+        self.on_lease_lost = on_lease_lost
+        self.on_reclaimable = on_reclaimable
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+
+        self.owned = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self.renewals = 0
+        self.leases_lost = 0
+
+        self._thread = threading.Thread(target=self._run, name="stream-lease", daemon=True)
+        self._thread.start()
+
+    def acquire(self, subscription_id):
+        """
+        Take the lease of a subscription if it is free, expired or already ours.
+        :return: whether this instance now holds the lease
+        """
+
+        now = datetime.now(UTC)
+        expires_at = now + timedelta(seconds=STREAM_LEASE_TTL_S)
+
+        with self.session_factory() as session:
+            result = session.execute(
+                update(StreamLease)
+                .where(
+                    StreamLease.stream_subscription_id == subscription_id,
+                    (StreamLease.owner == self.instance_id) | (StreamLease.expires_at < now)
+                )
+                .values(owner=self.instance_id, acquired_at=now, expires_at=expires_at)
+            )
+
+            if result.rowcount == 0:
+                session.add(StreamLease(
+                    stream_subscription_id=subscription_id, owner=self.instance_id, acquired_at=now,
+                    expires_at=expires_at
+                ))
+
+            try:
+                session.commit()
+
+            except IntegrityError:
+                # a live lease of another instance
+                session.rollback()
+                return False
+
+        with self._lock:
+            self.owned.add(str(subscription_id))
+
+        return True
+
+    def release(self, subscription_id):
+        with self._lock:
+            self.owned.discard(str(subscription_id))
+
+        with self.session_factory() as session:
+            session.execute(
+                delete(StreamLease)
+                .where(StreamLease.stream_subscription_id == subscription_id, StreamLease.owner == self.instance_id)
+            )
+            session.commit()
+
+    def renew(self):
+        """
+        Extend the leases of this instance, and report the ones another instance took over meanwhile.
+        """
+
+        with self._lock:
+            owned = set(self.owned)
+
+        if not owned:
+            return
+
+        with self.session_factory() as session:
+            session.execute(
+                update(StreamLease)
+                .where(StreamLease.owner == self.instance_id, StreamLease.stream_subscription_id.in_(owned))
+                .values(expires_at=datetime.now(UTC) + timedelta(seconds=STREAM_LEASE_TTL_S))
+            )
+            session.commit()
+
+            still_owned = {
+                str(subscription_id) for subscription_id in session.scalars(
+                    select(StreamLease.stream_subscription_id).where(StreamLease.owner == self.instance_id)
+                )
+            }
+
+        self.renewals += 1
+
+        for subscription_id in owned - still_owned:
+            with self._lock:
+                # released while renewing
+                if subscription_id not in self.owned:
+                    continue
+                self.owned.discard(subscription_id)
+
+            self.leases_lost += 1
+            logging.warning(f"[LeaseManager] Lease of subscription {subscription_id} was taken over, stopping it")
+            self.on_lease_lost(subscription_id)
+
+    def find_reclaimable(self):
+        """
+        :return: IDs of active subscriptions whose lease expired, or that have no lease at all
+        """
+
+        with self.session_factory() as session:
+            now = datetime.now(UTC)
+
+            # leases of subscriptions deactivated while their owner was down are just dropped
+            session.execute(
+                delete(StreamLease)
+                .where(
+                    StreamLease.expires_at < now,
+                    StreamLease.stream_subscription_id.in_(
+                        select(StreamSubscription.id).where(
+                            (StreamSubscription.is_active == False) | (StreamSubscription.is_deleted == True)
+                        )
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+            # subscriptions active before leases were introduced, or whose start message was lost, have no lease
+            return [
+                str(subscription_id) for subscription_id in session.scalars(
+                    select(StreamSubscription.id)
+                    .outerjoin(StreamLease, StreamLease.stream_subscription_id == StreamSubscription.id)
+                    .where(
+                        StreamSubscription.is_active == True,
+                        StreamSubscription.is_deleted == False,
+                        (StreamLease.stream_subscription_id == None) | (StreamLease.expires_at < now)
+                    )
+                )
+            ]
+
+    def expire_all(self):
+        """
+        Let other instances reclaim this instance's subscriptions right away, on shutdown.
+        """
+
+        self._stopping.set()
+
+        with self.session_factory() as session:
+            session.execute(
+                update(StreamLease)
+                .where(StreamLease.owner == self.instance_id)
+                .values(expires_at=datetime.now(UTC))
+            )
+            session.commit()
+
+    def _run(self):
+        last_reclaim_at = 0.0
+        elapsed_s = 0.0
+
+        while not self._stopping.wait(STREAM_LEASE_HEARTBEAT_S):
+            elapsed_s += STREAM_LEASE_HEARTBEAT_S
+
+            try:
+                self.renew()
+            except Exception as e:
+                logging.error(f"[LeaseManager] Could not renew leases: {e}")
+
+            if elapsed_s - last_reclaim_at < STREAM_LEASE_RECLAIM_INTERVAL_S:
+                continue
+            last_reclaim_at = elapsed_s
+
+            try:
+                reclaimable = self.find_reclaimable()
+            except Exception as e:
+                logging.error(f"[LeaseManager] Could not look for expired leases: {e}")
+                continue
+
+            if reclaimable:
+                logging.info(f"[LeaseManager] Expired leases of subscriptions {reclaimable}")
+                self.on_reclaimable(reclaimable)
+
+    def stats(self):
+        return {
+            "instance_id": self.instance_id,
+            "owned": len(self.owned),
+            "renewals": self.renewals,
+            "leases_lost": self.leases_lost,
+        }
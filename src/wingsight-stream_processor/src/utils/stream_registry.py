@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from utils.stream_url import normalize_source_url
+
+from config import SHARED_FRAME_MAX_AGE_S
+
+
+class SharedRecognitionResults:
+    """
+    Recognition results of the latest frames of a stream, computed once per (frame, key) for all subscribers.
+
+    The first caller for a key classifies without holding any lock; later callers for the same key wait for its
+    result, while other keys are classified in parallel.
+    """
+
+    # recognition results are only useful for the latest few frames
+    MAX_CACHED_RESULTS = 8
+
+    def __init__(self):
+        self.recognitions_computed = 0
+        self.recognitions_shared = 0
+
+        self._lock = threading.Lock()
+        # (frame_id, key) -> Future of the recognition result
+        self._results = OrderedDict()
+
+    def get_recognition_result(self, frame_id, classify, key=None):
+        """
+        Get the recognition result for a frame, classifying it only once for all subscribers.
+        :param frame_id: id returned by SharedStream.read_frame()
+        :param classify: callable without arguments returning the recognition result
+        :param key: optional extra key, for subscribers that classify a different view of the same frame
+        :return: recognition result dict
+        """
+
+        cache_key = (frame_id, key)
+
+        with self._lock:
+            future = self._results.get(cache_key)
+            is_first = future is None
+
+            if is_first:
+                future = Future()
+                self._results[cache_key] = future
+                while len(self._results) > self.MAX_CACHED_RESULTS:
+                    self._results.popitem(last=False)
+            else:
+                self.recognitions_shared += 1
+
+        if not is_first:
+            return future.result()
+
+        try:
+            result = classify()
+
+        except Exception as e:
+            # waiting subscribers get the error, later ones classify again
+            with self._lock:
+                if self._results.get(cache_key) is future:
+                    del self._results[cache_key]
+
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self.recognitions_computed += 1
+
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        return {
+            "recognitions_computed": self.recognitions_computed,
+            "recognitions_shared": self.recognitions_shared,
+        }
+
+
+class SharedStream:
+    """
+    One capture of a source stream, shared by every subscription to that source.
+
+    Subscriptions pull frames at their own frame_fetch_frequency. A frame read less than SHARED_FRAME_MAX_AGE_S ago
+    is handed out again instead of being read and decoded once more, and the recognition result of a frame is
+    computed once and shared by all subscriptions that got that frame (see SharedRecognitionResults).
+    """
+
+    def __init__(self, source_url, capture_session):
+        """
+        :param source_url: normalized source url
+        :param capture_session: CaptureSession (or another frame source with the same interface) for the source
+        """
+
+        self.source_url = source_url
+        self.capture_session = capture_session
+        self.subscription_ids = set()
+        # subscription id -> fetch interval in seconds
+        self.fetch_periods = {}
+
+        self.frame = None
+        self.frame_id = 0
+        self.frame_read_at = 0.0
+        self.frames_shared = 0
+
+        self.recognition_results = SharedRecognitionResults()
+
+        self._frame_lock = threading.Lock()
+        self._fetch_periods_lock = threading.Lock()
+
+    def set_fetch_period(self, subscription_id, period_s):
+        """
+        Record how often a subscription fetches frames. Frame sources that sample the stream themselves (see
+        FfmpegCaptureSession.set_sample_period) sample at the shortest interval of all subscribers.
+        """
+
+        with self._fetch_periods_lock:
+            if period_s is None:
+                self.fetch_periods.pop(subscription_id, None)
+            else:
+                self.fetch_periods[subscription_id] = period_s
+
+            if self.fetch_periods and hasattr(self.capture_session, "set_sample_period"):
+                self.capture_session.set_sample_period(min(self.fetch_periods.values()))
+
+    def needs_reopen(self):
+        return self.capture_session.needs_reopen()
+
+    def ensure_open(self):
+        """
+        Open the capture if needed. Several subscribers may ask at once; the capture is opened only by the first one.
+        :raises RuntimeError: if the stream url could not be resolved
+        """
+
+        with self._frame_lock:
+            self.capture_session.ensure_open()
+
+    def read_frame(self, position_ms=None):
+        """
+        Get the latest frame of the source, reading a new one only if the cached frame is too old.
+        :param position_ms: seek position of the requesting subscription; only honoured if it is the only subscriber
+        :return: (frame_id, frame), or (None, None) if the frame could not be read
+        """
+
+        with self._frame_lock:
+            if self.frame is not None and time.monotonic() - self.frame_read_at <= SHARED_FRAME_MAX_AGE_S:
+                self.frames_shared += 1
+                return self.frame_id, self.frame
+
+            if len(self.subscription_ids) > 1:
+                position_ms = None
+
+            frame_read_correctly, frame = self.capture_session.read(position_ms=position_ms)
+            if not frame_read_correctly:
+                return None, None
+
+            self.frame = frame
+            self.frame_id += 1
+            self.frame_read_at = time.monotonic()
+
+            return self.frame_id, self.frame
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscription_ids),
+            "frames_read": self.frame_id,
+            "frames_shared": self.frames_shared,
+            **self.recognition_results.stats(),
+            **self.capture_session.stats(),
+        }
+
+    def release(self):
+        with self._frame_lock:
+            self.capture_session.release()
+            self.frame = None
+
+
+class StreamRegistry:
+    """
+    Keeps one SharedStream per normalized source url for all subscriptions handled by this instance.
+    """
+
+    def __init__(self, create_capture_session):
+        """
+        :param create_capture_session: callable (subscription_url, logging_prefix) -> CaptureSession
+        """
+
+        self.create_capture_session = create_capture_session
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, subscription_id, subscription_url, fetch_period_s=None):
+        """
+        Register a subscription and get the shared stream of its source, opening the capture if needed.
+        :param fetch_period_s: how often the subscription fetches frames
+        :raises RuntimeError: if the stream url could not be resolved
+        """
+
+        source_url = normalize_source_url(subscription_url)
+
+        with self._lock:
+            shared_stream = self._streams.get(source_url)
+
+            if shared_stream is None:
+                capture_session = self.create_capture_session(subscription_url, f"[SharedStream {source_url}] ")
+                shared_stream = SharedStream(source_url, capture_session)
+                self._streams[source_url] = shared_stream
+
+            shared_stream.subscription_ids.add(subscription_id)
+
+        shared_stream.set_fetch_period(subscription_id, fetch_period_s)
+
+        logging.info(
+            f"[SharedStream {source_url}] Subscription {subscription_id} attached "
+            f"({len(shared_stream.subscription_ids)} subscribers)"
+        )
+
+        try:
+            shared_stream.ensure_open()
+
+        except RuntimeError:
+            self.release(subscription_id, shared_stream)
+            raise
+
+        return shared_stream
+
+    def release(self, subscription_id, shared_stream):
+        """
+        Unregister a subscription; the capture is released with its last subscriber.
+        """
+
+        shared_stream.set_fetch_period(subscription_id, None)
+
+        with self._lock:
+            shared_stream.subscription_ids.discard(subscription_id)
+
+            if shared_stream.subscription_ids:
+                return
+
+            if self._streams.get(shared_stream.source_url) is shared_stream:
+                del self._streams[shared_stream.source_url]
+
+        logging.info(f"[SharedStream {shared_stream.source_url}] Last subscriber left. Stats: {shared_stream.stats()}")
+        shared_stream.release()
@@ -0,0 +1,75 @@
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+
+
+# query params that don't change which stream is served
+IGNORED_SOURCE_URL_PARAMS = {"si", "feature", "ab_channel", "pp", "t", "fbclid", "mibextid", "ref", "ref_src"}
+
+
+def parse_stream_url_expiry(stream_url):
+    """
+    Get the expiry time of a signed live stream URL returned by yt-dlp.
+
+    YouTube (googlevideo) URLs carry the unix timestamp either as an `expire=` query param or as an `/expire/<ts>/`
+    path segment (HLS manifests). Facebook (fbcdn) URLs carry it as a hex `oe=` query param.
+
+    :param stream_url: resolved stream URL
+    :return: expiry as unix timestamp, or None if the URL is not signed with an expiry
+    """
+
+    if not stream_url:
+        return None
+
+    parsed_url = urlparse(stream_url)
+    query_params = parse_qs(parsed_url.query)
+
+    try:
+        if "expire" in query_params:
+            return float(query_params["expire"][0])
+
+        path_segments = parsed_url.path.split("/")
+        if "expire" in path_segments:
+            return float(path_segments[path_segments.index("expire") + 1])
+
+        if "oe" in query_params:
+            return float(int(query_params["oe"][0], 16))
+
+    except (ValueError, IndexError):
+        return None
+
+    return None
+
+
+def normalize_source_url(subscription_url):
+    """
+    Normalize a client-provided video url, so that different spellings of the same stream map to one key.
+
+    Lowercases scheme and host, drops `www.`/`m.` prefixes, fragments, trailing slashes and tracking params,
+    and rewrites youtu.be short links to the canonical watch url.
+
+    :param subscription_url: client-provided url of the video
+    :return: normalized url
+    """
+
+    parsed_url = urlparse(subscription_url.strip())
+
+    host = parsed_url.netloc.lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+
+    path = parsed_url.path.rstrip("/")
+    query_params = parse_qs(parsed_url.query, keep_blank_values=True)
+
+    if host == "youtu.be" and path:
+        query_params["v"] = [path.lstrip("/")]
+        host, path = "youtube.com", "/watch"
+
+    query = urlencode(
+        sorted(
+            (key, value) for key, values in query_params.items()
+            if key not in IGNORED_SOURCE_URL_PARAMS and not key.startswith("utm_")
+            for value in values
+        )
+    )
+
+    return urlunparse(((parsed_url.scheme or "https").lower(), host, path, "", query, ""))
@@ -0,0 +1,128 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+
+from utils.stream_url import parse_stream_url_expiry
+
+from config import STREAM_URL_CACHE_PATH, STREAM_URL_CACHE_DEFAULT_TTL_S, CAPTURE_URL_EXPIRY_MARGIN_S
+
+
+class StreamUrlCache:
+    """
+    Cache of resolved live stream URLs keyed by the client-provided subscription URL.
+
+    Entries are persisted to a local SQLite file, so all parser threads and restarted processes on a host share them.
+    An entry is refreshed shortly before the `expire` timestamp signed into the resolved URL; URLs without an expiry
+    are kept for a default TTL.
+    """
+
+    def __init__(self, resolve_stream_url, db_path=STREAM_URL_CACHE_PATH):
+        """
+        :param resolve_stream_url: callable that maps the client-provided url to a live stream url (e.g. via yt-dlp)
+        :param db_path: path of the SQLite file holding the cache
+        """
+
+        self.resolve_stream_url = resolve_stream_url
+        self.db_path = db_path
+
+        self._url_locks = {}
+        self._url_locks_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resolved_stream_url (
+                    subscription_url TEXT PRIMARY KEY,
+                    stream_url TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    resolved_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, so every operation uses its own short-lived one
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _get_url_lock(self, subscription_url):
+        with self._url_locks_lock:
+            return self._url_locks.setdefault(subscription_url, threading.Lock())
+
+    def _load(self, subscription_url):
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT stream_url, expires_at FROM resolved_stream_url WHERE subscription_url = ?",
+                (subscription_url,)
+            ).fetchone()
+
+    def _store(self, subscription_url, stream_url):
+        now = time.time()
+        expires_at = parse_stream_url_expiry(stream_url) or now + STREAM_URL_CACHE_DEFAULT_TTL_S
+
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO resolved_stream_url (subscription_url, stream_url, expires_at, resolved_at) "
+                "VALUES (?, ?, ?, ?)",
+                (subscription_url, stream_url, expires_at, now)
+            )
+
+    @staticmethod
+    def _is_fresh(expires_at):
+        return time.time() < expires_at - CAPTURE_URL_EXPIRY_MARGIN_S
+
+    def get(self, subscription_url):
+        """
+        Get the live stream url for a subscription url, resolving it only if the cached one is missing or expiring.
+        :param subscription_url: client-provided url of the video
+        :return: live stream url
+        :raises RuntimeError: if the url could not be resolved and there is no unexpired cached url
+        """
+
+        cached = self._load(subscription_url)
+        if cached and self._is_fresh(cached[1]):
+            self.hits += 1
+            return cached[0]
+
+        # only one thread per url resolves; others wait and pick up the stored result
+        with self._get_url_lock(subscription_url):
+            cached = self._load(subscription_url)
+            if cached and self._is_fresh(cached[1]):
+                self.hits += 1
+                return cached[0]
+
+            self.misses += 1
+
+            try:
+                stream_url = self.resolve_stream_url(subscription_url)
+
+            except RuntimeError as e:
+                # the old url is still usable until it actually expires
+                if cached and time.time() < cached[1]:
+                    logging.warning(f"[StreamUrlCache] Refresh failed for {subscription_url}, serving cached url: {e}")
+                    return cached[0]
+                raise
+
+            self._store(subscription_url, stream_url)
+
+            return stream_url
+
+    def invalidate(self, subscription_url):
+        """
+        Drop the cached url, e.g. when the capture fails to read from it.
+        """
+
+        with self._connect() as connection:
+            connection.execute("DELETE FROM resolved_stream_url WHERE subscription_url = ?", (subscription_url,))
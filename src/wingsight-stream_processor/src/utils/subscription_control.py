@@ -0,0 +1,128 @@
+import json
+import logging
+import threading
+import time
+
+import pika
+
+from config import MQ_HOST, MQ_USER, MQ_PASSWORD, CONTROL_EXCHANGE_NAME, CONTROL_CHANNEL_RECONNECT_S
+
+
+class SubscriptionState:
+    """
+    The fields of a StreamSubscription a running job needs, cached between DB reconciliations.
+    """
+
+    __slots__ = ("url", "is_active", "frame_fetch_frequency", "target_bird_species", "region_of_interest")
+
+    # fields that control events may change
+    CONTROL_FIELDS = ("frame_fetch_frequency", "target_bird_species", "region_of_interest")
+
+    def __init__(self, url, is_active, frame_fetch_frequency, target_bird_species, region_of_interest):
+        self.url = url
+        self.is_active = is_active
+        self.frame_fetch_frequency = frame_fetch_frequency
+        self.target_bird_species = target_bird_species
+        self.region_of_interest = region_of_interest
+
+    @classmethod
+    def from_model(cls, stream_subscription):
+        return cls(
+            url=stream_subscription.url,
+            is_active=stream_subscription.is_active,
+            frame_fetch_frequency=stream_subscription.frame_fetch_frequency,
+            target_bird_species=stream_subscription.target_bird_species,
+            region_of_interest=stream_subscription.region_of_interest
+        )
+
+    @property
+    def target_species(self):
+        """
+        :return: list of target species names, empty to accept any species
+        """
+
+        if not self.target_bird_species:
+            return []
+
+        try:
+            return json.loads(self.target_bird_species)
+        except json.JSONDecodeError as e:
+            logging.error(f"Error loading target species: {str(e)}")
+            return []
+
+    def apply(self, action, changes):
+        """
+        Apply a control event published by the Django app.
+        :param action: "deactivate", "reactivate", "delete" or "update"
+        :param changes: changed subscription fields
+        """
+
+        if action in ("deactivate", "delete"):
+            self.is_active = False
+        elif action == "reactivate":
+            self.is_active = True
+
+        for field in self.CONTROL_FIELDS:
+            if field in changes:
+                setattr(self, field, changes[field])
+
+
+class ControlChannelListener:
+    """
+    Consumes subscription control events from the fanout exchange in a background thread.
+
+    Every worker binds its own exclusive queue to the exchange, so each event reaches all workers. pika connections
+    aren't thread-safe, so the listener has its own connection, re-established after CONTROL_CHANNEL_RECONNECT_S if
+    it drops.
+    """
+
+    def __init__(self, on_event):
+        """
+        :param on_event: callable (subscription_id, action, changes), called from the listener thread
+        """
+
+        self.on_event = on_event
+        self.events_received = 0
+
+        self._thread = threading.Thread(target=self._run, name="control-channel", daemon=True)
+        self._thread.start()
+
+    def _handle_message(self, ch, method, properties, body):
+        try:
+            message = json.loads(body)
+            subscription_id = str(message["subscription_id"])
+            action = message["action"]
+            changes = message.get("changes", {})
+
+        except (ValueError, KeyError) as e:
+            logging.error(f"[ControlChannel] Ignoring malformed control event {body}: {e}")
+            return
+
+        self.events_received += 1
+        logging.info(f"[ControlChannel] {action} event for subscription {subscription_id}: {changes}")
+
+        try:
+            self.on_event(subscription_id, action, changes)
+
+        except Exception as e:
+            logging.error(f"[ControlChannel] Error while applying {action} event to subscription {subscription_id}: {e}")
+
+    def _run(self):
+        while True:
+            try:
+                credentials = pika.PlainCredentials(MQ_USER, MQ_PASSWORD)
+                connection = pika.BlockingConnection(pika.ConnectionParameters(MQ_HOST, credentials=credentials))
+                channel = connection.channel()
+
+                channel.exchange_declare(exchange=CONTROL_EXCHANGE_NAME, exchange_type="fanout")
+                queue_name = channel.queue_declare(queue="", exclusive=True).method.queue
+                channel.queue_bind(exchange=CONTROL_EXCHANGE_NAME, queue=queue_name)
+                channel.basic_consume(queue=queue_name, on_message_callback=self._handle_message, auto_ack=True)
+
+                logging.info("[ControlChannel] Listening for subscription control events...")
+                channel.start_consuming()
+
+            except Exception as e:
+                logging.error(f"[ControlChannel] Connection lost, reconnecting in {CONTROL_CHANNEL_RECONNECT_S}s: {e}")
+
+            time.sleep(CONTROL_CHANNEL_RECONNECT_S)
@@ -0,0 +1,232 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from config import REOPEN_BACKOFF_BASE_S, REOPEN_BACKOFF_MAX_S
+
+
+class SubscriptionScheduler:
+    """
+    Central scheduler for all subscriptions handled by this instance.
+
+    Instead of one sleeping thread per subscription, a single thread keeps a heap of next-due times and dispatches
+    due cycles to two small bounded pools: one for fetching frames and one for recognizing and persisting them.
+    Every job has at most one cycle in flight; it is rescheduled `period_s` after its cycle completes.
+
+    Starting jobs and reopening their streams can take many seconds, so it runs on a third pool; a stream that can't
+    be reopened is retried with exponential backoff instead of taking a fetch slot every cycle.
+
+    A job must provide:
+        subscription_id
+        is_running: set to False by the job to stop it
+        period_s: delay between two cycles
+        start() -> bool: prepare the job, False if it can't run
+        needs_reopen() -> bool: whether the job's source must be reopened before the next fetch
+        reopen(): reopen the job's source, raising if it can't
+        fetch() -> work or None: get the next piece of work (e.g. a frame)
+        process(work): handle the work
+        stop(): release the job's resources
+    """
+
+    def __init__(self, fetch_workers, process_workers, open_workers):
+        """
+        :param fetch_workers: max threads fetching frames
+        :param process_workers: max threads recognizing and persisting frames
+        :param open_workers: max threads starting jobs and reopening their sources
+        """
+
+        self.fetch_executor = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="fetch")
+        self.process_executor = ThreadPoolExecutor(max_workers=process_workers, thread_name_prefix="process")
+        self.open_executor = ThreadPoolExecutor(max_workers=open_workers, thread_name_prefix="open")
+
+        self.jobs = {}
+        # subscription id -> consecutive failed reopens
+        self.reopen_failures = {}
+
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self.cycles_dispatched = 0
+        self.max_dispatch_lag_s = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        """
+        Start a job. start() runs on the open pool; the first cycle is due one period later.
+        :return: False if a job of the same subscription is already scheduled
+        """
+
+        with self._condition:
+            if job.subscription_id in self.jobs:
+                logging.info(f"[Scheduler] Subscription {job.subscription_id} is already scheduled")
+                return False
+
+            self.jobs[job.subscription_id] = job
+
+        self.open_executor.submit(self._start_job, job)
+        return True
+
+    def cancel(self, subscription_id):
+        """
+        Stop a job. A job waiting for its next cycle is released right away; a job with a cycle in flight is released
+        when the cycle completes.
+        """
+
+        with self._condition:
+            job = self.jobs.get(subscription_id)
+            if job is None:
+                return
+
+            job.is_running = False
+
+            waiting = [entry for entry in self._heap if entry[2] is job]
+            if waiting:
+                self._heap = [entry for entry in self._heap if entry[2] is not job]
+                heapq.heapify(self._heap)
+
+        if waiting:
+            self._finish_job(job)
+
+    def _schedule(self, job, delay_s):
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay_s, next(self._sequence), job))
+            self._condition.notify()
+
+    def _finish_job(self, job):
+        with self._condition:
+            if self.jobs.get(job.subscription_id) is job:
+                del self.jobs[job.subscription_id]
+                self.reopen_failures.pop(job.subscription_id, None)
+
+        try:
+            job.stop()
+
+        except Exception as e:
+            logging.error(f"[Scheduler] Error while stopping subscription {job.subscription_id}: {e}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+
+                if self._stopped:
+                    return
+
+                due_at, _, job = heapq.heappop(self._heap)
+
+            self.cycles_dispatched += 1
+            self.max_dispatch_lag_s = max(self.max_dispatch_lag_s, time.monotonic() - due_at)
+
+            self.fetch_executor.submit(self._fetch, job)
+
+    def _start_job(self, job):
+        try:
+            started = job.start()
+
+        except Exception as e:
+            logging.error(f"[Scheduler] Error while starting subscription {job.subscription_id}: {e}")
+            started = False
+
+        if not started:
+            with self._condition:
+                if self.jobs.get(job.subscription_id) is job:
+                    del self.jobs[job.subscription_id]
+            return
+
+        self._schedule(job, job.period_s)
+
+    def _reopen(self, job):
+        try:
+            job.reopen()
+
+        except Exception as e:
+            failures = self.reopen_failures.get(job.subscription_id, 0) + 1
+            self.reopen_failures[job.subscription_id] = failures
+
+            delay_s = min(REOPEN_BACKOFF_MAX_S, REOPEN_BACKOFF_BASE_S * 2 ** (failures - 1))
+            logging.error(
+                f"[Scheduler] Could not reopen subscription {job.subscription_id} ({failures} failures), "
+                f"retrying in {delay_s}s: {e}"
+            )
+            self._schedule(job, delay_s)
+            return
+
+        self.reopen_failures.pop(job.subscription_id, None)
+        self._schedule(job, 0)
+
+    def _fetch(self, job):
+        if not job.is_running:
+            self._finish_job(job)
+            return
+
+        try:
+            needs_reopen = job.needs_reopen()
+        except Exception as e:
+            logging.error(f"[Scheduler] Error while checking subscription {job.subscription_id}: {e}")
+            needs_reopen = False
+
+        if needs_reopen:
+            self.open_executor.submit(self._reopen, job)
+            return
+
+        try:
+            work = job.fetch()
+
+        except Exception as e:
+            logging.error(f"[Scheduler] Error while fetching for subscription {job.subscription_id}: {e}")
+            work = None
+
+        if not job.is_running:
+            self._finish_job(job)
+            return
+
+        if work is None:
+            self._schedule(job, job.period_s)
+            return
+
+        self.process_executor.submit(self._process, job, work)
+
+    def _process(self, job, work):
+        try:
+            job.process(work)
+
+        except Exception as e:
+            logging.error(f"[Scheduler] Error while processing for subscription {job.subscription_id}: {e}")
+
+        self._schedule(job, job.period_s)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "jobs": len(self.jobs),
+                "pending_cycles": len(self._heap),
+                "cycles_dispatched": self.cycles_dispatched,
+                "max_dispatch_lag_s": round(self.max_dispatch_lag_s, 3),
+            }
+
+    def shutdown(self):
+        """
+        Stop dispatching and release all jobs.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            jobs = list(self.jobs.values())
+
+        self.open_executor.shutdown(wait=True, cancel_futures=True)
+        self.fetch_executor.shutdown(wait=True, cancel_futures=True)
+        self.process_executor.shutdown(wait=True, cancel_futures=True)
+
+        for job in jobs:
+            self._finish_job(job)